@@ -0,0 +1,305 @@
+# 策略热点路径基准测试
+#
+# 用 synthetic.py 生成的合成数据，在不同股票数 (300 / 1000 / 5000) 与历史长度
+# (1年日线 / 10年日线 / 分钟线) 下测量各环节的耗时 (多次运行取最短) 与峰值内存 (tracemalloc)：
+#   dma.*            01 双均线：单只股票 generate_signals、全市场面板信号、流式增量信号
+#   rank.*           03 多因子：fillNan、getRank、bubble、composite_score + select_top_n
+#   breadth.*        02 市场宽度：MarketBreadth 逐日推入全部历史
+#   filters.*        02 批量过滤流水线 filter_stock_batch（经 ptrade_local 本地API）
+#   stirrers.*       02 选股 get_stock_list（市场宽度、市场环境、小市值筛选全流程）
+#   multi_factor.*   03 停牌筛选 set_feasible_stocks
+# 结果可与保存的基准 (baseline.json) 比较，耗时或内存超过阈值时标记为退化并以非0状态退出。
+# 完全离线运行。
+#
+# 使用示例：
+#   python benchmarks/run_benchmarks.py                                 # 全部环节，与 baseline.json 比较
+#   python benchmarks/run_benchmarks.py --sizes 300,1000 --histories 1y --stages rank
+#   python benchmarks/run_benchmarks.py --save-baseline                 # 在本机重新生成基准
+
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from synthetic import HISTORIES, SIZES, SW1, make_local_data, make_market
+
+from ptrade_local import PTradeRuntime
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STRATEGIES = os.path.join(HERE, '..', 'strategies')
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+
+def _load_module(filename, name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(STRATEGIES, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _runtime(filename, data, day):
+    """加载 PTrade 策略到本地运行时，并把当前时间设为第 day 个交易日的 9:05"""
+    runtime = PTradeRuntime(os.path.join(STRATEGIES, filename), data)
+    runtime._t = day
+    runtime.context.previous_date = data.dates[day - 1].item()
+    runtime.context.blotter.current_dt = pd.Timestamp(data.dates[day]).to_pydatetime().replace(hour=9, minute=5)
+    runtime.namespace['initialize'](runtime.context)
+    return runtime
+
+
+# ----------------------------------------------------------------------
+# 各环节：setup(环境) -> 被计时的无参函数
+# ----------------------------------------------------------------------
+def dma_generate_signals(env):
+    dma = env.dma.DualMovingAverageStrategy()
+    frame = pd.DataFrame({'Close': env.market['close'][:, 0]}, index=env.market['dates']).dropna()
+    return lambda: dma.generate_signals(frame)
+
+
+def dma_panel_signals(env):
+    dma = env.dma.DualMovingAverageStrategy()
+    return lambda: dma.generate_panel_signals(env.market['close'])
+
+
+def dma_stream(env):
+    close = env.market['close']
+
+    def run():
+        stream = env.dma.DualMovingAverageStream(close.shape[1])
+        for row in close:
+            stream.update(row)
+    return run
+
+
+def _factors(env, n_factors=2):
+    rng = np.random.default_rng(1)
+    m = rng.lognormal(0, 1, (env.size, n_factors))
+    m[rng.random(m.shape) < 0.05] = np.nan
+    return m
+
+
+def rank_fill_nan(env):
+    m = _factors(env)
+    return lambda: env.mf['fillNan'](m.copy())
+
+
+def rank_get_rank(env):
+    m = _factors(env)
+    env.mf['fillNan'](m)
+    return lambda: env.mf['getRank'](m)
+
+
+def rank_bubble(env):
+    scores = np.random.default_rng(2).random(env.size)
+    codes = env.market['codes']
+    return lambda: env.mf['bubble'](scores.copy(), list(codes))
+
+
+def rank_select_top_n(env):
+    m = _factors(env)
+    env.mf['fillNan'](m)
+    ranks = env.mf['getRank'](m)
+    codes = env.market['codes']
+    return lambda: env.mf['select_top_n'](env.mf['composite_score'](ranks, [[1], [-1]]), codes, 20)
+
+
+def breadth_update_many(env):
+    engine_cls = env.stirrers['MarketBreadth']
+    industry = np.random.default_rng(3).integers(0, len(SW1), env.size).astype(np.int32)
+    close = env.market['close']
+    return lambda: engine_cls(industry, SW1, window=20).update_many(close)
+
+
+def filters_filter_stock_batch(env):
+    runtime = _runtime('02_four_stirrers_ptrade.py', env.data, len(env.data.dates) - 1)
+    ns = runtime.namespace
+    stocks = env.market['codes']
+
+    def run():
+        ns['_daily_cache']['date'] = None
+        ns['reset_daily_cache'](runtime.context)
+        return ns['filter_stock_batch'](runtime.context, stocks, paused=True, st=True, new=True,
+                                        limitup=True, limitdown=True)
+    return run
+
+
+def stirrers_get_stock_list(env):
+    runtime = _runtime('02_four_stirrers_ptrade.py', env.data, len(env.data.dates) - 1)
+    ns = runtime.namespace
+
+    def run():
+        # 每次都从空缓存开始，测量完整的冷启动路径
+        ns['_daily_cache']['date'] = None
+        ns['reset_daily_cache'](runtime.context)
+        ns['_breadth_state'].update(engine=None, stocks=None, last_date=None)
+        ns['_market_env_classifiers'].clear()
+        ns['_fundamentals_cache'].clear()
+        return ns['get_stock_list'](runtime.context)
+    return run
+
+
+def multi_factor_set_feasible_stocks(env):
+    runtime = _runtime('03_multi_factor.py', env.data, len(env.data.dates) - 1)
+    ns = runtime.namespace
+    stocks = env.market['codes']
+
+    def run():
+        ns['_suspension_screener'] = ns['SuspensionScreener']()
+        ns['g'].t = len(env.data.dates) - 1
+        return ns['set_feasible_stocks'](stocks, 63, runtime.context)
+    return run
+
+
+# (名称, 函数, 适用的历史长度, 是否随股票数变化)
+STAGES = [
+    ('dma.generate_signals', dma_generate_signals, ('1y', '10y', 'minute'), False),
+    ('dma.panel_signals', dma_panel_signals, ('1y', '10y', 'minute'), True),
+    ('dma.stream', dma_stream, ('1y', '10y', 'minute'), True),
+    ('rank.fillNan', rank_fill_nan, ('1y',), True),
+    ('rank.getRank', rank_get_rank, ('1y',), True),
+    ('rank.bubble', rank_bubble, ('1y',), True),
+    ('rank.select_top_n', rank_select_top_n, ('1y',), True),
+    ('breadth.update_many', breadth_update_many, ('1y', '10y'), True),
+    ('filters.filter_stock_batch', filters_filter_stock_batch, ('1y',), True),
+    ('stirrers.get_stock_list', stirrers_get_stock_list, ('1y',), True),
+    ('multi_factor.set_feasible_stocks', multi_factor_set_feasible_stocks, ('1y',), True),
+]
+
+# 依赖本地运行时 (LocalData) 的环节
+RUNTIME_STAGES = {'filters.filter_stock_batch', 'stirrers.get_stock_list', 'multi_factor.set_feasible_stocks'}
+
+
+class Env:
+    """一组 (股票数, 历史长度) 的合成数据与已加载的策略模块"""
+
+    def __init__(self, size, history, with_runtime):
+        freq, n_bars = HISTORIES[history]
+        self.size = size
+        self.history = history
+        self.market = make_market(size, n_bars, freq)
+        self.data = make_local_data(size, n_bars) if with_runtime else None
+        self.dma = _load_module('01_dual_moving_average.py', 'dual_moving_average')
+        self.mf = self._namespace('03_multi_factor.py')
+        self.stirrers = self._namespace('02_four_stirrers_ptrade.py')
+
+    @staticmethod
+    def _namespace(filename):
+        """只加载策略中的函数与类 (不访问平台API)"""
+        path = os.path.join(STRATEGIES, filename)
+        namespace = {'__name__': 'benchmark', '__file__': path}
+        with open(path, encoding='utf-8') as f:
+            exec(compile(f.read(), path, 'exec'), namespace)
+        return namespace
+
+
+def measure(func, repeat=3):
+    """返回 (最短耗时秒, 峰值内存MB)"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak / 2 ** 20
+
+
+def run(sizes, histories, stage_filter=None, repeat=3):
+    """运行选中的环节，返回结果表 (stage, history, size, seconds, peak_mb)"""
+    rows = []
+    for history in histories:
+        for size in sizes:
+            stages = [s for s in STAGES if history in s[2] and (not stage_filter or any(k in s[0] for k in stage_filter))]
+            if size != sizes[0]:
+                stages = [s for s in stages if s[3]]
+            if not stages:
+                continue
+            env = Env(size, history, with_runtime=any(s[0] in RUNTIME_STAGES for s in stages))
+            for name, setup, _, scales in stages:
+                seconds, peak = measure(setup(env), repeat)
+                row = {'stage': name, 'history': history, 'size': size if scales else 1,
+                       'seconds': seconds, 'peak_mb': peak}
+                rows.append(row)
+                print(f"{name:36s} {history:>6s} {row['size']:>6d}  {seconds * 1e3:10.2f} ms  {peak:9.1f} MB", flush=True)
+            del env
+            gc.collect()
+    return pd.DataFrame(rows)
+
+
+def _key(row):
+    return f"{row['stage']}|{row['history']}|{row['size']}"
+
+
+def compare(results, baseline, threshold=0.2):
+    """与基准比较，增加 base_seconds / time_ratio / base_peak_mb / mem_ratio / regression 列"""
+    results = results.copy()
+    base = [baseline.get(_key(row), {}) for _, row in results.iterrows()]
+    results['base_seconds'] = [b.get('seconds', np.nan) for b in base]
+    results['base_peak_mb'] = [b.get('peak_mb', np.nan) for b in base]
+    results['time_ratio'] = results['seconds'] / results['base_seconds']
+    results['mem_ratio'] = results['peak_mb'] / results['base_peak_mb']
+    results['regression'] = (results['time_ratio'] > 1 + threshold) | (results['mem_ratio'] > 1 + threshold)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='策略热点路径基准测试 (离线)')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='股票数，逗号分隔')
+    parser.add_argument('--histories', default=','.join(HISTORIES), help='历史长度：1y,10y,minute')
+    parser.add_argument('--stages', default=None, help='只运行名称包含这些关键字的环节，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=3, help='计时重复次数 (取最短)')
+    parser.add_argument('--baseline', default=BASELINE, help='基准文件')
+    parser.add_argument('--threshold', type=float, default=0.2, help='退化阈值 (0.2 表示慢/大 20%%)')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果写入基准文件')
+    parser.add_argument('--out', default=None, help='结果表 CSV 路径')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    histories = args.histories.split(',')
+    stage_filter = args.stages.split(',') if args.stages else None
+    results = run(sizes, histories, stage_filter, args.repeat)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        for _, row in results.iterrows():
+            baseline[_key(row)] = {'seconds': round(row['seconds'], 6), 'peak_mb': round(row['peak_mb'], 3)}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+        print(f"基准已写入 {args.baseline}")
+        return 0
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    results = compare(results, baseline, args.threshold)
+    if args.out:
+        results.to_csv(args.out, index=False)
+
+    regressions = results[results['regression']]
+    if len(regressions):
+        print(f"\n发现 {len(regressions)} 项退化 (阈值 {args.threshold:.0%}):")
+        print(regressions[['stage', 'history', 'size', 'seconds', 'base_seconds', 'time_ratio',
+                           'peak_mb', 'base_peak_mb', 'mem_ratio']].to_string(index=False))
+        return 1
+    print(f"\n未发现退化 (阈值 {args.threshold:.0%}，共比较 {results['base_seconds'].notna().sum()} 项)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+# 基准测试用的合成数据
+#
+# 按给定的股票数与K线数生成随机游走行情（含停牌、ST、次新股、行业、指数成分和财务数据），
+# 固定随机种子，结果可复现，不依赖任何外部数据源。
+#
+# 使用示例：
+#   market = make_market(1000, 2440)              # 1000只股票 x 10年日线 (numpy矩阵)
+#   data = make_local_data(1000, 244)             # 同样的数据包装为 ptrade_local.LocalData
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'strategies'))
+
+from ptrade_local import LocalData  # noqa: E402
+
+
+# 历史长度：(频率, K线数)
+HISTORIES = {
+    '1y': ('1d', 244),
+    '10y': ('1d', 2440),
+    'minute': ('1m', 20 * 240),
+}
+
+SIZES = (300, 1000, 5000)
+
+# 申万一级行业代码 (与 02_four_stirrers_ptrade.py 的 industry_code 一致)
+SW1 = ['801010', '801020', '801030', '801040', '801050', '801080', '801110', '801120', '801130', '801140', '801150',
+       '801160', '801170', '801180', '801200', '801210', '801230', '801710', '801720', '801730', '801740', '801750',
+       '801760', '801770', '801780', '801790', '801880', '801890']
+
+# 市场环境判断用到的指数
+INDEXES = ['000001.SS', '399001.SZ', '399986.SZ']
+
+
+def make_codes(n_stocks):
+    """生成股票代码，沪深各半"""
+    sh = [f'{600000 + i:06d}.SS' for i in range((n_stocks + 1) // 2)]
+    sz = [f'{1 + i:06d}.SZ' for i in range(n_stocks // 2)]
+    return sh + sz
+
+
+def make_dates(n_bars, freq='1d'):
+    """生成交易时间轴：日线为工作日，分钟线为每天240根 (9:31-11:30, 13:01-15:00)"""
+    if freq == '1d':
+        return pd.bdate_range('2010-01-04', periods=n_bars).values
+    days = pd.bdate_range('2024-01-02', periods=-(-n_bars // 240))
+    minutes = np.r_[np.arange(9 * 60 + 31, 11 * 60 + 31), np.arange(13 * 60 + 1, 15 * 60 + 1)]
+    stamps = (days.values[:, None] + pd.to_timedelta(minutes, unit='m').values[None, :]).ravel()
+    return stamps[:n_bars]
+
+
+def make_market(n_stocks, n_bars, freq='1d', seed=0, suspend_rate=0.002):
+    """
+    生成随机游走行情矩阵
+
+    返回:
+        dict: dates, codes, open/high/low/close/volume/money (K线数, 股票数)；停牌K线为NaN
+    """
+    rng = np.random.default_rng(seed)
+    sigma = 0.02 if freq == '1d' else 0.002
+    log_ret = rng.normal(0.0002, sigma, (n_bars, n_stocks))
+    close = 10.0 * np.exp(np.cumsum(log_ret, axis=0)) * rng.uniform(0.5, 5.0, n_stocks)
+    open_ = close * np.exp(rng.normal(0, sigma / 3, close.shape))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, sigma / 2, close.shape)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, sigma / 2, close.shape)))
+    volume = rng.lognormal(13, 1, close.shape).round(-2)
+
+    # 停牌：每次停牌持续1-10根K线
+    starts = np.argwhere(rng.random(close.shape) < suspend_rate)
+    for t, j in starts:
+        close[t:t + rng.integers(1, 11), j] = np.nan
+    suspended = np.isnan(close)
+    for arr in (open_, high, low):
+        arr[suspended] = np.nan
+    volume[suspended] = 0.0
+
+    return {
+        'dates': make_dates(n_bars, freq),
+        'codes': make_codes(n_stocks),
+        'open': open_, 'high': high, 'low': low, 'close': close,
+        'volume': volume, 'money': volume * np.nan_to_num(close),
+    }
+
+
+def make_local_data(n_stocks, n_days, seed=0):
+    """生成日线 LocalData（含指数、股票信息、行业、指数成分与季度财务数据）"""
+    rng = np.random.default_rng(seed + 1)
+    market = make_market(n_stocks, n_days, '1d', seed)
+    codes = market['codes'] + INDEXES
+    dates = np.asarray(market['dates'], dtype='datetime64[D]')
+
+    bars = {}
+    for field in ('open', 'high', 'low', 'close', 'volume', 'money'):
+        index_bars = make_market(len(INDEXES), n_days, '1d', seed + 2, suspend_rate=0)[field]
+        if field in ('volume', 'money'):
+            index_bars = index_bars * 1000
+        bars[field] = np.hstack([market[field], index_bars])
+
+    stocks = market['codes']
+    listed = dates[0] - rng.integers(0, 3000, n_stocks).astype('timedelta64[D]')
+    recent = rng.random(n_stocks) < 0.05
+    listed[recent] = dates[-1] - rng.integers(0, 300, recent.sum()).astype('timedelta64[D]')
+    names = np.where(rng.random(n_stocks) < 0.03, [f'ST股票{i}' for i in range(n_stocks)],
+                     [f'股票{i}' for i in range(n_stocks)])
+    stock_frame = pd.DataFrame({'code': stocks, 'name': names, 'listed_date': pd.to_datetime(listed).strftime('%Y-%m-%d')})
+
+    industries = pd.DataFrame({'industry': np.array(SW1)[rng.integers(0, len(SW1), n_stocks)], 'code': stocks})
+    small = [stocks[i] for i in np.flatnonzero(rng.random(n_stocks) < 0.5)]
+    index_members = pd.DataFrame({
+        'date': pd.Timestamp(dates[0]).strftime('%Y-%m-%d'),
+        'index': ['000985.XBHS'] * n_stocks + ['399101.XBHS'] * len(small) + ['000300.SS'] * min(n_stocks, 300),
+        'code': stocks + small + stocks[:300],
+    })
+
+    # 季度公告的财务数据
+    quarters = pd.date_range(pd.Timestamp(dates[0]) - pd.Timedelta(days=120), pd.Timestamp(dates[-1]), freq='QS')
+    announce = np.repeat(quarters.strftime('%Y-%m-%d').values, n_stocks)
+    code_col = np.tile(stocks, len(quarters))
+    size = len(announce)
+    fundamentals = {
+        'profit_ability': pd.DataFrame({'date': announce, 'code': code_col,
+                                        'roe': rng.normal(10, 8, size), 'roa': rng.normal(6, 5, size)}),
+        'valuation': pd.DataFrame({'date': announce, 'code': code_col,
+                                   'total_value': rng.lognormal(23, 1, size), 'roe': rng.normal(10, 8, size)}),
+    }
+
+    return LocalData(dates, codes, bars, stocks=stock_frame, index_members=index_members,
+                     industries=industries, fundamentals=fundamentals)
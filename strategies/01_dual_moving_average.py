@@ -1,5 +1,91 @@
 import pandas as pd
 import numpy as np
+from collections import namedtuple
+
+
+def _rolling_mean(values, windows):
+    """
+    对一条价格序列按窗口逐个计算 rolling(window, min_periods=1).mean()
+    窗口内跳过 NaN，全为 NaN 时结果为 NaN；与 generate_signals 使用同一 pandas 实现，结果逐位相同
+
+    输入: values 一维价格序列, windows 窗口列表
+    输出: 形状为 (len(windows), len(values)) 的 float64 数组
+    """
+    series = pd.Series(np.asarray(values, dtype=np.float64))
+    out = np.empty((len(windows), len(series)), dtype=np.float64)
+    for i, w in enumerate(windows):
+        out[i] = series.rolling(window=int(w), min_periods=1).mean().to_numpy()
+    return out
+
+
+def _compact_rolling_mean(values, windows):
+    """
+    对 (K线, 股票) 矩阵的每一列计算滚动均值 (前 window-1 根按已有K线数平均)
+
+    逐根K线推进、每步对全部股票向量化，运算顺序与 pandas rolling().mean() 相同：
+    先移出滑出窗口的旧值、再加入新值，两步各自做 Kahan 补偿；整个窗口价格相同时
+    均线直接取该价格。因此与逐列 rolling(window, min_periods=1).mean() 逐位相同，
+    长短均线理论上相等时不会因累加和的舍入误差判出大小。
+    要求有效K线连续排在每列前部 (见 generate_panel_signals 的紧凑矩阵)，其后的结果无意义
+
+    输入: values (K线数, 股票数), windows 窗口列表
+    输出: 形状为 (len(windows), K线数, 股票数) 的 float64 数组
+    """
+    n_bars, n_cols = values.shape
+    windows = np.asarray(windows, dtype=np.int64)
+    full = windows[:, None]
+    longest = int(windows.max())
+    total, comp_add, comp_remove, y, t = np.zeros((5, len(windows), n_cols))
+    run = np.zeros(n_cols)
+    same = np.zeros(n_cols, dtype=bool)
+    last = np.full(n_cols, np.nan)
+    out = np.empty((len(windows), n_bars, n_cols), dtype=np.float64)
+
+    for i in range(n_bars):
+        x = values[i]
+        # 移出 i-window 处的旧值；窗口未满时移出 0，补偿为 0，滚动和不变
+        np.negative(values[np.maximum(i - windows, 0)], out=y)
+        if i < longest:
+            y[i < windows] = 0.0
+        y -= comp_remove
+        np.add(total, y, out=t)
+        np.subtract(t, total, out=comp_remove)
+        comp_remove -= y
+        # 加入新值
+        np.subtract(x, comp_add, out=y)
+        np.add(t, y, out=total)
+        np.subtract(total, t, out=comp_add)
+        comp_add -= y
+        # 连续相同价格的根数
+        np.equal(x, last, out=same)
+        run *= same
+        run += 1
+        last = x
+
+        nobs = np.minimum(i + 1, full)
+        mavg = out[:, i]
+        np.divide(total, nobs, out=mavg)
+        np.copyto(mavg, x, where=run >= nobs)
+    return out
+
+
+def _as_panel(close):
+    """
+    将收盘价整理为 (日期, 股票) 的连续 float64 矩阵
+    支持宽表 (index=日期, columns=股票)、长表 (date, code, close 三列) 或 numpy 数组
+    """
+    if isinstance(close, pd.DataFrame):
+        if 'code' in close.columns:
+            price_col = 'close' if 'close' in close.columns else 'Close'
+            close = close.pivot(index='date', columns='code', values=price_col)
+        values = np.ascontiguousarray(close.to_numpy(dtype=np.float64))
+        return close.index, close.columns, values
+    values = np.ascontiguousarray(close, dtype=np.float64)
+    return pd.RangeIndex(values.shape[0]), pd.RangeIndex(values.shape[1]), values
+
+
+PanelSignals = namedtuple('PanelSignals', ['index', 'columns', 'signal', 'positions', 'short_mavg', 'long_mavg'])
+
 
 class DualMovingAverageStrategy:
     """
@@ -29,15 +115,179 @@ class DualMovingAverageStrategy:
 
         # 2. 生成信号 (1为买入状态, 0为持币状态)
         # 注意：这里我们使用 np.where 做向量化计算，提高回测速度
-        signals['signal'][self.short_window:] = np.where(
-            signals['short_mavg'][self.short_window:] > signals['long_mavg'][self.short_window:], 1.0, 0.0
-        )   
+        # (按位置整体赋值，避免链式赋值在 pandas Copy-on-Write 下失效)
+        signal = np.where(signals['short_mavg'] > signals['long_mavg'], 1.0, 0.0)
+        signal[:self.short_window] = 0.0
+        signals['signal'] = signal
 
         # 3. 生成买卖指令 (signal差分: 1为买入, -1为卖出)
         signals['positions'] = signals['signal'].diff()
 
         return signals
 
+    @staticmethod
+    def sweep_signals(data, window_pairs):
+        """
+        多参数扫描：一次计算整组 (short_window, long_window) 的信号
+        每个不同的窗口只计算一次均值，由共用该窗口的参数组共享
+
+        输入: 包含 'Close' 列的 DataFrame, 窗口参数对列表 [(short, long), ...]
+        输出: (signals, positions) 两个 int8 数组，形状均为 (参数组数, K线数)
+              逐行与 generate_signals 的 'signal' / 'positions' 列一致 (positions 首根记为 0)
+        """
+        pairs = np.asarray(window_pairs, dtype=np.int64).reshape(-1, 2)
+        windows, inverse = np.unique(pairs, return_inverse=True)
+        inverse = inverse.reshape(pairs.shape)
+
+        mavg = _rolling_mean(data['Close'].to_numpy(), windows)
+        short_mavg = mavg[inverse[:, 0]]
+        long_mavg = mavg[inverse[:, 1]]
+
+        # 1为买入状态, 0为持币状态；前 short_window 根K线不产生信号
+        bars = np.arange(mavg.shape[1])
+        signals = ((short_mavg > long_mavg) & (bars >= pairs[:, :1])).astype(np.int8)
+
+        # signal差分: 1为买入, -1为卖出
+        positions = np.zeros_like(signals)
+        positions[:, 1:] = np.diff(signals, axis=1)
+
+        return signals, positions
+
+    def generate_panel_signals(self, close, return_mavg=False):
+        """
+        面板模式：对全部股票一次向量化计算均线、持仓状态和买卖指令
+
+        停牌日 (收盘价为 NaN) 不计入均线窗口，结果与对每只股票 dropna() 后
+        单独调用 generate_signals 一致；停牌期间沿用停牌前的持仓状态，
+        复牌当根K线才产生交叉指令
+
+        输入: 宽表 (日期 x 股票) 或长表 (date, code, close) 或二维数组
+        输出: PanelSignals，其中 signal / positions 为 int8 矩阵 (日期 x 股票)；
+              return_mavg=True 时附带 short_mavg / long_mavg (停牌日为 NaN)
+        """
+        index, columns, values = _as_panel(close)
+        n_bars = values.shape[0]
+        missing = np.isnan(values)
+
+        # 1. 把每只股票的有效K线按时间顺序前移，得到"交易日"坐标下的紧凑矩阵
+        order = np.argsort(missing, axis=0, kind='stable')
+        compact = np.take_along_axis(values, order, axis=0)
+        bar = np.arange(n_bars)[:, None]
+        in_range = bar < (~missing).sum(axis=0)
+
+        # 2. 紧凑坐标下逐根推进两条均线 (与 pandas rolling().mean() 逐位相同)
+        short_mavg, long_mavg = _compact_rolling_mean(compact, [self.short_window, self.long_window])
+
+        # 3. 紧凑坐标下生成信号与买卖指令
+        signal = ((short_mavg > long_mavg) & (bar >= self.short_window) & in_range).astype(np.int8)
+        positions = np.zeros_like(signal)
+        positions[1:] = np.diff(signal, axis=0)
+
+        # 4. 还原到日历坐标：停牌日沿用上一有效K线的状态，指令记为 0
+        full_signal = np.zeros_like(signal)
+        full_positions = np.zeros_like(positions)
+        np.put_along_axis(full_signal, order, signal, axis=0)
+        np.put_along_axis(full_positions, order, np.where(in_range, positions, 0), axis=0)
+        last_valid = np.maximum.accumulate(np.where(missing, -1, bar), axis=0)
+        full_signal = np.where(last_valid >= 0, np.take_along_axis(full_signal, np.maximum(last_valid, 0), axis=0), 0)
+        full_signal = full_signal.astype(np.int8)
+
+        full_short = full_long = None
+        if return_mavg:
+            full_short = np.full_like(values, np.nan)
+            full_long = np.full_like(values, np.nan)
+            np.put_along_axis(full_short, order, np.where(in_range, short_mavg, np.nan), axis=0)
+            np.put_along_axis(full_long, order, np.where(in_range, long_mavg, np.nan), axis=0)
+
+        return PanelSignals(index, columns, full_signal, full_positions, full_short, full_long)
+
+class DualMovingAverageStream:
+    """
+    双均线策略的流式 (逐K线) 版本，用于盘中与实盘
+
+    每只股票维护一个长度为 max(short_window, long_window) 的环形缓冲区和两条均线的
+    滚动和，每根新K线 O(1) 更新并立即给出金叉/死叉指令。状态全部保存在按股票对齐的
+    numpy 数组中，可同时跟踪数千只股票。
+
+    滚动和按 pandas rolling().mean() 的方式累加：加入与移出各自带 Kahan 补偿，并记录
+    连续相同收盘价的根数，整个窗口价格相同时均线直接取该价格。因此平盘、一字板等
+    长短均线理论上相等的情形也与 generate_signals 逐根一致，不会因舍入误差产生假金叉。
+    收盘价为 NaN 视为停牌，不推进该股票的窗口 (与 generate_panel_signals 相同)
+    """
+
+    __slots__ = ('short_window', 'long_window', 'n_symbols', '_capacity', '_buffer',
+                 '_count', '_windows', '_kahan', '_last', '_run',
+                 'short_mavg', 'long_mavg', 'signal')
+
+    def __init__(self, n_symbols=1, short_window=20, long_window=60):
+        self.short_window = short_window
+        self.long_window = long_window
+        self.n_symbols = n_symbols
+        self._capacity = max(short_window, long_window)
+        self._buffer = np.zeros((n_symbols, self._capacity), dtype=np.float64)
+        self._count = np.zeros(n_symbols, dtype=np.int64)
+        # 滚动和及加入/移出两路补偿: _kahan[0|1|2] = 和 / 加入补偿 / 移出补偿，
+        # 每项的第 0 行为短均线、第 1 行为长均线
+        self._windows = np.array([[short_window], [long_window]], dtype=np.int64)
+        self._kahan = np.zeros((3, 2, n_symbols), dtype=np.float64)
+        self._last = np.full(n_symbols, np.nan)
+        self._run = np.zeros(n_symbols, dtype=np.int64)
+        self.short_mavg = np.full(n_symbols, np.nan)
+        self.long_mavg = np.full(n_symbols, np.nan)
+        self.signal = np.zeros(n_symbols, dtype=np.int8)
+
+    def update(self, closes):
+        """
+        推入每只股票的最新收盘价
+
+        输入: 长度为 n_symbols 的收盘价 (单只股票时可直接传标量)
+        输出: int8 数组，1 为金叉买入, -1 为死叉卖出, 0 为无指令
+        """
+        closes = np.asarray(closes, dtype=np.float64).reshape(self.n_symbols)
+        positions = np.zeros(self.n_symbols, dtype=np.int8)
+        active = np.flatnonzero(~np.isnan(closes))
+        if len(active) == 0:
+            return positions
+        if len(active) == self.n_symbols:
+            active = slice(None)    # 全部有价时用切片视图，省去花式索引的拷贝
+
+        x = closes[active]
+        count = self._count[active]
+        rows = np.arange(self.n_symbols)[active]
+
+        # 1. 滚动和：先减去滑出窗口的旧值 (仍在环形缓冲区中)，再加入新值，两步各自做
+        #    Kahan 补偿，运算顺序与 pandas 的 roll_mean 相同。窗口未满时取到的是尚未写入的
+        #    0 槽位，且此前从未移出过 (移出补偿为 0)，这一步恰好不改变滚动和与补偿
+        total, comp_add, comp_remove = self._kahan[:, :, active]
+        out = self._buffer[rows, (count - self._windows) % self._capacity]
+        y = -out - comp_remove
+        t = total + y
+        comp_remove = t - total - y
+        y = x - comp_add
+        total = t + y
+        comp_add = total - t - y
+        self._kahan[:, :, active] = (total, comp_add, comp_remove)
+        self._buffer[rows, count % self._capacity] = x
+
+        run = self._run[active] * (x == self._last[active]) + 1
+        self._run[active] = run
+        self._last[active] = x
+        count = count + 1
+        self._count[active] = count
+
+        # 2. 均线与持仓状态 (前 short_window 根K线不产生信号)
+        nobs = np.minimum(count, self._windows)
+        short_mavg, long_mavg = np.where(run >= nobs, x, total / nobs)
+        self.short_mavg[active] = short_mavg
+        self.long_mavg[active] = long_mavg
+        signal = ((short_mavg > long_mavg) & (count > self.short_window)).astype(np.int8)
+
+        # 3. 买卖指令
+        positions[active] = signal - self.signal[active]
+        self.signal[active] = signal
+        return positions
+
+
 if __name__ == "__main__":
     # 模拟数据生成 (仅供示例运行)
     print("正在加载模拟数据...")
@@ -15,7 +15,12 @@
 import numpy as np
 import pandas as pd
 import datetime 
+import functools
+import heapq
+import time
 import talib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 # 申万一级行业代码映射
 SW1 = {
@@ -70,8 +75,10 @@ def initialize(context):
     # 设定基准 (PTrade: 指数代码用.SS或.XBHS)
     set_benchmark('000985.SS')
     
-    # 设置佣金 (PTrade语法)
-    set_commission(commission_ratio=0.0003, min_commission=5.0)
+    # 设置佣金 (PTrade语法)，调仓计划按同样的费率估算成本
+    g.commission_ratio = 0.0003
+    g.min_commission = 5.0
+    set_commission(commission_ratio=g.commission_ratio, min_commission=g.min_commission)
     
     # 设置滑点 (PTrade语法)
     set_fixed_slippage(fixedslippage=0.0)
@@ -82,21 +89,42 @@ def initialize(context):
     g.yesterday_HL_list = []  # 记录持仓中昨日涨停的股票
     g.num = 1
     
+    # 可调参数 (本地参数扫描见 sweep_four_stirrers.py)
+    g.breadth_window = 20     # 市场宽度：收盘价站上均线的均线窗口
+    g.env_ma_window = 20      # 市场环境：成交额均线窗口 / 银行指数涨幅窗口
+    g.env_slope_window = 5    # 市场环境：成交额均线变化率窗口
+    g.turnover_cut = 0.1      # 市场环境：成交额均线变化率阈值
+    g.bank_cut = 0.9          # 市场环境：银行指数涨幅阈值
+    g.roe_min = 15            # 小市值筛选：ROE下限 (%)
+    g.roa_min = 10            # 小市值筛选：ROA下限 (%)
+    
+    # 并发数据请求：并发数 / 单次超时 (秒) / 重试次数 / 首次重试等待 (秒) / 每次请求的股票数
+    g.fetch_workers = 16
+    g.fetch_timeout = 10.0
+    g.fetch_retries = 2
+    g.fetch_backoff = 0.2
+    g.fetch_chunk_size = 500
+    
     # 设置股票池 (PTrade必须调用)
     set_universe([])
     
     # 设置交易运行时间 (PTrade语法: run_daily需要context参数)
     run_daily(context, prepare_stock_list, time='9:05')
-    # PTrade没有run_weekly，使用run_daily配合星期判断
+    # PTrade没有run_weekly，使用run_daily配合交易日历判断每周首个交易日
     run_daily(context, weekly_adjustment_wrapper, time='9:30')
+    # 实盘用 run_interval 盘中轮询涨停板，开板即卖；14:00 的检查作为兜底 (回测中 run_interval 不生效)
+    g.limit_monitor_seconds = 3
+    # 盘中行情缓存有效期 (秒)：过滤、调仓与涨停检查在有效期内共用一次请求的结果
+    g.quote_ttl = 3
+    if is_trade():
+        run_interval(context, monitor_limit_up, seconds=g.limit_monitor_seconds)
     run_daily(context, check_limit_up, time='14:00')
 
 
 def weekly_adjustment_wrapper(context):
-    """每周一执行调仓的包装函数"""
+    """每周首个交易日执行调仓的包装函数（周一休市时顺延到当周第一个交易日）"""
     today = get_trading_day(context)
-    # weekday() == 0 表示周一
-    if today.weekday() == 0:
+    if get_calendar(today).is_first_of_week(today):
         weekly_adjustment(context)
 
 
@@ -105,19 +133,131 @@ def get_trading_day(context):
     return context.blotter.current_dt.date()
 
 
+class TradingCalendar:
+    """
+    交易日历
+    
+    全部交易日保存为有序的 int32 yyyymmdd 数组，另按自然日序号建一张查找表
+    (自然日 -> 当日或之前最近一个交易日的下标)，前后交易日、向前/向后偏移 n 个交易日都是 O(1) 查表；
+    每周、每月首个交易日的标记预先算好。查询接受 date / datetime / int yyyymmdd，不解析字符串
+    """
+    
+    def __init__(self, trade_days):
+        dates = sorted({self._as_date(d) for d in trade_days})
+        self.days = np.array([d.year * 10000 + d.month * 100 + d.day for d in dates], dtype=np.int32)
+        self._dates = dates
+        self._text = [str(day) for day in self.days]
+        ordinals = np.array([d.toordinal() for d in dates], dtype=np.int64)
+        self._base = int(ordinals[0])
+        offsets = ordinals - self._base
+        # 自然日序号 -> 当日或之前最近交易日的下标；该日是否为交易日
+        self._floor = (np.searchsorted(offsets, np.arange(offsets[-1] + 1), side='right') - 1).astype(np.int32)
+        self._is_trade = np.zeros(offsets[-1] + 1, dtype=bool)
+        self._is_trade[offsets] = True
+        # 每周 (周一为一周开始)、每月首个交易日
+        week = (ordinals - 1) // 7
+        month = self.days // 100
+        self.first_of_week = np.r_[True, week[1:] != week[:-1]]
+        self.first_of_month = np.r_[True, month[1:] != month[:-1]]
+    
+    def __len__(self):
+        return len(self.days)
+    
+    @staticmethod
+    def _as_date(value):
+        """get_all_trades_days 的元素 (date / datetime / 'YYYY-MM-DD' 等) -> datetime.date，只在加载时调用"""
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        if isinstance(value, datetime.date):
+            return value
+        return pd.Timestamp(str(value)).date()
+    
+    @property
+    def last_date(self):
+        return self._dates[-1]
+    
+    def _offset(self, date):
+        """自然日序号（相对首个交易日）"""
+        if isinstance(date, (int, np.integer)):
+            date = datetime.date(int(date) // 10000, int(date) // 100 % 100, int(date) % 100)
+        return date.toordinal() - self._base
+    
+    def locate(self, date):
+        """date 当日或之前最近一个交易日的下标；早于日历返回 -1"""
+        k = self._offset(date)
+        if k < 0:
+            return -1
+        return int(self._floor[min(k, len(self._floor) - 1)])
+    
+    def is_trading_day(self, date):
+        k = self._offset(date)
+        return 0 <= k < len(self._is_trade) and bool(self._is_trade[k])
+    
+    def shift(self, date, n):
+        """
+        date 之后第 n 个交易日的下标 (n 为负时向前)；date 非交易日时从其前后最近的交易日起算
+        
+        返回:
+            交易日下标，超出日历范围返回 None
+        """
+        i = self.locate(date)
+        if n and not self.is_trading_day(date):
+            # 非交易日：向后从下一个交易日起算，向前从上一个交易日起算
+            i += 1 if n > 0 else 0
+            n -= 1 if n > 0 else -1
+        i += n
+        return i if 0 <= i < len(self.days) else None
+    
+    def date(self, i):
+        """下标 -> datetime.date"""
+        return self._dates[i]
+    
+    def text(self, i):
+        """下标 -> 'YYYYMMDD'"""
+        return self._text[i]
+    
+    def is_first_of_week(self, date):
+        return self.is_trading_day(date) and bool(self.first_of_week[self.locate(date)])
+    
+    def is_first_of_month(self, date):
+        return self.is_trading_day(date) and bool(self.first_of_month[self.locate(date)])
+
+
+# 交易日历只在首次使用时调用一次 get_all_trades_days；日期超出已加载的范围时每天最多重新加载一次
+_calendar_state = {'calendar': None, 'reloaded': None}
+
+
+def get_calendar(date=None):
+    """获取交易日历"""
+    calendar = _calendar_state['calendar']
+    stale = calendar is not None and date is not None and date > calendar.last_date
+    if calendar is None or (stale and _calendar_state['reloaded'] != date):
+        calendar = _calendar_state['calendar'] = TradingCalendar(get_all_trades_days())
+        _calendar_state['reloaded'] = date
+    return calendar
+
+
 def get_previous_date(context):
     """获取前一交易日"""
-    # PTrade中获取前一交易日
     today = get_trading_day(context)
-    trade_days = get_trade_days(end_date=today.strftime('%Y%m%d'), count=2)
-    if len(trade_days) >= 2:
-        return trade_days[-2]
-    return today
+    calendar = get_calendar(today)
+    i = calendar.shift(today, -1)
+    return calendar.date(i) if i is not None else today
+
+
+def get_date_str(context, n=0):
+    """当前交易日 (n=-1 为前一交易日) 的 'YYYYMMDD' 字符串"""
+    today = get_trading_day(context)
+    calendar = get_calendar(today)
+    i = calendar.shift(today, n) if n else calendar.locate(today)
+    return calendar.text(i) if i is not None and i >= 0 else today.strftime('%Y%m%d')
 
 
 # 1-1 准备股票池
 def prepare_stock_list(context):
     """准备股票池：获取持仓列表和昨日涨停列表"""
+    reset_daily_cache(context)
+    
     # 获取已持有列表 (PTrade语法)
     g.hold_list = []
     positions = get_positions()
@@ -125,137 +265,433 @@ def prepare_stock_list(context):
         g.hold_list.append(stock)
     
     # 获取昨日涨停列表
+    g.yesterday_HL_list = []
     if g.hold_list:
-        yesterday = get_previous_date(context)
-        yesterday_str = yesterday.strftime('%Y%m%d') if hasattr(yesterday, 'strftime') else str(yesterday).replace('-', '')
-        
-        g.yesterday_HL_list = []
-        for stock in g.hold_list:
-            try:
-                # PTrade: 使用get_history获取涨停价和收盘价
-                df = get_history(1, '1d', ['close', 'high_limit'], security_list=stock, include=False)
-                if df is not None and len(df) > 0:
-                    close = df['close'].iloc[-1] if 'close' in df.columns else df.iloc[-1, 0]
-                    high_limit = df['high_limit'].iloc[-1] if 'high_limit' in df.columns else df.iloc[-1, 1]
-                    if close >= high_limit * 0.999:  # 允许小误差
-                        g.yesterday_HL_list.append(stock)
-            except Exception as e:
-                log.debug(f"获取{stock}涨停信息出错: {e}")
-    else:
-        g.yesterday_HL_list = []
+        # PTrade: 一次 get_history 批量获取全部持仓的收盘价和涨停价
+        fields = ['close', 'high_limit']
+        try:
+            hist = get_history(1, '1d', fields, security_list=g.hold_list, include=False)
+        except Exception as e:
+            log.debug(f"批量获取涨停信息出错: {e}")
+            hist = None
+        last = _history_last(hist, g.hold_list, fields)
+        limit_up = last['close'].values >= last['high_limit'].values * 0.999  # 允许小误差
+        g.yesterday_HL_list = [stock for stock, hit in zip(g.hold_list, limit_up) if hit]
+    
+    # 盘中涨停监控跟踪昨日涨停的持仓
+    _limit_up_monitor.track(g.yesterday_HL_list)
 
 
-def industry(stockList, industry_code_list, date):
-    """计算各行业的股票数量"""
-    i_Constituent_Stocks = {}
+# 行业归属索引：每个申万一级行业调用一次 get_industry_stocks，按日缓存
+# members: {行业代码: 成分股集合}; stock_to_ind: {股票: 所属行业代码}; codes: 行业代码列表(整数编码顺序)
+_industry_index = {'date': None, 'members': {}, 'stock_to_ind': {}, 'codes': []}
+
+
+def get_industry_index(date, refresh=False):
+    """获取股票→申万一级行业索引（同一交易日内只构建一次）"""
     date_str = date.strftime('%Y%m%d') if hasattr(date, 'strftime') else str(date).replace('-', '')
+    if _industry_index['date'] == date_str and not refresh:
+        return _industry_index
     
-    for i in industry_code_list:
+    # 优先使用市场宽度计算的行业代码，其余申万代码补充
+    codes = industry_code + [code for code in SW1 if code not in industry_code]
+    members = {}
+    stock_to_ind = {}
+    for code in codes:
         # PTrade: 行业代码需要加.XBHS后缀
         try:
-            temp = get_industry_stocks(i + '.XBHS')
-            i_Constituent_Stocks[i] = list(set(temp).intersection(set(stockList)))
-        except:
-            i_Constituent_Stocks[i] = []
+            members[code] = set(get_industry_stocks(code + '.XBHS') or [])
+        except Exception as e:
+            log.debug(f"获取行业{code}成分股出错: {e}")
+            members[code] = set()
+        for stock in members[code]:
+            stock_to_ind.setdefault(stock, code)
     
-    count_dict = {}
-    for name, content_list in i_Constituent_Stocks.items():
-        count_dict[name] = len(content_list)
-    return count_dict
+    _industry_index.update(date=date_str, members=members, stock_to_ind=stock_to_ind, codes=codes)
+    return _industry_index
+
+
+def get_industry_codes(stock_list, date):
+    """
+    股票的行业整数编码（与 stock_list 对齐）
+    
+    返回:
+        (编码数组, 行业代码列表)，编码为行业代码列表中的下标，未知行业为-1
+    """
+    index = get_industry_index(date)
+    position = {code: i for i, code in enumerate(index['codes'])}
+    stock_to_ind = index['stock_to_ind']
+    codes = np.array([position.get(stock_to_ind.get(stock), -1) for stock in stock_list], dtype=np.int32)
+    return codes, index['codes']
+
+
+def industry(stockList, industry_code_list, date):
+    """计算各行业的股票数量"""
+    members = get_industry_index(date)['members']
+    stock_set = set(stockList)
+    return {i: len(members.get(i, set()) & stock_set) for i in industry_code_list}
 
 
 def getStockIndustry(p_stocks, p_day):
     """获取股票所属行业"""
-    dict_stk_2_ind = {}
-    date_str = p_day.strftime('%Y%m%d') if hasattr(p_day, 'strftime') else str(p_day).replace('-', '')
+    stock_to_ind = get_industry_index(p_day)['stock_to_ind']
+    return pd.Series({stock: stock_to_ind[stock] for stock in p_stocks if stock in stock_to_ind}, dtype=object)
+
+
+def _rolling_last_mean(block, window):
+    """
+    按 pandas rolling(window).mean() 的运算顺序求 (window + 1, 股票) 收盘价块最后一个窗口的均值
+
+    逐行加入、第 window 行时先移出首行，加入与移出各自做 Kahan 补偿，整窗同价时取该价，
+    结果与对同一块收盘价调用 rolling(window).mean() 逐位相同。block 按时间顺序且不含缺失
+    """
+    total = np.zeros(block.shape[1])
+    comp = np.zeros(block.shape[1])
+    run = np.zeros(block.shape[1], dtype=np.int64)
+    for k, x in enumerate(block):
+        if k >= window:
+            total = total - block[k - window]
+        y = x - comp
+        t = total + y
+        comp = t - total - y
+        total = t
+        run = np.where(x == block[k - 1], run + 1, 1) if k else run + 1
+    return np.where(run >= window, block[-1], total / window)
+
+
+class MarketBreadth:
+    """
+    市场宽度引擎
+
+    以 numpy 环形缓冲区保存最近 window + 1 个交易日的收盘价 (日期 x 股票，与原先每日
+    请求 window + 1 天收盘价的算法相同)，每日只推入一行新收盘价，用滚动和更新均线，
+    再用一次 np.bincount 按行业整数编码得到各行业站上均线的股票比例 (0-100，四舍五入)。
+    缓冲区内有缺失价格的股票不参与统计。每日的行业宽度保存在 history 中，
+    可直接用于长周期的"搅屎棍"研究而无需从原始价格重算。
+    股票池变化时 reindex 保留原有股票的窗口，只需补入新加入股票的收盘价
+
+    收盘价恰好等于均线 (一字板、停滞或分价持平) 很常见，此时滚动和的舍入误差会左右比较结果。
+    收盘价与均线相差在相对 tolerance 以内的股票，按 pandas rolling(window).mean() 的算法
+    重算均线后再比较，判断与原先的 pandas 实现逐只一致
+    """
+
+    tolerance = 1e-9
+
+    def __init__(self, industry_codes, codes, window=20):
+        self.industry_codes = np.asarray(industry_codes, dtype=np.int32)  # 行业整数编码，-1为未知
+        self.codes = list(codes)                                         # 行业代码列表
+        self.window = window
+        self._depth = window + 1
+        n_stocks = len(self.industry_codes)
+        self._closes = np.full((self._depth, n_stocks), np.nan)
+        self._sum = np.zeros(n_stocks)                                   # 最近 window 日收盘价之和
+        self._nan_count = np.full(n_stocks, self._depth, dtype=np.int32)  # 缓冲区内缺失价格数
+        self._count = 0
+        self.ratios = np.full(len(self.codes), np.nan)
+        self.dates = []
+        self.history = []
+
+    def update(self, closes, date=None):
+        """推入一个交易日的收盘价 (与股票列表对齐)，返回当日各行业宽度"""
+        closes = np.asarray(closes, dtype=np.float64)
+        slot = self._count % self._depth
+        # 滑出均线窗口的是 window 日前的收盘价 (仍在缓冲区中)，被覆盖的是再早一日的
+        old = self._closes[(self._count - self.window) % self._depth]
+        gone = self._closes[slot]
+        new_nan = np.isnan(closes)
+        self._sum += np.where(new_nan, 0.0, closes) - np.where(np.isnan(old), 0.0, old)
+        self._nan_count += new_nan.astype(np.int32) - np.isnan(gone)
+        self._closes[slot] = closes
+        self._count += 1
+        if slot == self._depth - 1:
+            # 缓冲区写满一圈时重新求和 (第 0 行是最早一日，不在均线窗口内)，控制累计的浮点误差
+            self._sum = np.nansum(self._closes[1:], axis=0)
+
+        ratios = self._ratios(closes)
+        self.ratios = ratios
+        self.dates.append(date)
+        self.history.append(ratios)
+        return ratios
+
+    def _ratios(self, closes):
+        """按当前窗口计算各行业宽度，closes 为窗口内最近一日的收盘价"""
+        ratios = np.full(len(self.codes), np.nan)
+        if self._count >= self._depth:
+            valid = (self._nan_count == 0) & (self.industry_codes >= 0)
+            mavg = self._sum / self.window
+            gap = closes - mavg
+            margin = self.tolerance * np.abs(mavg)
+            above = valid & (gap > margin)
+            near = np.flatnonzero(valid & (np.abs(gap) <= margin))
+            if len(near):
+                order = (self._count + np.arange(self._depth)) % self._depth
+                above[near] = closes[near] > _rolling_last_mean(self._closes[order[:, None], near], self.window)
+            total = np.bincount(self.industry_codes[valid], minlength=len(self.codes))
+            up = np.bincount(self.industry_codes[above], minlength=len(self.codes))
+            has = total > 0
+            ratios[has] = np.round(up[has] * 100.0 / total[has])
+        return ratios
+
+    def reindex(self, rows, industry_codes, codes, added):
+        """
+        股票池变化时调整列，并按新股票池重算当前宽度
+        
+        参数:
+            rows: 新股票池中各股票在原股票池中的列号，新加入的股票为-1
+            industry_codes / codes: 新股票池的行业整数编码与行业代码列表
+            added: 新加入股票截至最近一次更新日的收盘价 (日期 x 新股票，时间顺序)，不足 window + 1 行的前面视为缺失
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        fresh = np.flatnonzero(rows < 0)
+        kept = rows >= 0
+        closes = np.full((self._depth, len(rows)), np.nan)
+        closes[:, kept] = self._closes[:, rows[kept]]
+        total = np.zeros(len(rows))
+        total[kept] = self._sum[rows[kept]]
+        nan_count = np.full(len(rows), self._depth, dtype=np.int32)
+        nan_count[kept] = self._nan_count[rows[kept]]
+        if len(fresh):
+            # 时间顺序第 i 行 (共 window + 1 行，最后一行为最近一日) 对应环形缓冲区的槽位 (count + i) % (window + 1)
+            block = np.full((self._depth, len(fresh)), np.nan)
+            added = np.asarray(added, dtype=np.float64).reshape(-1, len(fresh))[-self._depth:]
+            if len(added):
+                block[self._depth - len(added):] = added
+            slots = (self._count + np.arange(self._depth)) % self._depth
+            closes[slots[:, None], fresh[None, :]] = block
+            total[fresh] = np.nansum(block[1:], axis=0)
+            nan_count[fresh] = np.isnan(block).sum(axis=0)
+        self._closes, self._sum, self._nan_count = closes, total, nan_count
+        self.industry_codes = np.asarray(industry_codes, dtype=np.int32)
+        self.codes = list(codes)
+        self.ratios = self._ratios(closes[(self._count - 1) % self._depth])
+
+    def update_many(self, close_matrix, dates=None):
+        """按日期顺序推入多日收盘价 (日期 x 股票)"""
+        dates = list(dates) if dates is not None else [None] * len(close_matrix)
+        for closes, date in zip(np.asarray(close_matrix, dtype=np.float64), dates):
+            self.update(closes, date)
+        return self.ratios
+
+    def history_frame(self):
+        """全部历史行业宽度 (index=日期, columns=行业代码)"""
+        return pd.DataFrame(np.array(self.history).reshape(-1, len(self.codes)), index=self.dates, columns=self.codes)
+
+
+# 市场宽度引擎按股票池常驻，调仓时只补推上次之后的新交易日
+_breadth_state = {'engine': None, 'stocks': None, 'last_date': None}
+
+
+def _close_matrix(h, stock_list, dates=None):
+    """
+    把 get_price 的返回整理为 (日期, 股票) 的收盘价矩阵
+
+    给出 dates 时按这些交易日对齐行，股票停牌 (没有返回) 的日期为NaN
+    """
+    if 'code' in h.columns:
+        # 多股票返回格式
+        h = h.assign(date=pd.to_datetime(h.index)).pivot(index='date', columns='code', values='close')
+    elif len(stock_list) == 1:
+        # 单只股票时返回普通的时间序列表
+        h = h[['close']].set_axis(list(stock_list), axis=1)
+    h.index = pd.to_datetime(h.index)
+    h = h.reindex(columns=stock_list).sort_index()
+    return h if dates is None else h.reindex(pd.to_datetime(dates))
+
+
+def update_market_breadth(stock_list, end_date, window=20):
+    """
+    更新并返回股票池的市场宽度引擎
     
-    # PTrade: 使用get_stock_blocks获取股票所属板块
-    for stock in p_stocks:
-        try:
-            blocks = get_stock_blocks(stock)
-            if blocks:
-                # 查找申万一级行业
-                for block in blocks:
-                    if block.startswith('801') and len(block) == 6:
-                        dict_stk_2_ind[stock] = block
-                        break
-        except:
-            pass
+    首次运行或窗口变化时取最近 window + 1 个交易日重建；股票池变化时保留原有股票的窗口，
+    只为新加入的股票请求 window + 1 个交易日的收盘价 (超过一半的股票变化时仍整体重建)；
+    之后只获取上次更新之后到 end_date 的收盘价
+    """
+    end_str = end_date.strftime('%Y%m%d') if hasattr(end_date, 'strftime') else str(end_date).replace('-', '')
+    industry_codes, codes = get_industry_codes(stock_list, end_date)
+    engine = _breadth_state['engine']
+    
+    rows = added = None
+    if engine is not None and engine.window == window and _breadth_state['stocks'] != tuple(stock_list):
+        position = {stock: i for i, stock in enumerate(_breadth_state['stocks'])}
+        rows = [position.get(stock, -1) for stock in stock_list]
+        added = [stock for stock, row in zip(stock_list, rows) if row < 0]
+        if len(added) * 2 > len(stock_list):
+            engine = None
+    
+    if engine is None or engine.window != window:
+        h = get_price(stock_list, end_date=end_str, frequency='1d', fields=['close'], count=window + 1)
+        if h is None or len(h) == 0:
+            return None
+        engine = MarketBreadth(industry_codes, codes, window=window)
+        _breadth_state.update(engine=engine, stocks=tuple(stock_list), last_date=None)
+    else:
+        last_date = _breadth_state['last_date']
+        if rows is not None:
+            # 股票池变化 (指数成分调整)：只补入新加入股票截至上次更新日的收盘价，按引擎最近 window + 1 个交易日对齐
+            closes = np.empty((0, len(added)))
+            if added:
+                h = get_price(added, end_date=last_date.strftime('%Y%m%d'), frequency='1d', fields=['close'],
+                              count=window + 1)
+                if h is not None and len(h) > 0:
+                    closes = _close_matrix(h, added, engine.dates[-(window + 1):]).values
+            engine.reindex(rows, industry_codes, codes, closes)
+            _breadth_state['stocks'] = tuple(stock_list)
+        if last_date >= pd.Timestamp(end_str):
+            return engine
+        start_str = (last_date + pd.Timedelta(days=1)).strftime('%Y%m%d')
+        h = get_price(stock_list, start_date=start_str, end_date=end_str, frequency='1d', fields=['close'])
+        # 行业归属可能当日刷新，直接替换编码即可
+        engine.industry_codes = industry_codes
+        engine.codes = list(codes)
+        if h is None or len(h) == 0:
+            return engine
+    
+    close = _close_matrix(h, list(stock_list))
+    engine.update_many(close.values, close.index)
+    _breadth_state['last_date'] = close.index[-1]
+    return engine
+
+
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+class ConstituentTracker:
+    """
+    指数成分跟踪器
+    
+    同一指数同一交易日只请求一次 get_index_stocks，与上次的成分比较得到新增、剔除的股票，
+    并保存带日期的成分变动历史 (首期记全部成分，之后只在成分变化时记一条)。
+    verdicts 按名称缓存逐只股票不随时间变化的数据 (如上市日期)，只对缓存中没有的股票
+    (新加入的成分) 计算；暂时查不到的 (None) 不缓存，下次再查；被剔除的股票移出缓存。
+    需要整表重算时传 refresh=True，一次批量请求
+    """
+    
+    def __init__(self):
+        self._members = {}      # 指数 -> 最近一期成分 (平台返回顺序)
+        self._dates = {}        # 指数 -> 最近一次请求的日期 'YYYYMMDD'
+        self._delta = {}        # 指数 -> (新增, 剔除)
+        self._history = {}      # 指数 -> [(日期, 新增, 剔除)]
+        self._verdicts = {}     # 名称 -> {股票: 结果}
+    
+    def update(self, index_code, date):
+        """
+        获取 date 当日的成分股
+        
+        返回:
+            成分股列表；查询失败 (返回为空) 时返回空列表，不改变已记录的成分
+        """
+        date_str = date.strftime('%Y%m%d') if hasattr(date, 'strftime') else str(date).replace('-', '')
+        if self._dates.get(index_code) == date_str:
+            return list(self._members[index_code])
+        stocks = list(get_index_stocks(index_code, date_str) or [])
+        if not stocks:
+            return []
+        
+        previous = self._members.get(index_code)
+        if previous is None:
+            added, removed = stocks, []
+        else:
+            old, new = set(previous), set(stocks)
+            added = [stock for stock in stocks if stock not in old]
+            removed = [stock for stock in previous if stock not in new]
+            if added or removed:
+                log.info(f"{index_code} 成分变动: 新增 {len(added)} 只, 剔除 {len(removed)} 只")
+        if previous is None or added or removed:
+            self._history.setdefault(index_code, []).append((date_str, tuple(added), tuple(removed)))
+            self.forget(removed)
+        self._members[index_code] = stocks
+        self._dates[index_code] = date_str
+        self._delta[index_code] = (added, removed)
+        return list(stocks)
+    
+    def delta(self, index_code):
+        """最近一次 update 相对上一期的 (新增, 剔除)"""
+        return self._delta.get(index_code, ([], []))
+    
+    def members_on(self, index_code, date):
+        """按成分变动历史还原 date 当日 (含) 的成分股 (排序后的列表)"""
+        date_str = date.strftime('%Y%m%d') if hasattr(date, 'strftime') else str(date).replace('-', '')
+        members = set()
+        for day, added, removed in self._history.get(index_code, []):
+            if day > date_str:
+                break
+            members.update(added)
+            members.difference_update(removed)
+        return sorted(members)
     
-    return pd.Series(dict_stk_2_ind)
+    def verdicts(self, name, stock_list, compute, refresh=False):
+        """
+        逐只股票的缓存结果
+        
+        参数:
+            name: 缓存名称
+            compute: compute(股票列表)，返回与之对齐的结果序列，只对缓存中没有的股票调用；
+                     查询失败等暂时得不到结果的股票返回 None，不写入缓存，下次调用时重新计算
+            refresh: 是否清空缓存整表重算
+        返回:
+            与 stock_list 对齐的 ndarray (本次得不到结果的为 None)
+        """
+        cache = self._verdicts.setdefault(name, {})
+        if refresh:
+            cache.clear()
+        missing = [stock for stock in dict.fromkeys(stock_list) if stock not in cache]
+        pending = {}
+        if missing:
+            for stock, value in zip(missing, compute(missing)):
+                (pending if value is None else cache)[stock] = value
+        return np.array([cache[stock] if stock in cache else pending[stock] for stock in stock_list])
+    
+    def forget(self, stock_list):
+        """把股票移出全部缓存"""
+        for cache in self._verdicts.values():
+            for stock in stock_list:
+                cache.pop(stock, None)
+
+
+# 指数成分跟踪器在整个运行期间常驻
+_constituents = ConstituentTracker()
 
 
 # 1-2 选股模块
 def get_stock_list(context):
     """选股逻辑"""
     yesterday = get_previous_date(context)
-    today = get_trading_day(context)
-    today_str = today.strftime('%Y%m%d') if hasattr(today, 'strftime') else str(today).replace('-', '')
-    yesterday_str = yesterday.strftime('%Y%m%d') if hasattr(yesterday, 'strftime') else str(yesterday).replace('-', '')
-    
-    final_list = []
+    today_str = get_date_str(context)
     
-    # 获取初始列表 (PTrade: 指数代码用.XBHS)
-    initial_list = get_index_stocks('000985.XBHS', today_str)
+    # 获取初始列表 (PTrade: 指数代码用.XBHS)；成分未变时市场宽度只推入新交易日，变化时只补入新增股票
+    initial_list = _constituents.update('000985.XBHS', today_str)
     
     if not initial_list:
         log.info("获取指数成分股失败")
         return []
     
-    p_count = 1
-    
-    # 获取历史收盘价数据
+    # 获取历史收盘价数据并更新市场宽度
     try:
-        # PTrade: 使用get_price获取多只股票历史数据
-        h = get_price(initial_list, end_date=yesterday_str, frequency='1d', fields=['close'], count=p_count + 20)
+        breadth = update_market_breadth(initial_list, yesterday, window=g.breadth_window)
         
-        if h is None or len(h) == 0:
+        if breadth is None:
             log.info("获取历史价格数据失败")
             return []
         
-        # 数据处理
-        if 'code' in h.columns:
-            # 多股票返回格式
-            h['date'] = pd.to_datetime(h.index).date if hasattr(h.index[0], 'date') else h.index
-            df_close = h.pivot(index='code', columns='date', values='close').dropna(axis=0)
-        else:
-            # 尝试其他格式处理
-            df_close = h.T if len(h.columns) > 1 else h
-        
-        # 计算20日均线
-        df_ma20 = df_close.rolling(window=20, axis=1).mean().iloc[:, -p_count:]
-        df_bias = (df_close.iloc[:, -p_count:] > df_ma20)
-        
-        # 获取股票行业信息
-        s_stk_2_ind = getStockIndustry(p_stocks=initial_list, p_day=yesterday)
-        
-        if len(s_stk_2_ind) == 0:
+        if (breadth.industry_codes < 0).all():
             log.info("获取行业信息失败，使用备选逻辑")
             # 直接使用小市值策略
             return get_small_cap_stocks(context, today_str)
         
-        df_bias['industry_code'] = s_stk_2_ind
-        
-        # 计算行业宽度比例
-        df_ratio = ((df_bias.groupby('industry_code').sum() * 100.0) / df_bias.groupby('industry_code').count()).round()
-        
-        # 获取宽度最高的行业
-        column_names = df_ratio.columns.tolist()
-        if len(column_names) > 0:
-            last_col = column_names[-1]
-            top_values = df_ratio[last_col].nlargest(g.num)
-            I = top_values.index.tolist()
-            
-            # 计算全市场宽度
-            TT = df_ratio.sum().iloc[-1] if len(df_ratio.sum()) > 0 else 0
+        # 获取宽度最高的行业 (宽度相同按行业代码排序)
+        ratios = breadth.ratios
+        codes = np.array(breadth.codes)
+        valid = np.flatnonzero(~np.isnan(ratios))
+        if len(valid) > 0:
+            order = valid[np.lexsort((codes[valid], -ratios[valid]))]
+            I = codes[order[:g.num]].tolist()
             
             name_list = [SW1.get(code, code) for code in I]
             log.info(f"市场宽度最高行业: {name_list}")
-            log.info(f"全市场宽度: {np.array(df_ratio.sum(axis=0).mean()):.2f}")
+            log.info(f"全市场宽度: {np.nansum(ratios):.2f}")
             
             # 搅屎棍逻辑：如果是银行、有色、煤炭、钢铁且处于存量市场，则空仓
             if I and I[0] in ['801780', '801050', '801950', '801040']:
-                market_env = judge_market_env(context)
+                market_env = judge_market_env(context, g.env_ma_window, g.env_slope_window, g.turnover_cut, g.bank_cut)
                 if market_env == '存量':
                     log.info(f"搅屎棍触发：{name_list[0]}领涨且市场为存量环境，本周空仓")
                     return []
@@ -267,10 +703,72 @@ def get_stock_list(context):
     return get_small_cap_stocks(context, today_str)
 
 
+# 财务数据缓存
+# 已公告的财务数据不再变化，按 (表名, 日期, 字段) 缓存 get_fundamentals 的结果（有界LRU）：
+# 同一日期、同一股票池的重复查询不再请求平台，股票池扩大时只补查缺失的股票
+_fundamentals_cache = OrderedDict()
+_FUNDAMENTALS_CACHE_SIZE = 16
+
+
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+def _numeric_fundamentals(df):
+    """把文本字段（含百分比字符串 '15.2%'）一次性转为数值，无法转换的字段保持原样"""
+    for col in df.columns:
+        if col == 'secu_code' or pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        values = pd.to_numeric(df[col].astype(str).str.rstrip('%'), errors='coerce')
+        if values.notna().any():
+            df[col] = values
+    return df
+
+
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+def get_fundamentals_cached(stock_list, table, fields, date):
+    """
+    带缓存的 get_fundamentals
+    
+    同一日期、同一股票池的重复查询不再请求平台，股票池扩大时只补查缺失的股票；
+    文本字段（含百分比字符串）在入缓存时一次性转为数值
+    
+    参数:
+        stock_list: 股票列表
+        table: 财务表名
+        fields: 字段列表
+        date: 日期字符串
+    返回:
+        index 为股票代码、按 stock_list 顺序排列的 DataFrame
+    """
+    key = (table, str(date), tuple(fields))
+    entry = _fundamentals_cache.get(key)
+    if entry is None:
+        entry = _fundamentals_cache[key] = {'frame': None, 'asked': set()}
+    _fundamentals_cache.move_to_end(key)
+    while len(_fundamentals_cache) > _FUNDAMENTALS_CACHE_SIZE:
+        _fundamentals_cache.popitem(last=False)
+    
+    missing = [s for s in stock_list if s not in entry['asked']]
+    if missing:
+        df = get_fundamentals(missing, table, fields=list(fields), date=date)
+        if df is not None and len(df) > 0:
+            if 'secu_code' in df.columns:
+                df = df.set_index('secu_code', drop=False)
+            df = _numeric_fundamentals(df.copy())
+            frame = df if entry['frame'] is None else pd.concat([entry['frame'], df])
+            entry['frame'] = frame[~frame.index.duplicated(keep='last')]
+        entry['asked'].update(missing)
+    
+    frame = entry['frame']
+    if frame is None:
+        return pd.DataFrame(columns=list(fields))
+    return frame.reindex([s for s in stock_list if s in frame.index])
+
+
 def get_small_cap_stocks(context, today_str):
     """获取小市值股票列表"""
     # 获取中证1000成分股 (PTrade: 指数代码用.XBHS)
-    S_stocks = get_index_stocks('399101.XBHS', today_str)
+    S_stocks = _constituents.update('399101.XBHS', today_str)
     
     if not S_stocks:
         # 备选：获取所有A股
@@ -278,10 +776,8 @@ def get_small_cap_stocks(context, today_str):
     
     # 过滤科创北交股票
     stocks = filter_kcbj_stock(S_stocks)
-    # 过滤ST股票
-    choice = filter_st_stock(stocks)
-    # 过滤次新股
-    choice = filter_new_stock(context, choice)
+    # 过滤ST股票、次新股 (批量)
+    choice = filter_stock_batch(context, stocks, st=True, new=True)
     
     if not choice:
         return []
@@ -289,25 +785,19 @@ def get_small_cap_stocks(context, today_str):
     # 获取财务数据筛选 (PTrade语法)
     try:
         # 获取ROE和ROA数据
-        df = get_fundamentals(choice, 'profit_ability', fields=['roe', 'roa'], date=today_str)
+        df = get_fundamentals_cached(choice, 'profit_ability', ['roe', 'roa'], today_str)
         
         if df is not None and len(df) > 0:
-            # 筛选ROE > 15%, ROA > 10%
+            # 筛选ROE > g.roe_min%, ROA > g.roa_min% (百分比字符串已在缓存中转为数值)
             if 'roe' in df.columns and 'roa' in df.columns:
-                # 处理百分比字符串
-                if df['roe'].dtype == 'object':
-                    df['roe'] = df['roe'].str.replace('%', '').astype(float)
-                if df['roa'].dtype == 'object':
-                    df['roa'] = df['roa'].str.replace('%', '').astype(float)
-                
-                qualified = df[(df['roe'] > 15) & (df['roa'] > 10)]
+                qualified = df[(df['roe'] > g.roe_min) & (df['roa'] > g.roa_min)]
                 choice = qualified.index.tolist()
     except Exception as e:
         log.debug(f"获取财务数据出错: {e}")
     
     # 按市值排序，取最小的
     try:
-        val_df = get_fundamentals(choice, 'valuation', fields=['total_value'], date=today_str)
+        val_df = get_fundamentals_cached(choice, 'valuation', ['total_value'], today_str)
         if val_df is not None and len(val_df) > 0:
             val_df = val_df.sort_values('total_value', ascending=True)
             choice = val_df.index.tolist()[:g.stock_num]
@@ -315,10 +805,8 @@ def get_small_cap_stocks(context, today_str):
         log.debug(f"获取市值数据出错: {e}")
         choice = choice[:g.stock_num]
     
-    # 过滤停牌、涨停、跌停股票
-    BIG_stock_list = filter_paused_stock(choice)
-    BIG_stock_list = filter_limitup_stock(context, BIG_stock_list)
-    L = filter_limitdown_stock(context, BIG_stock_list)
+    # 过滤停牌、涨停、跌停股票 (批量)
+    L = filter_stock_batch(context, choice, paused=True, limitup=True, limitdown=True)
     
     return L
 
@@ -330,51 +818,150 @@ def weekly_adjustment(context):
     
     log.info(f"本周目标持仓: {target_B}")
     
-    # 调仓卖出
-    for stock in g.hold_list:
-        if (stock not in target_B) and (stock not in g.yesterday_HL_list):
-            position = get_position(stock)
-            if position and position.amount > 0:
-                close_position(stock)
-    
-    # 调仓买入
-    position_count = len(get_positions())
-    target_num = len(target_B)
-    
-    if target_num > position_count:
-        buy_num = min(len(target_B), g.stock_num * g.num - position_count)
-        if buy_num > 0:
-            value = context.portfolio.cash / buy_num
-            for stock in target_B:
-                positions = get_positions()
-                if stock not in positions:
-                    if open_position(stock, value):
-                        if len(get_positions()) >= target_num:
-                            break
+    # 持仓只查询一次
+    positions = get_positions()
+    held = [stock for stock in positions if positions[stock].amount > 0]
+    # 不在目标中的持仓卖出 (昨日涨停的继续持有)，其余持仓不动
+    keep = [stock for stock in held if stock in target_B or stock in g.yesterday_HL_list]
+    
+    # 调仓买入：目标中未持有的股票，持仓数达到目标数为止
+    buy_num = min(len(target_B), g.stock_num * g.num - len(keep), len(target_B) - len(keep))
+    new = [stock for stock in target_B if stock not in positions][:max(buy_num, 0)]
+    
+    stocks = held + new
+    if not stocks:
+        return
+    prices, high_limit, low_limit = _quote_cache.lookup(stocks, context.blotter.current_dt)
+    limit_up, _ = QuoteCache.at_limit(prices, high_limit, low_limit)
+    amounts = np.array([positions[s].amount for s in held] + [0] * len(new), dtype=np.int64)
+    sellable = np.array([getattr(positions[s], 'enable_amount', positions[s].amount) for s in held] + [0] * len(new))
+    
+    # 卖出的资金与现金一起平分给新买入的股票；涨停买不进的股票不分配
+    sell_mask = np.array([s not in keep for s in held] + [False] * len(new))
+    buyable = np.array([False] * len(held) + [True] * len(new)) & ~limit_up
+    free = context.portfolio.cash + np.nansum(amounts * prices * sell_mask)
+    target_values = np.where(sell_mask, 0.0, np.nan)
+    if buyable.any():
+        target_values[buyable] = free / buyable.sum()
+    
+    plan, left = plan_rebalance(stocks, amounts, target_values, prices, context.portfolio.cash, sellable=sellable,
+                                commission_ratio=g.commission_ratio, min_commission=g.min_commission)
+    execute_plan(plan)
+    log.info(f"调仓完成，预计剩余资金 {left:.2f}")
+
+
+class LimitUpMonitor:
+    """
+    盘中涨停板监控
+    
+    对全部跟踪股票 (昨日涨停的持仓) 从盘中行情缓存批量取价，逐只维护封板状态：
+    当前是否封板、今日是否开过板、首次开板时间 (秒)、开板后回封次数、是否已发出卖出决策。
+    状态保存在按容量预分配的 numpy 数组中，轮询时原地更新，不逐只股票建对象
+    (每次轮询仍会为取价、判断封板生成与跟踪股票数同长的临时数组)；
+    开板的第一次轮询即返回需要卖出的股票，卖出下单成功后由调用方用 mark_sold 记录，
+    下单被拒的股票在之后的轮询 (包括 14:00 兜底检查) 中仍处于开板时会再次返回
+    """
+
+    def __init__(self, capacity=512):
+        self.capacity = capacity
+        self.codes = []
+        self._n = 0
+        self._last = np.zeros(capacity)
+        self._limit = np.zeros(capacity)
+        self._now_sealed = np.zeros(capacity, dtype=bool)
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._fire = np.zeros(capacity, dtype=bool)
+        self.sealed = np.zeros(capacity, dtype=bool)        # 上次轮询时是否封板
+        self.opened = np.zeros(capacity, dtype=bool)        # 今日是否开过板
+        self.open_time = np.full(capacity, -1, dtype=np.int32)  # 首次开板时间 (当日秒数)
+        self.reseals = np.zeros(capacity, dtype=np.int32)   # 开板后回封次数
+        self.sold = np.zeros(capacity, dtype=bool)          # 卖出已成功下单
+
+    def track(self, stock_list):
+        """设置当日跟踪的股票并清空状态 (超出容量的部分不跟踪)"""
+        self.codes = list(stock_list)[:self.capacity]
+        self._n = len(self.codes)
+        self.sealed[:] = True
+        self.opened[:] = False
+        self.open_time[:] = -1
+        self.reseals[:] = 0
+        self.sold[:] = False
+
+    def poll(self, now):
+        """
+        批量获取行情并更新状态，返回当前开板且尚未卖出 (需要卖出) 的股票列表
+        
+        now: 当前时间 (datetime)，用于记录开板时间
+        """
+        n = self._n
+        if n == 0:
+            return []
+        last, limit = self._last[:n], self._limit[:n]
+        last[:], limit[:], low_limit = _quote_cache.lookup(self.codes, now)
+        
+        valid, now_sealed, fire = self._valid[:n], self._now_sealed[:n], self._fire[:n]
+        np.greater(last, 0, out=valid)
+        valid &= limit > 0
+        now_sealed[:], _ = QuoteCache.at_limit(last, limit, low_limit)
+        
+        # 开板后回封
+        self.reseals[:n] += valid & now_sealed & ~self.sealed[:n] & self.opened[:n]
+        # 首次开板：记录时间；开板且尚未卖出的触发卖出
+        fire[:] = valid & ~now_sealed
+        first_open = fire & ~self.opened[:n]
+        self.open_time[:n][first_open] = now.hour * 3600 + now.minute * 60 + now.second
+        self.opened[:n] |= fire
+        fire &= ~self.sold[:n]
+        self.sealed[:n] = np.where(valid, now_sealed, self.sealed[:n])
+        return [self.codes[i] for i in np.flatnonzero(fire)]
+
+    def mark_sold(self, stock_list):
+        """记录卖出已成功下单的股票，之后的轮询不再返回"""
+        sold = set(stock_list)
+        for i, code in enumerate(self.codes):
+            if code in sold:
+                self.sold[i] = True
+
+    def state(self):
+        """当前跟踪状态表 (index=股票)"""
+        n = self._n
+        return pd.DataFrame({'sealed': self.sealed[:n], 'opened': self.opened[:n], 'open_time': self.open_time[:n],
+                             'reseals': self.reseals[:n], 'sold': self.sold[:n]}, index=self.codes)
+
+
+# 涨停监控器在整个运行期间常驻，每天开盘前重新设置跟踪列表
+_limit_up_monitor = LimitUpMonitor()
+
+
+def monitor_limit_up(context):
+    """盘中定时轮询 (run_interval)：昨日涨停的持仓一旦开板立即卖出"""
+    now = context.blotter.current_dt
+    if not (datetime.time(9, 30) <= now.time() < datetime.time(15, 0)):
+        return
+    try:
+        for stock in _limit_up_monitor.poll(now):
+            log.info(f"[{stock}]涨停打开，卖出")
+            if close_position(stock):
+                _limit_up_monitor.mark_sold([stock])
+    except Exception as e:
+        log.debug(f"盘中涨停监控出错: {e}")
 
 
 def check_limit_up(context):
-    """检查持仓中的涨停股是否需要卖出"""
+    """检查持仓中的涨停股是否需要卖出 (14:00 兜底检查，回测中没有盘中轮询时由它完成判断)"""
     if not g.yesterday_HL_list:
         return
     
-    now_time = context.blotter.current_dt
-    
-    for stock in g.yesterday_HL_list:
-        try:
-            # PTrade: 使用get_snapshot获取实时行情
-            snapshot = get_snapshot(stock)
-            if snapshot and stock in snapshot:
-                last_px = snapshot[stock].get('last_px', 0)
-                high_limit = snapshot[stock].get('high_limit', 0)
-                
-                if last_px > 0 and high_limit > 0 and last_px < high_limit * 0.999:
-                    log.info(f"[{stock}]涨停打开，卖出")
-                    close_position(stock)
-                else:
-                    log.info(f"[{stock}]涨停，继续持有")
-        except Exception as e:
-            log.debug(f"检查{stock}涨停状态出错: {e}")
+    try:
+        for stock in _limit_up_monitor.poll(context.blotter.current_dt):
+            log.info(f"[{stock}]涨停打开，卖出")
+            if close_position(stock):
+                _limit_up_monitor.mark_sold([stock])
+        state = _limit_up_monitor.state()
+        for stock in state.index[state['sealed'] & ~state['sold']]:
+            log.info(f"[{stock}]涨停，继续持有")
+    except Exception as e:
+        log.debug(f"检查涨停状态出错: {e}")
 
 
 # 3-1 交易模块-自定义下单
@@ -407,55 +994,553 @@ def close_position(security):
     return False
 
 
-# 2-1 过滤停牌股票
-def filter_paused_stock(stock_list):
-    """过滤停牌股票"""
-    if not stock_list:
-        return []
+# 3-4 交易模块-调仓计划
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+def plan_rebalance(stocks, amounts, target_values, prices, cash, sellable=None, locked=None,
+                   lot=100, commission_ratio=0.0003, min_commission=5.0, tax=0.001):
+    """
+    调仓计划：一次向量化计算先卖后买的全部股数
     
-    result = []
-    for stock in stock_list:
-        try:
-            # PTrade: 使用get_stock_status检查停牌状态
-            status = get_stock_status(stock, query_type='HALT')
-            if status and stock in status:
-                if not status[stock]:  # False表示未停牌
-                    result.append(stock)
-            else:
-                result.append(stock)
-        except:
-            result.append(stock)
+    按目标市值换算整手股数，卖出释放的资金 (扣除佣金、印花税) 计入可用资金，
+    买入资金不足时按比例缩减，取整剩下的资金按缺口从大到小每只再补一手；
+    资金按每只股票的净买卖计算，对正在减仓的股票补一手即少卖一手
+    
+    参数:
+        stocks: 股票列表 (当前持仓与目标股票的并集)
+        amounts: 当前持股数
+        target_values: 目标市值 (NaN 表示不调整)
+        prices: 当前价格
+        cash: 可用资金
+        sellable: 可卖股数 (T+1)，默认为全部持股
+        locked: 不调整的股票 (布尔数组)
+        lot: 每手股数
+        commission_ratio: 佣金费率
+        min_commission: 最低佣金
+        tax: 卖出印花税率
+    返回:
+        (调仓计划 DataFrame[index=股票, columns=amount/price/delta/target], 预计剩余资金)；
+        delta 为正表示买入、为负表示卖出
+    """
+    amounts = np.asarray(amounts, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    target_values = np.asarray(target_values, dtype=np.float64)
+    sellable = amounts if sellable is None else np.minimum(np.asarray(sellable, dtype=np.int64), amounts)
+    locked = np.zeros(len(amounts), dtype=bool) if locked is None else np.asarray(locked, dtype=bool)
+    # 没有有效价格或目标市值的股票不调整
+    locked = locked | ~(prices > 0) | np.isnan(target_values)
+    px = np.where(locked, 1.0, prices)
+    
+    def fee(value):
+        return np.where(value > 0, np.maximum(value * commission_ratio, min_commission), 0.0)
+    
+    def cost(net):
+        # 净买入为买入金额加佣金，净卖出为负的到账金额 (扣除佣金、印花税)
+        value = np.abs(net) * px
+        return np.where(net > 0, value + fee(value), fee(value) + value * tax - value)
+    
+    # 目标股数按整手向下取整
+    target = np.where(locked, amounts, np.floor(np.where(locked, 0.0, target_values) / px / lot) * lot).astype(np.int64)
+    
+    # 卖出：清仓时零股一并卖出，减仓按整手；不超过可卖数量 (T+1)
+    sell = np.maximum(amounts - target, 0)
+    sell = np.where(target > 0, sell // lot * lot, sell)
+    sell = np.minimum(sell, sellable)
+    available = cash - np.sum(cost(-sell))
+    
+    # 买入：按整手 (持有零股时买到目标以下最近的整手)，资金不足时按比例缩减，再按整手向下取整
+    buy = np.maximum(target - amounts, 0) // lot * lot
+    need = np.sum(cost(buy))
+    if need > available > 0:
+        buy = (np.floor(buy * (available / need) / lot) * lot).astype(np.int64)
+    elif available <= 0:
+        buy[:] = 0
+    
+    # 取整剩下的资金：按距离目标市值的缺口从大到小，每只最多再补一手；清仓卖出零股的不补
+    net = buy - sell
+    holding = amounts + net
+    shortfall = np.where(locked | (target_values <= 0) | (net % lot != 0), -np.inf, target_values - holding * px)
+    extra = cost(net + lot) - cost(net)
+    order = np.argsort(-shortfall, kind='stable')
+    left = cash - np.sum(cost(net))
+    for i in order[shortfall[order] > 0]:
+        if extra[i] <= left:
+            net[i] += lot
+            left -= extra[i]
     
+    # 最低佣金可能使总额略超可用资金，从买入最多的股票逐手撤回
+    spent = np.sum(cost(net))
+    while spent > cash + 1e-6 and (net > 0).any():
+        i = int(np.argmax(net * px))
+        net[i] -= lot
+        spent = np.sum(cost(net))
+    
+    delta = np.where(locked, 0, net)
+    plan = pd.DataFrame({'amount': amounts, 'price': prices, 'delta': delta, 'target': amounts + delta},
+                        index=pd.Index(list(stocks), name='code'))
+    return plan, float(cash - spent)
+
+
+# 3-5 交易模块-批量执行调仓计划
+def execute_plan(plan):
+    """按调仓计划批量下单：先卖后买，期间不再查询持仓"""
+    for stock, delta in plan['delta'][plan['delta'] < 0].items():
+        if order(stock, int(delta)) is not None:
+            log.info(f"卖出 {stock} {-int(delta)}股")
+    for stock, delta in plan['delta'][plan['delta'] > 0].items():
+        if order(stock, int(delta)) is not None:
+            log.info(f"买入 {stock} {int(delta)}股")
+
+
+# 2-0 批量过滤流水线
+# 停牌、ST、名称在一个交易日内不变，按日缓存；上市日期不会变化，跨日缓存在成分跟踪器中；
+# 所有过滤都对整只股票列表一次批量请求，再用布尔掩码向量化过滤
+_daily_cache = {'date': None, 'st': {}, 'halt': {}}
+
+
+def reset_daily_cache(context):
+    """交易日切换时清空按日缓存，并按 g 上的当前参数设置行情缓存与并发请求层"""
+    today = get_trading_day(context)
+    if _daily_cache['date'] != today:
+        _daily_cache['date'] = today
+        _daily_cache['st'] = {}
+        _daily_cache['halt'] = {}
+        _quote_cache.reset()
+        _quote_cache.ttl = g.quote_ttl
+        _fetcher.configure(max_workers=g.fetch_workers, timeout=g.fetch_timeout, retries=g.fetch_retries,
+                           backoff=g.fetch_backoff, chunk_size=g.fetch_chunk_size)
+
+
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+class ConcurrentFetcher:
+    """
+    有界并发的数据请求层
+
+    把相互独立的平台调用（逐只股票，或按 chunk_size 分块的股票列表）放进线程池并发执行：
+    同时在途的调用不超过 max_workers 个；单次调用超过 timeout 秒视为超时（平台调用无法取消，超时的调用被放弃）；
+    失败或超时后按 backoff * 2^k 秒退避重试，最多 retries 次；结果按输入顺序组装。
+    每一项从提交起另有总时限 timeout * (retries + 1) 加各次退避（含排队等待），到期仍未成功即失败，
+    即使所有线程都卡在不返回的调用上也不会无限等待；有调用被放弃时，本次结束后关闭线程池（不等待
+    卡住的线程、取消排队的调用），之后的请求使用新线程池。
+    重试后仍失败的调用返回 None，写入日志并计入 counts，不再被静默吞掉。
+    只有一个调用或 max_workers <= 1 时在当前线程顺序执行（不限时）
+    """
+
+    def __init__(self, max_workers=16, timeout=10.0, retries=2, backoff=0.2, chunk_size=500):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.counts = {'calls': 0, 'retries': 0, 'timeouts': 0, 'errors': 0}
+        self._pool = None
+        self._pool_size = 0
+        self._futures = set()   # 已提交到当前线程池、尚未处理完的调用
+
+    def configure(self, **params):
+        for name, value in params.items():
+            setattr(self, name, value)
+
+    def _executor(self):
+        if self._pool is None or self._pool_size != self.max_workers:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='fetch')
+            self._pool_size = self.max_workers
+        return self._pool
+
+    def _discard_pool(self):
+        """关闭当前线程池：不等待卡住的线程，取消尚未开始的调用 (自行取消，shutdown 的 cancel_futures 需要 Python 3.9)"""
+        if self._pool is not None:
+            for future in self._futures:
+                future.cancel()
+            self._futures.clear()
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    @staticmethod
+    def _call(func, started):
+        started.append(time.monotonic())
+        return func()
+
+    def _failed(self, func, item, attempt, error):
+        """记录一次失败，返回是否还可以重试"""
+        if attempt <= self.retries:
+            self.counts['retries'] += 1
+            return True
+        self.counts['errors'] += 1
+        log.warning(f"{getattr(func, '__name__', func)}({item}) 请求失败: {error!r}")
+        return False
+
+    def map(self, func, items, item_arg=None, **kwargs):
+        """
+        对 items 中的每一项调用 func
+
+        参数:
+            func: 平台接口
+            items: 每次调用的参数（股票代码或股票列表）
+            item_arg: items 作为哪个关键字参数传入；None 表示作为第一个位置参数
+            kwargs: 每次调用共用的其他参数
+        返回:
+            结果列表，与 items 同序；重试后仍失败的为 None
+        """
+        items = list(items)
+        results = [None] * len(items)
+        for i, result in self.imap(func, items, item_arg, **kwargs):
+            results[i] = result
+        return results
+
+    def imap(self, func, items, item_arg=None, **kwargs):
+        """
+        与 map 相同，但按完成顺序逐个产出 (序号, 结果)，调用方可以边取边处理，
+        不必同时持有全部结果；重试后仍失败的项不产出
+        """
+        items = list(items)
+
+        def call(item):
+            if item_arg is None:
+                return functools.partial(func, item, **kwargs)
+            return functools.partial(func, **{item_arg: item}, **kwargs)
+
+        if len(items) <= 1 or self.max_workers <= 1:
+            for i, item in enumerate(items):
+                attempt = 0
+                while True:
+                    self.counts['calls'] += 1
+                    try:
+                        result = call(item)()
+                    except Exception as e:
+                        attempt += 1
+                        if not self._failed(func, item, attempt, e):
+                            break
+                        time.sleep(self.backoff * 2 ** (attempt - 1))
+                        continue
+                    yield i, result
+                    del result      # 请求下一项时不再持有已产出的结果
+                    break
+            return
+
+        pool = self._executor()
+        budget = self.timeout * (self.retries + 1) + self.backoff * (2 ** self.retries - 1)
+        expires = [time.monotonic() + budget] * len(items)     # 每一项的总时限
+        attempts = [0] * len(items)
+        pending = {}            # future -> (序号, [开始时间])
+        retry_queue = []        # (重试时间, 序号)
+        abandoned = False       # 是否有调用超时后仍占着线程
+
+        def submit(i):
+            started = []
+            future = pool.submit(self._call, call(items[i]), started)
+            pending[future] = (i, started)
+            self._futures.add(future)
+            self.counts['calls'] += 1
+
+        def settle(future):
+            self._futures.discard(future)
+            return pending.pop(future)
+
+        def failed(i, error):
+            attempts[i] += 1
+            if self._failed(func, items[i], attempts[i], error):
+                heapq.heappush(retry_queue, (time.monotonic() + self.backoff * 2 ** (attempts[i] - 1), i))
+
+        def expired(i):
+            self.counts['timeouts'] += 1
+            self._failed(func, items[i], self.retries + 1, TimeoutError(f'超过总时限 {budget:.1f} 秒'))
+
+        for i in range(len(items)):
+            submit(i)
+        while pending or retry_queue:
+            now = time.monotonic()
+            while retry_queue and retry_queue[0][0] <= now:
+                i = heapq.heappop(retry_queue)[1]
+                if now < expires[i]:
+                    submit(i)
+                else:
+                    expired(i)
+            if not pending:
+                if retry_queue:
+                    time.sleep(max(retry_queue[0][0] - now, 0))
+                continue
+
+            # 等到有调用完成、最早开始的调用超时、某一项到达总时限或最早的重试到期
+            deadlines = [started[0] + self.timeout for _, started in pending.values() if started]
+            deadlines += [expires[i] for i, _ in pending.values()]
+            if retry_queue:
+                deadlines.append(retry_queue[0][0])
+            done, _ = wait(pending, timeout=max(min(deadlines) - now, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                i, _ = settle(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed(i, e)
+                    continue
+                yield i, result
+
+            now = time.monotonic()
+            for future, (i, started) in list(pending.items()):
+                if now >= expires[i]:
+                    # 到达总时限：还在排队的取消，已开始的放弃
+                    settle(future)
+                    if not future.cancel() and not future.done():
+                        abandoned = True
+                    expired(i)
+                elif started and now - started[0] > self.timeout:
+                    settle(future)
+                    abandoned = True
+                    self.counts['timeouts'] += 1
+                    failed(i, TimeoutError(f'超过 {self.timeout} 秒'))
+        if abandoned:
+            self._discard_pool()
+
+    def chunks(self, stock_list):
+        """把股票列表按 chunk_size 分块"""
+        size = max(int(self.chunk_size), 1)
+        return [stock_list[i:i + size] for i in range(0, len(stock_list), size)]
+
+
+# 并发请求层在整个运行期间常驻，每个交易日开盘前由 reset_daily_cache 按 g.fetch_* 设置
+_fetcher = ConcurrentFetcher()
+
+
+def _bulk_query(func, stock_list, **kwargs):
+    """
+    批量调用平台接口，返回 {股票: 结果}
+
+    股票列表按 chunk_size 分块并发请求；某一块重试后仍失败时改为逐只并发请求，
+    单只股票的失败不影响其他股票。仍然失败的股票没有结果（不被过滤），失败次数计入 _fetcher.counts
+    """
+    if not stock_list:
+        return {}
+    chunks = _fetcher.chunks(list(stock_list))
+    result = {}
+    for chunk, part in zip(chunks, _fetcher.map(func, chunks, **kwargs)):
+        if part is None and len(chunk) > 1:
+            for single in _fetcher.map(func, chunk, **kwargs):
+                result.update(single or {})
+        else:
+            result.update(part or {})
     return result
 
 
+def get_st_flags(stock_list):
+    """批量获取ST/退市标记（ST状态或名称中含ST、*、退），按日缓存"""
+    cache = _daily_cache['st']
+    missing = [stock for stock in stock_list if stock not in cache]
+    if missing:
+        status = _bulk_query(get_stock_status, missing, query_type='ST')
+        names = _bulk_query(get_stock_name, missing)
+        for stock in missing:
+            name = names.get(stock) or ''
+            cache[stock] = bool(status.get(stock)) or 'ST' in name or '*' in name or '退' in name
+    return np.array([cache[stock] for stock in stock_list], dtype=bool)
+
+
+def get_listed_dates(stock_list):
+    """
+    批量获取上市日期 (datetime64[D]，未知为NaT)；上市日期不会变化，跨日缓存在成分跟踪器中，只查询新出现的股票。
+    查询失败或没有上市日期的股票不缓存，下次调用时重新查询
+    """
+    def fetch(missing):
+        info = _bulk_query(get_stock_info, missing, field=['listed_date'])
+        dates = [(info.get(stock) or {}).get('listed_date') for stock in missing]
+        return [np.datetime64(date, 'D') if date else None for date in dates]
+    return _constituents.verdicts('listed_date', stock_list, fetch).astype('datetime64[D]')
+
+
+def get_halt_flags(stock_list):
+    """批量获取停牌标记，按日缓存"""
+    cache = _daily_cache['halt']
+    missing = [stock for stock in stock_list if stock not in cache]
+    if missing:
+        status = _bulk_query(get_stock_status, missing, query_type='HALT')
+        for stock in missing:
+            cache[stock] = bool(status.get(stock))
+    return np.array([cache[stock] for stock in stock_list], dtype=bool)
+
+
+def _history_last(hist, stock_list, fields):
+    """把多股票 get_history 的返回统一为 index=股票, columns=fields 的最新一根K线"""
+    if hist is None or len(hist) == 0:
+        return pd.DataFrame(np.nan, index=stock_list, columns=fields)
+    if isinstance(hist, dict):
+        last = pd.DataFrame({stock: pd.DataFrame(v)[fields].iloc[-1] for stock, v in hist.items() if len(v) > 0}).T
+    elif 'code' in hist.columns:
+        last = hist.groupby('code')[fields].last()
+    else:
+        # 单只股票时返回普通的时间序列表
+        last = pd.DataFrame([hist[fields].iloc[-1].values], index=stock_list[:1], columns=fields)
+    return last.reindex(stock_list).astype(float)
+
+
+class QuoteCache:
+    """
+    盘中行情缓存 (按交易日清空)
+
+    一次请求获取整个股票列表的最新价、涨停价、跌停价 (实盘用 get_snapshot，回测用1分钟K线)，
+    结果在 ttl 秒内供涨跌停过滤、调仓和涨停监控共用；只有缺失或过期的股票才会再次请求。
+    价格按股票编号保存在预分配的 numpy 数组中，涨停/跌停判断对整个列表向量化完成。
+    hits / misses 按股票计数，fetches 为实际请求次数
+    """
+
+    def __init__(self, ttl=3, capacity=1024):
+        self.ttl = ttl
+        self._index = {}
+        self._time = np.full(capacity, -np.inf)     # 取价时间戳 (秒)
+        self._prices = np.full((capacity, 3), np.nan)
+        self.hits = self.misses = self.fetches = 0
+
+    def reset(self):
+        """清空缓存与计数 (交易日切换时调用)"""
+        self._index = {}
+        self._time[:] = -np.inf
+        self._prices[:] = np.nan
+        self.hits = self.misses = self.fetches = 0
+
+    def _rows(self, stock_list):
+        """股票在缓存数组中的行号，新股票追加到末尾 (容量不足时翻倍扩容)"""
+        index = self._index
+        for stock in stock_list:
+            if stock not in index:
+                index[stock] = len(index)
+        if len(index) > len(self._time):
+            capacity = max(len(index), 2 * len(self._time))
+            self._time = np.concatenate([self._time, np.full(capacity - len(self._time), -np.inf)])
+            self._prices = np.vstack([self._prices, np.full((capacity - len(self._prices), 3), np.nan)])
+        return np.array([index[stock] for stock in stock_list], dtype=np.int64)
+
+    @staticmethod
+    def _fetch(stock_list):
+        """一次请求获取 (股票数, 3) 的最新价/涨停价/跌停价，无数据为NaN"""
+        if is_trade():
+            snapshot = _bulk_query(get_snapshot, stock_list)
+            values = np.full((len(stock_list), 3), np.nan)
+            for i, stock in enumerate(stock_list):
+                quote = snapshot.get(stock)
+                if quote:
+                    values[i] = [quote.get('last_px') or np.nan,
+                                 quote.get('high_limit') or quote.get('up_px') or np.nan,
+                                 quote.get('low_limit') or quote.get('down_px') or np.nan]
+            return values
+        fields = ['close', 'high_limit', 'low_limit']
+        try:
+            hist = get_history(1, '1m', fields, security_list=stock_list, include=True)
+        except Exception as e:
+            log.debug(f"批量获取涨跌停价出错: {e}")
+            hist = None
+        return _history_last(hist, stock_list, fields).values
+
+    def lookup(self, stock_list, now):
+        """
+        获取最新价、涨停价、跌停价
+
+        参数:
+            stock_list: 股票列表
+            now: 当前时间 (datetime)，取价超过 ttl 秒的股票重新请求
+        返回:
+            (last, high_limit, low_limit) 三个数组，顺序与 stock_list 一致，无数据为NaN
+        """
+        stock_list = list(stock_list)
+        if not stock_list:
+            empty = np.empty(0)
+            return empty, empty, empty
+        rows = self._rows(stock_list)
+        stamp = now.timestamp()
+        stale = stamp - self._time[rows] >= self.ttl
+        n_stale = int(stale.sum())
+        self.hits += len(rows) - n_stale
+        self.misses += n_stale
+        if n_stale:
+            # 同一列表中重复的股票只请求一次
+            fetch_rows, first = np.unique(rows[stale], return_index=True)
+            self._prices[fetch_rows] = self._fetch([stock_list[i] for i in np.flatnonzero(stale)[first]])
+            self._time[fetch_rows] = stamp
+            self.fetches += 1
+        prices = self._prices[rows]
+        return prices[:, 0], prices[:, 1], prices[:, 2]
+
+    @staticmethod
+    def at_limit(last, high_limit, low_limit):
+        """
+        向量化判断是否涨停 / 跌停 (允许0.1%误差)
+
+        返回:
+            (limit_up, limit_down) 两个布尔数组；无行情数据的股票均为False
+        """
+        valid = last > 0
+        limit_up = valid & (high_limit > 0) & (last >= high_limit * 0.999)
+        limit_down = valid & (low_limit > 0) & (last <= low_limit * 1.001)
+        return limit_up, limit_down
+
+    def limit_masks(self, stock_list, now):
+        """按缓存行情判断 stock_list 是否涨停 / 跌停，返回 (limit_up, limit_down)"""
+        return self.at_limit(*self.lookup(stock_list, now))
+
+    def stats(self):
+        """当日命中/未命中/请求次数"""
+        return {'hits': self.hits, 'misses': self.misses, 'fetches': self.fetches}
+
+
+# 行情缓存在整个运行期间常驻，每个交易日开盘前由 reset_daily_cache 清空
+_quote_cache = QuoteCache()
+
+
+def filter_stock_batch(context, stock_list, paused=False, st=False, new=False, limitup=False, limitdown=False):
+    """
+    批量过滤股票：每类数据整表只请求一次，过滤用布尔掩码完成
+
+    参数:
+        context: 上下文对象，只有过滤次新股和涨跌停时需要，其余可传 None
+        stock_list: 股票列表
+        paused / st / new / limitup / limitdown: 是否过滤停牌 / ST / 次新 / 涨停 / 跌停
+    返回:
+        过滤后的股票列表（保持原顺序）；接口缺失数据的股票不被过滤
+    """
+    if not stock_list:
+        return []
+
+    stocks = np.array(stock_list, dtype=object)
+    keep = np.ones(len(stocks), dtype=bool)
+
+    if st:
+        keep &= ~get_st_flags(list(stocks))
+
+    if new and keep.any():
+        # 过滤上市不满375天的次新股
+        listed = get_listed_dates(list(stocks[keep]))
+        yesterday = np.datetime64(get_previous_date(context), 'D')
+        keep[keep] = np.isnat(listed) | ((yesterday - listed).astype(int) >= 375)
+
+    if paused and keep.any():
+        keep[keep] = ~get_halt_flags(list(stocks[keep]))
+
+    if (limitup or limitdown) and keep.any():
+        # 已持仓的股票不做涨跌停过滤
+        check = keep & ~np.isin(stocks, list(get_positions()))
+        if check.any():
+            limit_up, limit_down = _quote_cache.limit_masks(list(stocks[check]), context.blotter.current_dt)
+            ok = np.ones(len(limit_up), dtype=bool)
+            if limitup:
+                ok &= ~limit_up
+            if limitdown:
+                ok &= ~limit_down
+            keep[check] = ok
+
+    return stocks[keep].tolist()
+
+
+# 2-1 过滤停牌股票
+def filter_paused_stock(stock_list):
+    """过滤停牌股票"""
+    return filter_stock_batch(None, stock_list, paused=True)
+
+
 # 2-2 过滤ST及其他具有退市标签的股票
 def filter_st_stock(stock_list):
     """过滤ST股票"""
-    if not stock_list:
-        return []
-    
-    result = []
-    for stock in stock_list:
-        try:
-            # PTrade: 使用get_stock_status检查ST状态
-            status = get_stock_status(stock, query_type='ST')
-            if status and stock in status:
-                if not status[stock]:  # False表示非ST
-                    # 再检查股票名称
-                    name_info = get_stock_name(stock)
-                    if name_info and stock in name_info:
-                        name = name_info[stock]
-                        if name and 'ST' not in name and '*' not in name and '退' not in name:
-                            result.append(stock)
-                    else:
-                        result.append(stock)
-            else:
-                result.append(stock)
-        except:
-            result.append(stock)
-    
-    return result
+    return filter_stock_batch(None, stock_list, st=True)
 
 
 # 2-3 过滤科创北交股票
@@ -478,98 +1563,144 @@ def filter_kcbj_stock(stock_list):
 # 2-4 过滤涨停的股票
 def filter_limitup_stock(context, stock_list):
     """过滤涨停股票（非持仓）"""
-    if not stock_list:
-        return []
-    
-    positions = get_positions()
-    result = []
-    
-    for stock in stock_list:
-        if stock in positions:
-            result.append(stock)
-            continue
-        
-        try:
-            # 获取最新价和涨停价
-            hist = get_history(1, '1m', ['close', 'high_limit'], security_list=stock, include=True)
-            if hist is not None and len(hist) > 0:
-                close = hist['close'].iloc[-1] if 'close' in hist.columns else hist.iloc[-1, 0]
-                high_limit = hist['high_limit'].iloc[-1] if 'high_limit' in hist.columns else hist.iloc[-1, 1]
-                if close < high_limit * 0.999:
-                    result.append(stock)
-            else:
-                result.append(stock)
-        except:
-            result.append(stock)
-    
-    return result
+    return filter_stock_batch(context, stock_list, limitup=True)
 
 
 # 2-5 过滤跌停的股票
 def filter_limitdown_stock(context, stock_list):
     """过滤跌停股票（非持仓）"""
-    if not stock_list:
-        return []
-    
-    positions = get_positions()
-    result = []
-    
-    for stock in stock_list:
-        if stock in positions:
-            result.append(stock)
-            continue
-        
-        try:
-            # 获取最新价和跌停价
-            hist = get_history(1, '1m', ['close', 'low_limit'], security_list=stock, include=True)
-            if hist is not None and len(hist) > 0:
-                close = hist['close'].iloc[-1] if 'close' in hist.columns else hist.iloc[-1, 0]
-                low_limit = hist['low_limit'].iloc[-1] if 'low_limit' in hist.columns else hist.iloc[-1, 1]
-                if close > low_limit * 1.001:
-                    result.append(stock)
-            else:
-                result.append(stock)
-        except:
-            result.append(stock)
-    
-    return result
+    return filter_stock_batch(context, stock_list, limitdown=True)
 
 
 # 2-6 过滤次新股
 def filter_new_stock(context, stock_list):
     """过滤次新股（上市不满375天）"""
-    if not stock_list:
-        return []
-    
-    yesterday = get_previous_date(context)
-    result = []
-    
-    for stock in stock_list:
-        try:
-            # PTrade: 使用get_stock_info获取上市日期
-            info = get_stock_info(stock, field=['listed_date'])
-            if info and stock in info:
-                listed_date_str = info[stock].get('listed_date', '')
-                if listed_date_str:
-                    listed_date = datetime.datetime.strptime(listed_date_str, '%Y-%m-%d').date()
-                    if hasattr(yesterday, 'date'):
-                        yesterday_date = yesterday
-                    else:
-                        yesterday_date = datetime.datetime.strptime(str(yesterday), '%Y-%m-%d').date()
-                    
-                    if (yesterday_date - listed_date).days >= 375:
-                        result.append(stock)
-                else:
-                    result.append(stock)
-            else:
-                result.append(stock)
-        except:
-            result.append(stock)
-    
-    return result
+    return filter_stock_batch(context, stock_list, new=True)
 
 
-def judge_market_env(context, ma_window=20, slope_window=5):
+class MarketEnvClassifier:
+    """
+    市场环境分类器 (带缓存的增量版 judge_market_env)
+
+    缓存上证+深证成交额与中证银行指数收盘价，每次只追加上次之后的新K线，
+    并增量更新成交额 ma_window 日均线、slope_window 日均线变化率和银行指数
+    ma_window 日涨幅。regime 为逐日预先算好的"存量"标记数组，回测时可直接查询
+    """
+
+    def __init__(self, ma_window=20, slope_window=5, turnover_cut=0.1, bank_cut=0.9, history_start=None):
+        self.ma_window = ma_window
+        self.slope_window = slope_window
+        self.turnover_cut = turnover_cut
+        self.bank_cut = bank_cut
+        self.history_start = history_start  # 研究模式从该日期起加载全部历史；None 只加载判断所需的K线
+        self._n = 0
+        self._dates = np.empty(0, dtype='datetime64[D]')
+        self._csum = np.zeros(1)       # 成交额累加和 (首位为0)
+        self._bank = np.empty(0)
+        self._change = np.empty(0)     # 成交额均线 slope_window 日变化率
+        self._bank_return = np.empty(0)
+        self._regime = np.empty(0, dtype=bool)
+
+    @property
+    def dates(self):
+        return self._dates[:self._n]
+
+    @property
+    def regime(self):
+        """逐日"存量"标记 (True 为存量)，与 dates 对齐；数据不足的日期为 False"""
+        return self._regime[:self._n]
+
+    def _grow(self, size):
+        """按倍数扩容，保证逐日追加为均摊 O(1)"""
+        if size <= len(self._dates):
+            return
+        capacity = max(size, 2 * len(self._dates), 64)
+        def extend(arr, fill, extra=0):
+            out = np.full(capacity + extra, fill, dtype=arr.dtype)
+            out[:len(arr)] = arr
+            return out
+        self._dates = extend(self._dates, np.datetime64('NaT'))
+        self._csum = extend(self._csum, 0.0, extra=1)
+        self._bank = extend(self._bank, np.nan)
+        self._change = extend(self._change, np.nan)
+        self._bank_return = extend(self._bank_return, np.nan)
+        self._regime = extend(self._regime, False)
+
+    def append(self, dates, money, bank_close):
+        """追加新交易日的全市场成交额和银行指数收盘价，并增量计算指标"""
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        if self._n > 0:
+            fresh = dates > self._dates[self._n - 1]
+            dates, money, bank_close = dates[fresh], np.asarray(money)[fresh], np.asarray(bank_close)[fresh]
+        k = len(dates)
+        if k == 0:
+            return
+        n0, n1 = self._n, self._n + k
+        self._grow(n1)
+        self._dates[n0:n1] = dates
+        self._csum[n0 + 1:n1 + 1] = self._csum[n0] + np.cumsum(money)
+        self._bank[n0:n1] = bank_close
+        self._n = n1
+
+        w, s = self.ma_window, self.slope_window
+        t = np.arange(n0, n1)
+        # 成交额均线及其 slope_window 日变化率
+        prev = t - s
+        ok = prev >= w - 1
+        ma_now = (self._csum[t + 1] - self._csum[np.maximum(t + 1 - w, 0)]) / w
+        ma_prev = (self._csum[np.maximum(prev + 1, 0)] - self._csum[np.maximum(prev + 1 - w, 0)]) / w
+        self._change[t] = np.where(ok, (ma_now - ma_prev) / np.where(ok, ma_prev, 1.0), np.nan)
+        # 银行指数 ma_window 日涨幅 (首尾收盘价之比)
+        start = t - w + 1
+        self._bank_return[t] = np.where(start >= 0, self._bank[t] / self._bank[np.maximum(start, 0)], np.nan)
+        # 判断市场环境
+        with np.errstate(invalid='ignore'):
+            ready = ok & (start >= 0)
+            self._regime[t] = ready & ((self._change[t] <= self.turnover_cut) | (self._bank_return[t] <= self.bank_cut))
+
+    def update(self, end_date):
+        """从平台补齐截至 end_date 的新K线 (三次 get_price，只请求缓存之后的日期)"""
+        end_str = end_date.strftime('%Y%m%d') if hasattr(end_date, 'strftime') else str(end_date).replace('-', '')
+        if self._n > 0 and self._dates[self._n - 1] >= np.datetime64(pd.Timestamp(end_str).date(), 'D'):
+            return
+        
+        if self._n > 0:
+            start = pd.Timestamp(self._dates[self._n - 1]) + pd.Timedelta(days=1)
+            kwargs = {'start_date': start.strftime('%Y%m%d')}
+        elif self.history_start is not None:
+            kwargs = {'start_date': str(self.history_start).replace('-', '')}
+        else:
+            kwargs = {'count': self.ma_window + self.slope_window}
+        
+        # 获取上证指数和深证成指的成交额、中证银行指数 (399986.SZ) 收盘价
+        sh_data = get_price('000001.SS', end_date=end_str, frequency='1d', fields=['money'], **kwargs)
+        sz_data = get_price('399001.SZ', end_date=end_str, frequency='1d', fields=['money'], **kwargs)
+        bank_data = get_price('399986.SZ', end_date=end_str, frequency='1d', fields=['close'], **kwargs)
+        if sh_data is None or sz_data is None or bank_data is None:
+            return
+        
+        df = pd.concat([sh_data['money'], sz_data['money'], bank_data['close']], axis=1, join='inner').dropna()
+        if len(df) == 0:
+            return
+        self.append(pd.to_datetime(df.index).values, df.iloc[:, 0].values + df.iloc[:, 1].values, df.iloc[:, 2].values)
+
+    def judge(self, date):
+        """返回 date (含) 之前最近一个交易日的市场环境：'存量' 或 None"""
+        i = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(str(date)).date(), 'D'), side='right') - 1
+        if i < 0 or np.isnan(self._change[i]) or np.isnan(self._bank_return[i]):
+            return None
+        return '存量' if self._regime[i] else None
+
+    def regime_series(self):
+        """全部历史的市场环境序列 (index=日期, 值为'存量'或None)"""
+        return pd.Series(np.where(self.regime, '存量', None), index=pd.to_datetime(self.dates))
+
+
+# 每组参数一个常驻分类器
+_market_env_classifiers = {}
+
+
+def judge_market_env(context, ma_window=20, slope_window=5, turnover_cut=0.1, bank_cut=0.9):
     """
     判断市场环境
     
@@ -580,49 +1711,14 @@ def judge_market_env(context, ma_window=20, slope_window=5):
     - 全市场成交额趋势下跌 + 银行指数下跌 : 熊市/退潮市场
     """
     yesterday = get_previous_date(context)
-    yesterday_str = yesterday.strftime('%Y%m%d') if hasattr(yesterday, 'strftime') else str(yesterday).replace('-', '')
     
     try:
-        trade_days = get_trade_days(end_date=yesterday_str, count=ma_window + slope_window)
-        if len(trade_days) < ma_window + slope_window:
-            return None
-        
-        start_date = trade_days[0]
-        start_date_str = start_date.strftime('%Y%m%d') if hasattr(start_date, 'strftime') else str(start_date).replace('-', '')
-        
-        # 获取上证指数和深证成指的成交额
-        sh_data = get_price('000001.SS', start_date=start_date_str, end_date=yesterday_str, 
-                           frequency='1d', fields=['money'])
-        sz_data = get_price('399001.SZ', start_date=start_date_str, end_date=yesterday_str, 
-                           frequency='1d', fields=['money'])
-        
-        if sh_data is None or sz_data is None:
-            return None
-        
-        total_money = sh_data['money'] + sz_data['money']
-        
-        # 计算成交额MA
-        ma_total = total_money.rolling(ma_window).mean().dropna()
-        if len(ma_total) < slope_window + 1:
-            return None
-        
-        change_total = (ma_total.iloc[-1] - ma_total.iloc[-slope_window - 1]) / ma_total.iloc[-slope_window - 1]
-        
-        # 获取银行指数数据 (中证银行: 399986.SZ)
-        bank_data = get_price('399986.SZ', end_date=yesterday_str, frequency='1d', 
-                             fields=['close'], count=ma_window)
-        
-        if bank_data is None or len(bank_data) < ma_window:
-            return None
-        
-        close_prices = bank_data['close']
-        bank_return = close_prices.iloc[-1] / close_prices.iloc[0]
-        
-        # 判断市场环境
-        if change_total <= 0.1 or bank_return <= 0.9:
-            return '存量'
-        
-        return None
+        key = (ma_window, slope_window, turnover_cut, bank_cut)
+        if key not in _market_env_classifiers:
+            _market_env_classifiers[key] = MarketEnvClassifier(ma_window, slope_window, turnover_cut, bank_cut)
+        classifier = _market_env_classifiers[key]
+        classifier.update(yesterday)
+        return classifier.judge(yesterday)
         
     except Exception as e:
         log.debug(f"判断市场环境出错: {e}")
@@ -638,4 +1734,9 @@ def after_trading_end(context, data):
     """盘后函数"""
     log.info(f"====== 交易日结束 ======")
     log.info(f"持仓数量: {len(get_positions())}")
-    log.info(f"总资产: {context.portfolio.portfolio_value:.2f}")
\ No newline at end of file
+    log.info(f"总资产: {context.portfolio.portfolio_value:.2f}")
+    stats = _quote_cache.stats()
+    log.info(f"行情缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 请求 {stats['fetches']} 次")
+    counts = _fetcher.counts
+    log.info(f"数据请求累计: 调用 {counts['calls']} 次, 重试 {counts['retries']} 次, "
+             f"超时 {counts['timeouts']} 次, 失败 {counts['errors']} 次")
\ No newline at end of file
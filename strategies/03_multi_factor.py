@@ -10,8 +10,13 @@
 # 7. 回测时间2005-1-01到2016-12-31回测结果450.95%
 
 import numpy as np
-from math import isnan
+import pandas as pd
 import datetime
+import functools
+import heapq
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 '''
 ================================================================================
@@ -24,6 +29,7 @@ def initialize(context):
     set_params()        # 1.设置策略参数
     set_variables()     # 2.设置中间变量
     set_backtest()      # 3.设置回测条件
+    set_fetcher()       # 4.设置并发数据请求
 
 
 def set_params():
@@ -31,8 +37,9 @@ def set_params():
     g.tc = 15           # 调仓频率（天）
     g.yb = 63           # 样本长度（天）
     g.N = 20            # 持仓数目
-    # 用户选出来的因子（使用PTrade的valuation表字段）
+    # 用户选出来的因子（见因子注册表 FACTORS：valuation表字段及衍生因子）
     # market_cap对应total_value(A股总市值), roe在valuation表中可获取
+    # 衍生因子：momentum / volatility / turnover (g.yb天), ep / bp, roe_growth
     g.factors = ["total_value", "roe"]
     # 因子等权重：1表示因子值越小越好，-1表示因子值越大越好
     # 市值小优先(1)，ROE大优先(-1)
@@ -55,6 +62,15 @@ def set_backtest():
     set_fixed_slippage(fixedslippage=0.0)
 
 
+def set_fetcher():
+    """设置并发数据请求参数：并发数 / 单次超时 (秒) / 重试次数 / 首次重试等待 (秒) / 每次请求的股票数"""
+    g.fetch_workers = 16
+    g.fetch_timeout = 10.0
+    g.fetch_retries = 2
+    g.fetch_backoff = 0.2
+    g.fetch_chunk_size = 500
+
+
 '''
 ================================================================================
 每天开盘前
@@ -63,6 +79,9 @@ def set_backtest():
 
 def before_trading_start(context, data):
     """每天开盘前要做的事情"""
+    # 按 g 上的当前参数设置并发请求层（参数可在 initialize 之后被覆盖）
+    _fetcher.configure(max_workers=g.fetch_workers, timeout=g.fetch_timeout, retries=g.fetch_retries,
+                       backoff=g.fetch_backoff, chunk_size=g.fetch_chunk_size)
     if g.t % g.tc == 0:
         # 每g.tc天，交易一次
         g.if_trade = True
@@ -70,11 +89,445 @@ def before_trading_start(context, data):
         set_slip_fee(context)
         # 设置可行股票池：获得当前开盘的沪深300股票池并剔除停牌股票
         # PTrade中沪深300指数代码为 000300.SS 或 399300.SZ
-        hs300_stocks = get_index_stocks('000300.SS')
+        # 成分未变时停牌筛选只请求新增的K线，成分调整时只为新加入的股票请求完整窗口
+        hs300_stocks = _constituents.update('000300.SS', context.blotter.current_dt)
         g.all_stocks = set_feasible_stocks(hs300_stocks, g.yb, context)
     g.t += 1
 
 
+def _history_frame(hist, stock_list, field):
+    """
+    把多股票 get_history 的返回整理为列按 stock_list 排列的 (K线, 股票) DataFrame
+    
+    返回:
+        (DataFrame, 股票是否有数据的布尔数组)，缺失的股票整列为NaN；返回为空时 DataFrame 为 None
+    """
+    if hist is None or len(hist) == 0:
+        return None, np.zeros(len(stock_list), dtype=bool)
+    if 'code' in hist.columns:
+        hist = hist.assign(date=hist.index).pivot(index='date', columns='code', values=field)
+    elif field in hist.columns and len(stock_list) == 1:
+        # 单股票返回时列名为字段名
+        hist = hist[[field]].set_axis(stock_list, axis=1)
+    present = np.isin(stock_list, hist.columns)
+    return hist.reindex(columns=stock_list), present
+
+
+def _history_matrix(hist, stock_list, field):
+    """
+    把多股票 get_history 的返回整理为 (K线, 股票) 矩阵
+    
+    返回:
+        (float64矩阵, 股票是否有数据的布尔数组)，缺失的股票整列为NaN
+    """
+    frame, present = _history_frame(hist, stock_list, field)
+    if frame is None:
+        return np.full((0, len(stock_list)), np.nan), present
+    return frame.values.astype(float), present
+
+
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+class ConcurrentFetcher:
+    """
+    有界并发的数据请求层
+
+    把相互独立的平台调用（逐只股票，或按 chunk_size 分块的股票列表）放进线程池并发执行：
+    同时在途的调用不超过 max_workers 个；单次调用超过 timeout 秒视为超时（平台调用无法取消，超时的调用被放弃）；
+    失败或超时后按 backoff * 2^k 秒退避重试，最多 retries 次；结果按输入顺序组装。
+    每一项从提交起另有总时限 timeout * (retries + 1) 加各次退避（含排队等待），到期仍未成功即失败，
+    即使所有线程都卡在不返回的调用上也不会无限等待；有调用被放弃时，本次结束后关闭线程池（不等待
+    卡住的线程、取消排队的调用），之后的请求使用新线程池。
+    重试后仍失败的调用返回 None，写入日志并计入 counts，不再被静默吞掉。
+    只有一个调用或 max_workers <= 1 时在当前线程顺序执行（不限时）
+    """
+
+    def __init__(self, max_workers=16, timeout=10.0, retries=2, backoff=0.2, chunk_size=500):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_size = chunk_size
+        self.counts = {'calls': 0, 'retries': 0, 'timeouts': 0, 'errors': 0}
+        self._pool = None
+        self._pool_size = 0
+        self._futures = set()   # 已提交到当前线程池、尚未处理完的调用
+
+    def configure(self, **params):
+        for name, value in params.items():
+            setattr(self, name, value)
+
+    def _executor(self):
+        if self._pool is None or self._pool_size != self.max_workers:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix='fetch')
+            self._pool_size = self.max_workers
+        return self._pool
+
+    def _discard_pool(self):
+        """关闭当前线程池：不等待卡住的线程，取消尚未开始的调用 (自行取消，shutdown 的 cancel_futures 需要 Python 3.9)"""
+        if self._pool is not None:
+            for future in self._futures:
+                future.cancel()
+            self._futures.clear()
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    @staticmethod
+    def _call(func, started):
+        started.append(time.monotonic())
+        return func()
+
+    def _failed(self, func, item, attempt, error):
+        """记录一次失败，返回是否还可以重试"""
+        if attempt <= self.retries:
+            self.counts['retries'] += 1
+            return True
+        self.counts['errors'] += 1
+        log.warning(f"{getattr(func, '__name__', func)}({item}) 请求失败: {error!r}")
+        return False
+
+    def map(self, func, items, item_arg=None, **kwargs):
+        """
+        对 items 中的每一项调用 func
+
+        参数:
+            func: 平台接口
+            items: 每次调用的参数（股票代码或股票列表）
+            item_arg: items 作为哪个关键字参数传入；None 表示作为第一个位置参数
+            kwargs: 每次调用共用的其他参数
+        返回:
+            结果列表，与 items 同序；重试后仍失败的为 None
+        """
+        items = list(items)
+        results = [None] * len(items)
+        for i, result in self.imap(func, items, item_arg, **kwargs):
+            results[i] = result
+        return results
+
+    def imap(self, func, items, item_arg=None, **kwargs):
+        """
+        与 map 相同，但按完成顺序逐个产出 (序号, 结果)，调用方可以边取边处理，
+        不必同时持有全部结果；重试后仍失败的项不产出
+        """
+        items = list(items)
+
+        def call(item):
+            if item_arg is None:
+                return functools.partial(func, item, **kwargs)
+            return functools.partial(func, **{item_arg: item}, **kwargs)
+
+        if len(items) <= 1 or self.max_workers <= 1:
+            for i, item in enumerate(items):
+                attempt = 0
+                while True:
+                    self.counts['calls'] += 1
+                    try:
+                        result = call(item)()
+                    except Exception as e:
+                        attempt += 1
+                        if not self._failed(func, item, attempt, e):
+                            break
+                        time.sleep(self.backoff * 2 ** (attempt - 1))
+                        continue
+                    yield i, result
+                    del result      # 请求下一项时不再持有已产出的结果
+                    break
+            return
+
+        pool = self._executor()
+        budget = self.timeout * (self.retries + 1) + self.backoff * (2 ** self.retries - 1)
+        expires = [time.monotonic() + budget] * len(items)     # 每一项的总时限
+        attempts = [0] * len(items)
+        pending = {}            # future -> (序号, [开始时间])
+        retry_queue = []        # (重试时间, 序号)
+        abandoned = False       # 是否有调用超时后仍占着线程
+
+        def submit(i):
+            started = []
+            future = pool.submit(self._call, call(items[i]), started)
+            pending[future] = (i, started)
+            self._futures.add(future)
+            self.counts['calls'] += 1
+
+        def settle(future):
+            self._futures.discard(future)
+            return pending.pop(future)
+
+        def failed(i, error):
+            attempts[i] += 1
+            if self._failed(func, items[i], attempts[i], error):
+                heapq.heappush(retry_queue, (time.monotonic() + self.backoff * 2 ** (attempts[i] - 1), i))
+
+        def expired(i):
+            self.counts['timeouts'] += 1
+            self._failed(func, items[i], self.retries + 1, TimeoutError(f'超过总时限 {budget:.1f} 秒'))
+
+        for i in range(len(items)):
+            submit(i)
+        while pending or retry_queue:
+            now = time.monotonic()
+            while retry_queue and retry_queue[0][0] <= now:
+                i = heapq.heappop(retry_queue)[1]
+                if now < expires[i]:
+                    submit(i)
+                else:
+                    expired(i)
+            if not pending:
+                if retry_queue:
+                    time.sleep(max(retry_queue[0][0] - now, 0))
+                continue
+
+            # 等到有调用完成、最早开始的调用超时、某一项到达总时限或最早的重试到期
+            deadlines = [started[0] + self.timeout for _, started in pending.values() if started]
+            deadlines += [expires[i] for i, _ in pending.values()]
+            if retry_queue:
+                deadlines.append(retry_queue[0][0])
+            done, _ = wait(pending, timeout=max(min(deadlines) - now, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                i, _ = settle(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed(i, e)
+                    continue
+                yield i, result
+
+            now = time.monotonic()
+            for future, (i, started) in list(pending.items()):
+                if now >= expires[i]:
+                    # 到达总时限：还在排队的取消，已开始的放弃
+                    settle(future)
+                    if not future.cancel() and not future.done():
+                        abandoned = True
+                    expired(i)
+                elif started and now - started[0] > self.timeout:
+                    settle(future)
+                    abandoned = True
+                    self.counts['timeouts'] += 1
+                    failed(i, TimeoutError(f'超过 {self.timeout} 秒'))
+        if abandoned:
+            self._discard_pool()
+
+    def chunks(self, stock_list):
+        """把股票列表按 chunk_size 分块"""
+        size = max(int(self.chunk_size), 1)
+        return [stock_list[i:i + size] for i in range(0, len(stock_list), size)]
+
+
+# 并发请求层在整个运行期间常驻，每天开盘前按 g.fetch_* 设置
+_fetcher = ConcurrentFetcher()
+
+
+def fetch_history_matrix(count, frequency, field, stock_list, **kwargs):
+    """
+    分块并发请求 get_history，按 stock_list 顺序拼成 (K线, 股票) 矩阵
+    
+    返回:
+        (float64矩阵, 股票是否有数据的布尔数组)；重试后仍失败的分块整列为NaN、记为无数据
+    """
+    stock_list = list(stock_list)
+    chunks = _fetcher.chunks(stock_list)
+    if len(chunks) <= 1:
+        # 只有一个分块时直接使用其矩阵，不再拷贝
+        hist, = _fetcher.map(get_history, [stock_list], item_arg='security_list', count=count,
+                             frequency=frequency, field=field, **kwargs)
+        return _history_matrix(hist, stock_list, field)
+
+    # 多个分块：每块返回后立即写入预分配的矩阵 (get_history 最多返回 count 根K线)，
+    # 各分块按最近一根K线对齐；直接从 DataFrame 写入，不为每块再生成中间矩阵
+    starts = np.cumsum([0] + [len(chunk) for chunk in chunks])
+    matrix = np.full((count, len(stock_list)), np.nan)
+    present = np.zeros(len(stock_list), dtype=bool)
+    rows = 0
+    for k, hist in _fetcher.imap(get_history, chunks, item_arg='security_list', count=count,
+                                 frequency=frequency, field=field, **kwargs):
+        frame, present[starts[k]:starts[k + 1]] = _history_frame(hist, chunks[k], field)
+        if frame is not None:
+            matrix[count - len(frame):, starts[k]:starts[k + 1]] = frame.to_numpy(dtype=float, copy=False)
+            rows = max(rows, len(frame))
+        del hist, frame     # 请求下一块时不再持有本块的数据
+    return matrix[count - rows:], present
+
+
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+class ConstituentTracker:
+    """
+    指数成分跟踪器
+    
+    同一指数同一交易日只请求一次 get_index_stocks，与上次的成分比较得到新增、剔除的股票，
+    并保存带日期的成分变动历史 (首期记全部成分，之后只在成分变化时记一条)。
+    verdicts 按名称缓存逐只股票不随时间变化的数据 (如上市日期)，只对缓存中没有的股票
+    (新加入的成分) 计算；暂时查不到的 (None) 不缓存，下次再查；被剔除的股票移出缓存。
+    需要整表重算时传 refresh=True，一次批量请求
+    """
+    
+    def __init__(self):
+        self._members = {}      # 指数 -> 最近一期成分 (平台返回顺序)
+        self._dates = {}        # 指数 -> 最近一次请求的日期 'YYYYMMDD'
+        self._delta = {}        # 指数 -> (新增, 剔除)
+        self._history = {}      # 指数 -> [(日期, 新增, 剔除)]
+        self._verdicts = {}     # 名称 -> {股票: 结果}
+    
+    def update(self, index_code, date):
+        """
+        获取 date 当日的成分股
+        
+        返回:
+            成分股列表；查询失败 (返回为空) 时返回空列表，不改变已记录的成分
+        """
+        date_str = date.strftime('%Y%m%d') if hasattr(date, 'strftime') else str(date).replace('-', '')
+        if self._dates.get(index_code) == date_str:
+            return list(self._members[index_code])
+        stocks = list(get_index_stocks(index_code, date_str) or [])
+        if not stocks:
+            return []
+        
+        previous = self._members.get(index_code)
+        if previous is None:
+            added, removed = stocks, []
+        else:
+            old, new = set(previous), set(stocks)
+            added = [stock for stock in stocks if stock not in old]
+            removed = [stock for stock in previous if stock not in new]
+            if added or removed:
+                log.info(f"{index_code} 成分变动: 新增 {len(added)} 只, 剔除 {len(removed)} 只")
+        if previous is None or added or removed:
+            self._history.setdefault(index_code, []).append((date_str, tuple(added), tuple(removed)))
+            self.forget(removed)
+        self._members[index_code] = stocks
+        self._dates[index_code] = date_str
+        self._delta[index_code] = (added, removed)
+        return list(stocks)
+    
+    def delta(self, index_code):
+        """最近一次 update 相对上一期的 (新增, 剔除)"""
+        return self._delta.get(index_code, ([], []))
+    
+    def members_on(self, index_code, date):
+        """按成分变动历史还原 date 当日 (含) 的成分股 (排序后的列表)"""
+        date_str = date.strftime('%Y%m%d') if hasattr(date, 'strftime') else str(date).replace('-', '')
+        members = set()
+        for day, added, removed in self._history.get(index_code, []):
+            if day > date_str:
+                break
+            members.update(added)
+            members.difference_update(removed)
+        return sorted(members)
+    
+    def verdicts(self, name, stock_list, compute, refresh=False):
+        """
+        逐只股票的缓存结果
+        
+        参数:
+            name: 缓存名称
+            compute: compute(股票列表)，返回与之对齐的结果序列，只对缓存中没有的股票调用；
+                     查询失败等暂时得不到结果的股票返回 None，不写入缓存，下次调用时重新计算
+            refresh: 是否清空缓存整表重算
+        返回:
+            与 stock_list 对齐的 ndarray (本次得不到结果的为 None)
+        """
+        cache = self._verdicts.setdefault(name, {})
+        if refresh:
+            cache.clear()
+        missing = [stock for stock in dict.fromkeys(stock_list) if stock not in cache]
+        pending = {}
+        if missing:
+            for stock, value in zip(missing, compute(missing)):
+                (pending if value is None else cache)[stock] = value
+        return np.array([cache[stock] if stock in cache else pending[stock] for stock in stock_list])
+    
+    def forget(self, stock_list):
+        """把股票移出全部缓存"""
+        for cache in self._verdicts.values():
+            for stock in stock_list:
+                cache.pop(stock, None)
+
+
+# 指数成分跟踪器在整个运行期间常驻
+_constituents = ConstituentTracker()
+
+
+class SuspensionScreener:
+    """
+    停牌筛选器
+    
+    对整个股票池一次请求成交量，并按股票维护"截至上次筛选（不含当日）连续非零成交量的天数"。
+    再次筛选时只请求上次之后新增的K线增量更新计数器，可行性判断为一次向量化比较；
+    适用于沪深300、中证800乃至全A股票池
+    """
+
+    def __init__(self):
+        self._index = {}                          # 股票 -> 计数器下标
+        self._streak = np.zeros(0, dtype=np.int64)
+        self._last_t = None                       # 上次筛选时的 g.t
+
+    @staticmethod
+    def _trailing_nonzero(vol):
+        """每列末尾连续非零成交量的K线数（NaN视为非零，与逐只判断 vol == 0 一致）"""
+        zero = vol == 0
+        n = len(vol)
+        if n == 0:
+            return np.zeros(vol.shape[1], dtype=np.int64)
+        last_zero = np.where(zero.any(axis=0), n - 1 - np.argmax(zero[::-1], axis=0), -1)
+        return n - 1 - last_zero
+
+    def screen(self, stock_list, days, t):
+        """
+        筛选最近days天及当日均未停牌的股票
+        
+        参数:
+            stock_list: 股票列表(list)
+            days: 样本天数(int)
+            t: 当前交易日序号（g.t），用于计算距上次筛选的交易日数
+        返回:
+            可行股票列表(list)
+        """
+        stocks = list(stock_list)
+        n = len(stocks)
+        streak = np.zeros(n, dtype=np.int64)
+        today_ok = np.zeros(n, dtype=bool)
+        present = np.zeros(n, dtype=bool)
+        
+        elapsed = None if self._last_t is None else t - self._last_t
+        tracked = np.array([stock in self._index for stock in stocks], dtype=bool)
+        if elapsed is None or elapsed > days:
+            tracked[:] = False
+        
+        # 已跟踪的股票：只取上次之后的新K线（多取1根为当日）
+        if tracked.any():
+            sub = [stocks[i] for i in np.flatnonzero(tracked)]
+            vol, ok = fetch_history_matrix(elapsed + 1, '1d', 'volume', sub, include=True)
+            prev = self._streak[[self._index[stock] for stock in sub]]
+            done = vol[:-1]
+            streak[tracked] = np.where((done == 0).any(axis=0), self._trailing_nonzero(done), prev + len(done))
+            today_ok[tracked] = vol[-1] != 0 if len(vol) > 0 else False
+            present[tracked] = ok
+        
+        # 新加入的股票：取完整的days+1根K线
+        fresh = ~tracked
+        if fresh.any():
+            sub = [stocks[i] for i in np.flatnonzero(fresh)]
+            vol, ok = fetch_history_matrix(days + 1, '1d', 'volume', sub, include=True)
+            streak[fresh] = self._trailing_nonzero(vol[:-1])
+            today_ok[fresh] = vol[-1] != 0 if len(vol) > 0 else False
+            present[fresh] = ok
+        
+        keep = np.flatnonzero(present)
+        self._index = {stocks[i]: k for k, i in enumerate(keep)}
+        self._streak = streak[keep]
+        self._last_t = t
+        
+        feasible = present & today_ok & (streak >= days)
+        return [stocks[i] for i in np.flatnonzero(feasible)]
+
+
+# 停牌筛选器在整个运行期间常驻
+_suspension_screener = SuspensionScreener()
+
+
 def set_feasible_stocks(stock_list, days, context):
     """
     设置可行股票池
@@ -90,36 +543,12 @@ def set_feasible_stocks(stock_list, days, context):
     if not stock_list:
         return []
     
-    feasible_stocks = []
-    
-    for stock in stock_list:
-        try:
-            # 使用get_history获取历史成交量，成交量为0表示停牌
-            # 多取1天用于判断当日是否停牌（include=True包含当日）
-            hist = get_history(days + 1, '1d', 'volume', security_list=stock, include=True)
-            
-            if hist is None or len(hist) == 0:
-                continue
-            
-            # 检查是否有停牌（成交量为0）
-            # 如果过去days+1天内没有任何停牌，则加入可行股票池
-            if 'volume' in hist.columns:
-                vol_data = hist['volume']
-            else:
-                vol_data = hist.iloc[:, 0]  # 单股票返回时列名可能不同
-            
-            # 统计成交量为0的天数
-            suspend_days = (vol_data == 0).sum()
-            
-            if suspend_days == 0:
-                feasible_stocks.append(stock)
-                
-        except Exception as e:
-            # 出错的股票跳过
-            log.debug(f"股票{stock}检查停牌出错: {e}")
-            continue
-    
-    return feasible_stocks
+    try:
+        # 使用get_history批量获取历史成交量，成交量为0表示停牌
+        return _suspension_screener.screen(stock_list, days, g.t)
+    except Exception as e:
+        log.error(f"检查停牌出错: {e}")
+        return []
 
 
 def set_slip_fee(context):
@@ -133,13 +562,16 @@ def set_slip_fee(context):
     
     if dt > datetime.datetime(2013, 1, 1):
         # 2013年后：买入万3，卖出万13（含印花税千1）
-        set_commission(commission_ratio=0.0003, min_commission=5.0)
+        g.commission_ratio = 0.0003
     elif dt > datetime.datetime(2011, 1, 1):
-        set_commission(commission_ratio=0.001, min_commission=5.0)
+        g.commission_ratio = 0.001
     elif dt > datetime.datetime(2009, 1, 1):
-        set_commission(commission_ratio=0.002, min_commission=5.0)
+        g.commission_ratio = 0.002
     else:
-        set_commission(commission_ratio=0.003, min_commission=5.0)
+        g.commission_ratio = 0.003
+    # 调仓计划按同样的费率估算成本
+    g.min_commission = 5.0
+    set_commission(commission_ratio=g.commission_ratio, min_commission=g.min_commission)
 
 
 '''
@@ -171,58 +603,138 @@ def handle_data(context, data):
             return
         
         # 计算每个股票的得分
-        points = np.dot(a, g.weights)
-        
-        # 复制股票代码
-        stock_sort = list(b[:])
-        
-        # 对股票的得分进行排名
-        points, stock_sort = bubble(points, stock_sort)
-        
-        # 取前N名的股票
-        toBuy = stock_sort[0:min(g.N, len(stock_sort))]
+        points = composite_score(a, g.weights)
         
-        # 对于不需要持仓的股票，全仓卖出
-        order_stock_sell(context, data, toBuy)
+        # 取得分前N名的股票
+        toBuy = select_top_n(points, b, g.N)
         
-        # 对于需要持仓的股票，按分配到的份额买入
-        order_stock_buy(context, data, toBuy)
+        # 不需要持仓的股票全仓卖出，需要持仓的股票按分配到的份额调整 (一次计划，先卖后买)
+        order_rebalance(context, toBuy)
     
     g.if_trade = False
 
 
-def order_stock_sell(context, data, toBuy):
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+def plan_rebalance(stocks, amounts, target_values, prices, cash, sellable=None, locked=None,
+                   lot=100, commission_ratio=0.0003, min_commission=5.0, tax=0.001):
     """
-    获得卖出信号，并执行卖出操作
+    调仓计划：一次向量化计算先卖后买的全部股数
+    
+    按目标市值换算整手股数，卖出释放的资金 (扣除佣金、印花税) 计入可用资金，
+    买入资金不足时按比例缩减，取整剩下的资金按缺口从大到小每只再补一手；
+    资金按每只股票的净买卖计算，对正在减仓的股票补一手即少卖一手
     
     参数:
-        context: 上下文对象
-        data: 数据对象
-        toBuy: 需要买入的股票列表
+        stocks: 股票列表 (当前持仓与目标股票的并集)
+        amounts: 当前持股数
+        target_values: 目标市值 (NaN 表示不调整)
+        prices: 当前价格
+        cash: 可用资金
+        sellable: 可卖股数 (T+1)，默认为全部持股
+        locked: 不调整的股票 (布尔数组)
+        lot: 每手股数
+        commission_ratio: 佣金费率
+        min_commission: 最低佣金
+        tax: 卖出印花税率
+    返回:
+        (调仓计划 DataFrame[index=股票, columns=amount/price/delta/target], 预计剩余资金)；
+        delta 为正表示买入、为负表示卖出
     """
-    # PTrade中使用get_positions()获取持仓
-    positions = get_positions()
+    amounts = np.asarray(amounts, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    target_values = np.asarray(target_values, dtype=np.float64)
+    sellable = amounts if sellable is None else np.minimum(np.asarray(sellable, dtype=np.int64), amounts)
+    locked = np.zeros(len(amounts), dtype=bool) if locked is None else np.asarray(locked, dtype=bool)
+    # 没有有效价格或目标市值的股票不调整
+    locked = locked | ~(prices > 0) | np.isnan(target_values)
+    px = np.where(locked, 1.0, prices)
+    
+    def fee(value):
+        return np.where(value > 0, np.maximum(value * commission_ratio, min_commission), 0.0)
+    
+    def cost(net):
+        # 净买入为买入金额加佣金，净卖出为负的到账金额 (扣除佣金、印花税)
+        value = np.abs(net) * px
+        return np.where(net > 0, value + fee(value), fee(value) + value * tax - value)
+    
+    # 目标股数按整手向下取整
+    target = np.where(locked, amounts, np.floor(np.where(locked, 0.0, target_values) / px / lot) * lot).astype(np.int64)
     
-    for stock in positions:
-        if stock not in toBuy:
-            # 将持仓调整到0（卖出）
-            order_target(stock, 0)
-            log.info(f"卖出股票: {stock}")
+    # 卖出：清仓时零股一并卖出，减仓按整手；不超过可卖数量 (T+1)
+    sell = np.maximum(amounts - target, 0)
+    sell = np.where(target > 0, sell // lot * lot, sell)
+    sell = np.minimum(sell, sellable)
+    available = cash - np.sum(cost(-sell))
+    
+    # 买入：按整手 (持有零股时买到目标以下最近的整手)，资金不足时按比例缩减，再按整手向下取整
+    buy = np.maximum(target - amounts, 0) // lot * lot
+    need = np.sum(cost(buy))
+    if need > available > 0:
+        buy = (np.floor(buy * (available / need) / lot) * lot).astype(np.int64)
+    elif available <= 0:
+        buy[:] = 0
+    
+    # 取整剩下的资金：按距离目标市值的缺口从大到小，每只最多再补一手；清仓卖出零股的不补
+    net = buy - sell
+    holding = amounts + net
+    shortfall = np.where(locked | (target_values <= 0) | (net % lot != 0), -np.inf, target_values - holding * px)
+    extra = cost(net + lot) - cost(net)
+    order = np.argsort(-shortfall, kind='stable')
+    left = cash - np.sum(cost(net))
+    for i in order[shortfall[order] > 0]:
+        if extra[i] <= left:
+            net[i] += lot
+            left -= extra[i]
+    
+    # 最低佣金可能使总额略超可用资金，从买入最多的股票逐手撤回
+    spent = np.sum(cost(net))
+    while spent > cash + 1e-6 and (net > 0).any():
+        i = int(np.argmax(net * px))
+        net[i] -= lot
+        spent = np.sum(cost(net))
+    
+    delta = np.where(locked, 0, net)
+    plan = pd.DataFrame({'amount': amounts, 'price': prices, 'delta': delta, 'target': amounts + delta},
+                        index=pd.Index(list(stocks), name='code'))
+    return plan, float(cash - spent)
 
 
-def order_stock_buy(context, data, toBuy):
+def order_rebalance(context, toBuy):
     """
-    获得买入信号，并执行买入操作
+    按目标股票等权调仓：先卖后买，整批下单
     
     参数:
         context: 上下文对象
-        data: 数据对象
-        toBuy: 需要买入的股票列表
+        toBuy: 需要持有的股票列表
     """
-    for stock in toBuy:
-        # 按分配到的金额买入
-        order_target_value(stock, g.everyStock)
-        log.info(f"买入股票: {stock}, 目标金额: {g.everyStock:.2f}")
+    # PTrade中使用get_positions()获取持仓，只查询一次
+    positions = get_positions()
+    held = [stock for stock in positions if positions[stock].amount > 0]
+    stocks = held + [stock for stock in toBuy if stock not in positions]
+    if not stocks:
+        return
+    
+    # 一次请求获取全部股票的最新价
+    prices, present = fetch_history_matrix(1, '1m', 'close', stocks, include=True)
+    prices = np.where(present, prices[-1], np.nan) if len(prices) > 0 else np.full(len(stocks), np.nan)
+    
+    amounts = np.array([positions[s].amount if s in positions else 0 for s in stocks], dtype=np.int64)
+    sellable = np.array([getattr(positions[s], 'enable_amount', positions[s].amount) if s in positions else 0
+                         for s in stocks])
+    target = set(toBuy)
+    target_values = np.array([g.everyStock if s in target else 0.0 for s in stocks])
+    
+    plan, left = plan_rebalance(stocks, amounts, target_values, prices, context.portfolio.cash, sellable=sellable,
+                                commission_ratio=g.commission_ratio, min_commission=g.min_commission)
+    
+    for stock, delta in plan['delta'][plan['delta'] < 0].items():
+        if order(stock, int(delta)) is not None:
+            log.info(f"卖出股票: {stock}, 数量: {-int(delta)}")
+    for stock, delta in plan['delta'][plan['delta'] > 0].items():
+        if order(stock, int(delta)) is not None:
+            log.info(f"买入股票: {stock}, 数量: {int(delta)}, 目标金额: {g.everyStock:.2f}")
+    log.info(f"调仓完成，预计剩余资金: {left:.2f}")
 
 
 def indexOf(e, a):
@@ -241,6 +753,298 @@ def indexOf(e, a):
     return -1
 
 
+# 财务数据缓存：已公告的财务数据不再变化，按 (表名, 日期, 字段) 缓存查询结果（有界LRU）
+_fundamentals_cache = OrderedDict()
+_FUNDAMENTALS_CACHE_SIZE = 16
+
+
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+def _numeric_fundamentals(df):
+    """把文本字段（含百分比字符串 '15.2%'）一次性转为数值，无法转换的字段保持原样"""
+    for col in df.columns:
+        if col == 'secu_code' or pd.api.types.is_numeric_dtype(df[col]):
+            continue
+        values = pd.to_numeric(df[col].astype(str).str.rstrip('%'), errors='coerce')
+        if values.notna().any():
+            df[col] = values
+    return df
+
+
+# 镜像代码：PTrade 策略须为单个文件，02 与 03 两个策略各保留一份，两份必须逐字相同
+# (由 tests/test_mirrored_code.py 检查，修改时两处同步)
+def get_fundamentals_cached(stock_list, table, fields, date):
+    """
+    带缓存的 get_fundamentals
+    
+    同一日期、同一股票池的重复查询不再请求平台，股票池扩大时只补查缺失的股票；
+    文本字段（含百分比字符串）在入缓存时一次性转为数值
+    
+    参数:
+        stock_list: 股票列表
+        table: 财务表名
+        fields: 字段列表
+        date: 日期字符串
+    返回:
+        index 为股票代码、按 stock_list 顺序排列的 DataFrame
+    """
+    key = (table, str(date), tuple(fields))
+    entry = _fundamentals_cache.get(key)
+    if entry is None:
+        entry = _fundamentals_cache[key] = {'frame': None, 'asked': set()}
+    _fundamentals_cache.move_to_end(key)
+    while len(_fundamentals_cache) > _FUNDAMENTALS_CACHE_SIZE:
+        _fundamentals_cache.popitem(last=False)
+    
+    missing = [s for s in stock_list if s not in entry['asked']]
+    if missing:
+        df = get_fundamentals(missing, table, fields=list(fields), date=date)
+        if df is not None and len(df) > 0:
+            if 'secu_code' in df.columns:
+                df = df.set_index('secu_code', drop=False)
+            df = _numeric_fundamentals(df.copy())
+            frame = df if entry['frame'] is None else pd.concat([entry['frame'], df])
+            entry['frame'] = frame[~frame.index.duplicated(keep='last')]
+        entry['asked'].update(missing)
+    
+    frame = entry['frame']
+    if frame is None:
+        return pd.DataFrame(columns=list(fields))
+    return frame.reindex([s for s in stock_list if s in frame.index])
+
+
+# valuation 表中供因子使用的字段，一次查询全部，各因子共用
+VALUATION_FIELDS = ['total_value', 'float_value', 'pe_ttm', 'pb', 'roe']
+
+
+class Factor:
+    """
+    因子定义
+    
+    参数:
+        name: 因子名
+        inputs: 依赖的因子名 (tuple)，求值结果按顺序传给 compute
+        lookback: 需要的日K线数；可为返回整数的函数（如随 g.yb 变化）；
+                  None 表示K线数据本身，长度由依赖它的因子决定
+        compute: compute(stocks, date, lookback, *inputs)，返回按 stocks 排列的 ndarray（首维为股票）
+    """
+    
+    def __init__(self, name, inputs=(), lookback=0, compute=None):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.lookback = lookback
+        self.compute = compute
+    
+    def window(self, requested=0):
+        """本因子实际使用的K线数"""
+        if self.lookback is None:
+            return requested
+        return self.lookback() if callable(self.lookback) else self.lookback
+
+
+# 因子注册表：因子名 -> Factor
+FACTORS = {}
+
+
+def register_factor(name, inputs=(), lookback=0):
+    """注册因子（装饰器），参数见 Factor"""
+    def decorator(compute):
+        FACTORS[name] = Factor(name, inputs, lookback, compute)
+        return compute
+    return decorator
+
+
+class BarWindow:
+    """
+    日K线滑动窗口
+    
+    按股票缓存最近的日K线（不含当日，后复权），再次请求时只取上次之后新增的K线拼接到窗口末尾；
+    新加入的股票或新增K线对不齐时才请求完整长度
+    """
+    
+    def __init__(self, field):
+        self.field = field
+        self._index = {}                          # 股票 -> 窗口行号
+        self._values = np.zeros((0, 0))           # (股票, K线)
+        self._width = 0                           # 窗口长度（历次请求的最大值）
+        self._last_t = None                       # 上次请求时的 g.t
+    
+    def _fetch(self, stock_list, count):
+        values, _ = fetch_history_matrix(count, '1d', self.field, stock_list, fq='post', include=False)
+        return values.T
+    
+    def get(self, stock_list, count, t):
+        """
+        最近 count 根日K线
+        
+        参数:
+            stock_list: 股票列表
+            count: K线数
+            t: 当前交易日序号（g.t），用于计算距上次请求新增的K线数
+        返回:
+            ndarray (股票, count)
+        """
+        stocks = list(stock_list)
+        elapsed = None if self._last_t is None else t - self._last_t
+        if elapsed is None or elapsed < 0 or count > self._width:
+            # 首次请求或窗口变长：全部重新请求
+            self._index, self._width = {}, max(count, self._width)
+            elapsed = 0
+        width = self._width
+        values = np.full((len(stocks), width), np.nan)
+        rows = np.array([self._index.get(stock, -1) for stock in stocks], dtype=np.int64)
+        tracked = rows >= 0
+        
+        # 已缓存的股票：只取新增的K线
+        if tracked.any():
+            old = self._values[rows[tracked]]
+            if elapsed > 0:
+                sub = [stocks[i] for i in np.flatnonzero(tracked)]
+                new = self._fetch(sub, elapsed)
+                if new.shape[1] == elapsed:
+                    old = np.hstack([old, new])[:, -width:]
+                else:
+                    tracked[:] = False
+            if tracked.any():
+                values[tracked] = old
+        
+        # 新加入的股票：取完整窗口
+        fresh = ~tracked
+        if fresh.any():
+            sub = [stocks[i] for i in np.flatnonzero(fresh)]
+            new = self._fetch(sub, width)
+            values[fresh, width - new.shape[1]:] = new
+        
+        self._index = {stock: i for i, stock in enumerate(stocks)}
+        self._values = values
+        self._last_t = t
+        return values[:, width - count:]
+
+
+# K线窗口与因子值缓存在整个运行期间常驻；因子值按 (因子, 日期, K线数) 缓存（有界LRU）
+_bar_windows = {}
+_factor_cache = OrderedDict()
+_FACTOR_CACHE_SIZE = 64
+
+
+def evaluate_factor(name, stocks, date, lookback=0):
+    """
+    惰性求值因子
+    
+    只计算缓存中缺少的股票，依赖的因子按需递归求值；同一日期各因子共用的数据（财务表、K线）只取一次
+    
+    参数:
+        name: 因子名（见 FACTORS）
+        stocks: 股票列表
+        date: 日期字符串(YYYYMMDD)
+        lookback: 依赖方要求的K线数（只对K线数据有效）
+    返回:
+        按 stocks 排列的 ndarray
+    """
+    if name not in FACTORS:
+        raise KeyError(f"未注册的因子: {name}")
+    factor = FACTORS[name]
+    window = factor.window(lookback)
+    key = (name, date, window)
+    entry = _factor_cache.get(key)
+    if entry is None:
+        entry = _factor_cache[key] = {'index': {}, 'values': None}
+    _factor_cache.move_to_end(key)
+    while len(_factor_cache) > _FACTOR_CACHE_SIZE:
+        _factor_cache.popitem(last=False)
+    
+    missing = [s for s in stocks if s not in entry['index']]
+    if missing:
+        inputs = [evaluate_factor(dep, missing, date, window) for dep in factor.inputs]
+        values = np.asarray(factor.compute(missing, date, window, *inputs), dtype=np.float64)
+        start = 0 if entry['values'] is None else len(entry['values'])
+        entry['values'] = values if entry['values'] is None else np.concatenate([entry['values'], values])
+        entry['index'].update({s: start + i for i, s in enumerate(missing)})
+    
+    return entry['values'][[entry['index'][s] for s in stocks]]
+
+
+@register_factor('valuation')
+def _valuation(stocks, date, lookback):
+    df = get_fundamentals_cached(stocks, 'valuation', VALUATION_FIELDS + ['secu_code'], date)
+    return factor_matrix(df.reindex(stocks), VALUATION_FIELDS)
+
+
+def _register_valuation_field(j, field):
+    register_factor(field, ('valuation',))(lambda stocks, date, lookback, valuation: valuation[:, j])
+
+
+for _j, _field in enumerate(VALUATION_FIELDS):
+    _register_valuation_field(_j, _field)
+
+
+def _register_bars(field):
+    def compute(stocks, date, lookback):
+        if field not in _bar_windows:
+            _bar_windows[field] = BarWindow(field)
+        return _bar_windows[field].get(stocks, lookback, g.t)
+    register_factor(field, lookback=None)(compute)
+
+
+for _field in ('close', 'money'):
+    _register_bars(_field)
+
+
+@register_factor('roe_last_year')
+def _roe_last_year(stocks, date, lookback):
+    last_year = (datetime.datetime.strptime(date, '%Y%m%d') - datetime.timedelta(days=365)).strftime('%Y%m%d')
+    df = get_fundamentals_cached(stocks, 'valuation', ['roe', 'secu_code'], last_year)
+    return factor_matrix(df.reindex(stocks), ['roe'])[:, 0]
+
+
+@register_factor('momentum', ('close',), lookback=lambda: g.yb + 1)
+def _momentum(stocks, date, lookback, close):
+    """g.yb 天收益率"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return close[:, -1] / close[:, 0] - 1
+
+
+@register_factor('volatility', ('close',), lookback=lambda: g.yb + 1)
+def _volatility(stocks, date, lookback, close):
+    """g.yb 天日对数收益率的标准差"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = np.diff(np.log(close), axis=1)
+    valid = ~np.isnan(ret)
+    count = valid.sum(axis=1)
+    mean = np.where(valid, ret, 0.0).sum(axis=1) / np.maximum(count, 1)
+    var = np.where(valid, (ret - mean[:, None]) ** 2, 0.0).sum(axis=1) / np.maximum(count - 1, 1)
+    return np.where(count > 1, np.sqrt(var), np.nan)
+
+
+@register_factor('turnover', ('money', 'float_value'), lookback=lambda: g.yb)
+def _turnover(stocks, date, lookback, money, float_value):
+    """g.yb 天日均成交额 / 流通市值"""
+    valid = ~np.isnan(money)
+    avg = np.where(valid, money, 0.0).sum(axis=1) / np.maximum(valid.sum(axis=1), 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid.any(axis=1) & (float_value > 0), avg / float_value, np.nan)
+
+
+@register_factor('ep', ('pe_ttm',))
+def _ep(stocks, date, lookback, pe):
+    """盈利收益率 1/PE"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(pe != 0, 1.0 / pe, np.nan)
+
+
+@register_factor('bp', ('pb',))
+def _bp(stocks, date, lookback, pb):
+    """账面市值比 1/PB"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(pb > 0, 1.0 / pb, np.nan)
+
+
+@register_factor('roe_growth', ('roe', 'roe_last_year'))
+def _roe_growth(stocks, date, lookback, roe, roe_last_year):
+    """ROE 同比变化（百分点）"""
+    return roe - roe_last_year
+
+
 def getRankedFactors(factors, date):
     """
     取因子数据并排序
@@ -249,20 +1053,15 @@ def getRankedFactors(factors, date):
         factors: 因子列表
         date: 日期字符串(YYYYMMDD)
     返回:
-        (排序后的因子数据, 股票代码列表)
+        (因子排名矩阵 ndarray[股票数, 因子数], 股票代码列表)
     """
     if not g.all_stocks:
         return None, None
     
     try:
         # PTrade中获取财务数据
-        # 从valuation表获取total_value和roe
-        df = get_fundamentals(
-            g.all_stocks, 
-            'valuation', 
-            fields=['total_value', 'roe', 'secu_code'],
-            date=date
-        )
+        # 从valuation表获取因子所需字段，有数据的股票构成排名的股票池
+        df = get_fundamentals_cached(g.all_stocks, 'valuation', VALUATION_FIELDS + ['secu_code'], date)
         
         if df is None or len(df) == 0:
             log.info(f"获取财务数据为空: {date}")
@@ -274,134 +1073,178 @@ def getRankedFactors(factors, date):
         else:
             stock_codes = df.index.tolist()
         
-        # 构建因子数据数组
-        res = []
-        for i in range(len(df)):
-            row_data = []
-            for f in factors:
-                if f in df.columns:
-                    val = df[f].iloc[i]
-                    # 处理roe字段（可能是百分比字符串）
-                    if f == 'roe' and isinstance(val, str) and '%' in val:
-                        val = float(val.replace('%', '')) / 100
-                    row_data.append(val if val is not None else np.nan)
-                else:
-                    row_data.append(np.nan)
-            res.append(row_data)
+        # 构建因子数据矩阵：只计算所选因子及其依赖，已缓存的因子值直接复用
+        res = np.column_stack([evaluate_factor(f, stock_codes, date) for f in factors])
         
         # 用均值填充NaN值
         fillNan(res)
         
         # 将数据变成排名
-        getRank(res)
-        
-        return res, stock_codes
+        return getRank(res), stock_codes
         
     except Exception as e:
         log.error(f"获取因子数据出错: {e}")
         return None, None
 
 
-def getRank(r):
+def factor_matrix(df, factors):
     """
-    把每列原始数据变成排序的数据
+    把财务数据表整理为 float64 因子矩阵
     
     参数:
-        r: 二维列表
+        df: get_fundamentals 返回的 DataFrame
+        factors: 因子列表（缺失的因子整列为NaN）
     返回:
-        排名后的二维列表
+        因子矩阵 ndarray[股票数, 因子数]
     """
-    if not r or not r[0]:
-        return r
+    m = np.full((len(df), len(factors)), np.nan)
+    for j, f in enumerate(factors):
+        if f not in df.columns:
+            continue
+        col = df[f]
+        if col.dtype == object:
+            # 处理百分比字符串 (如roe字段的 '12.5%')
+            text = col.astype(str)
+            percent = text.str.endswith('%').values
+            values = pd.to_numeric(text.str.rstrip('%'), errors='coerce').values
+            m[:, j] = np.where(percent, values / 100, values)
+        else:
+            m[:, j] = col.values.astype(float)
+    return m
+
+
+def rank_data(x, method='average'):
+    """
+    升序排名（从1开始），语义同 scipy.stats.rankdata
     
-    # 定义一个临时数组记住一开始的顺序
-    indexes = list(range(len(r)))
+    参数:
+        x: 一维数组（不含NaN）
+        method: 并列处理方式 'average' / 'min' / 'max' / 'ordinal'
+    返回:
+        排名数组(float64)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    n = len(x)
+    order = np.argsort(x, kind='mergesort')
+    ranks = np.empty(n)
+    if method == 'ordinal':
+        ranks[order] = np.arange(1, n + 1)
+        return ranks
     
-    # 对每一列进行冒泡排序
-    for k in range(len(r[0])):
-        for i in range(len(r)):
-            for j in range(i):
-                if r[j][k] < r[i][k]:
-                    # 交换所有的列以及用于记录一开始的顺序的数组
-                    indexes[j], indexes[i] = indexes[i], indexes[j]
-                    for l in range(len(r[0])):
-                        r[j][l], r[i][l] = r[i][l], r[j][l]
-        # 将排序好的因子顺序变成排名
-        for i in range(len(r)):
-            r[i][k] = i + 1
+    xs = x[order]
+    new_group = np.r_[True, xs[1:] != xs[:-1]]
+    group = np.cumsum(new_group) - 1
+    bounds = np.r_[np.flatnonzero(new_group), n]
+    if method == 'min':
+        group_rank = bounds[:-1] + 1.0
+    elif method == 'max':
+        group_rank = bounds[1:].astype(np.float64)
+    else:
+        group_rank = (bounds[:-1] + 1 + bounds[1:]) / 2.0
+    ranks[order] = group_rank[group]
+    return ranks
+
+
+def getRank(r, method='average'):
+    """
+    把每列原始数据变成排序的数据（因子值最大的排名为1）
+    
+    并列的因子值（包括 NaN 用均值填充后的相同值）默认取平均排名。原实现逐列冒泡交换排序，
+    并列值按前一列排序后的行顺序得到互不相同的名次，因此有并列时排名与原实现不同；
+    因子值各不相同时两者一致
     
-    # 再进行一次冒泡排序恢复一开始的股票顺序
-    for i in range(len(r)):
-        for j in range(i):
-            if indexes[j] > indexes[i]:
-                indexes[j], indexes[i] = indexes[i], indexes[j]
-                for k in range(len(r[0])):
-                    r[j][k], r[i][k] = r[i][k], r[j][k]
+    参数:
+        r: 二维数组[股票数, 因子数]（已填充NaN）
+        method: 并列处理方式，见 rank_data
+    返回:
+        排名矩阵 ndarray
+    """
+    r = np.asarray(r, dtype=np.float64)
+    if r.size == 0:
+        return r
     
-    return r
+    ranks = np.empty_like(r)
+    for k in range(r.shape[1]):
+        ranks[:, k] = rank_data(-r[:, k], method)
+    return ranks
 
 
-def fillNan(m):
+def fillNan(m, method='mean'):
     """
-    用均值填充NaN
+    用均值(或中位数)填充NaN，原地修改
     
     参数:
-        m: 二维列表
+        m: 二维数组[股票数, 因子数]
+        method: 'mean' 或 'median'；整列均为NaN时填充0
     返回:
-        填充后的二维列表
+        填充后的数组
     """
-    if not m or not m[0]:
+    if m.size == 0:
         return m
     
-    rows = len(m)
-    columns = len(m[0])
-    
-    # 对每一列进行操作
-    for j in range(columns):
-        sum_val = 0.0
-        count = 0.0
-        
-        # 计算非NaN值的总和和个数
-        for i in range(rows):
-            val = m[i][j]
-            if val is not None and not isnan(val):
-                sum_val += val
-                count += 1
-        
-        # 计算平均值
-        avg = sum_val / max(count, 1)
-        
-        # 用平均值填充NaN
-        for i in range(rows):
-            val = m[i][j]
-            if val is None or isnan(val):
-                m[i][j] = avg
+    missing = np.isnan(m)
+    count = (~missing).sum(axis=0)
+    if method == 'median':
+        fill = np.zeros(m.shape[1])
+        has = count > 0
+        fill[has] = np.nanmedian(m[:, has], axis=0)
+    else:
+        fill = np.where(missing, 0.0, m).sum(axis=0) / np.maximum(count, 1)
     
+    rows, cols = np.nonzero(missing)
+    m[rows, cols] = fill[cols]
     return m
 
 
+def composite_score(ranks, weights):
+    """
+    计算综合得分：因子排名按 g.weights 加权求和
+    
+    参数:
+        ranks: 排名矩阵[股票数, 因子数]
+        weights: 因子权重（[[1], [-1]] 或 [1, -1]），正数表示因子值越小越好
+    返回:
+        得分数组[股票数]
+    """
+    return np.dot(ranks, np.asarray(weights, dtype=np.float64).reshape(-1))
+
+
+def select_top_n(scores, stocks, n):
+    """
+    用 argpartition 选出得分最高的n只股票（按得分从高到低，同分按原顺序）
+    
+    原实现的冒泡排序不稳定，同分股票的先后取决于交换顺序；有同分（或因子并列、缺失）时
+    入选的股票可能与原实现不同，得分各不相同时选股结果一致
+    
+    参数:
+        scores: 得分数组
+        stocks: 股票代码列表
+        n: 选股数量
+    返回:
+        股票代码列表
+    """
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    n = min(n, len(scores))
+    if n <= 0:
+        return []
+    top = np.argpartition(-scores, n - 1)[:n] if n < len(scores) else np.arange(len(scores))
+    top = top[np.lexsort((top, -scores[top]))]
+    return [stocks[i] for i in top]
+
+
 def bubble(numbers, indexes):
     """
-    冒泡排序函数
+    按得分从高到低排序
     
     参数:
-        numbers: 股票的综合得分(list)
+        numbers: 股票的综合得分
         indexes: 股票列表(list)
     返回:
         (排序后的得分, 排序后的股票列表)
     """
-    n = len(numbers)
-    # 转换为列表以支持交换
-    indexes = list(indexes)
-    
-    for i in range(n):
-        for j in range(i):
-            if numbers[j][0] < numbers[i][0]:
-                # 在进行交换的时候同时交换得分以记录哪些股票得分比较高
-                numbers[j][0], numbers[i][0] = numbers[i][0], numbers[j][0]
-                indexes[j], indexes[i] = indexes[i], indexes[j]
-    
-    return numbers, indexes
+    numbers = np.asarray(numbers, dtype=np.float64)
+    order = np.argsort(-numbers.reshape(len(numbers), -1)[:, 0], kind='mergesort')
+    return numbers[order], [indexes[i] for i in order]
 
 
 '''
@@ -413,4 +1256,7 @@ def after_trading_end(context, data):
     """每日收盘后要做的事情"""
     log.info(f"====== 交易日结束: {context.blotter.current_dt} ======")
     log.info(f"当日持仓数量: {len(get_positions())}")
-    log.info(f"账户总资产: {context.portfolio.portfolio_value:.2f}")
\ No newline at end of file
+    log.info(f"账户总资产: {context.portfolio.portfolio_value:.2f}")
+    counts = _fetcher.counts
+    log.info(f"数据请求累计: 调用 {counts['calls']} 次, 重试 {counts['retries']} 次, "
+             f"超时 {counts['timeouts']} 次, 失败 {counts['errors']} 次")
\ No newline at end of file
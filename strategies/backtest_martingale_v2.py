@@ -0,0 +1,595 @@
+# 均线斜率 + 马丁格尔网格回测 V2.1
+#
+# 10日均线斜率 > 阈值视为主升浪：满仓持有，有现金则补仓；
+# 斜率 <= 阈值视为震荡/下跌：较上次买入价每跌 grid_step 按 martingale_mult 倍加仓，单笔涨 take_profit 网格止盈。
+# 网格持仓保存在定长 numpy 数组 (GridBook) 中，批量模式把多组参数放进同一次逐日循环向量化推进，
+# 均线斜率按 (ma_period, slope_period) 去重后只计算一次。
+#
+# 使用示例：
+#   df = pd.read_csv('sh510300_daily.csv')        # 需包含 date, close 列
+#   result = MartingaleTrendBacktest(slope_period=3, grid_step=0.02).run(df, '2023-01-01', '2023-12-31')
+#   table = batch_backtest(df, param_grid(grid_step=[0.01, 0.02], take_profit=[0.01, 0.02]))
+
+import pandas as pd
+import numpy as np
+from dataclasses import dataclass
+from itertools import product
+from typing import List, Dict
+
+
+# 参数及默认值，顺序与 MartingaleTrendBacktest 构造函数一致
+DEFAULT_PARAMS = {
+    'ma_period': 10,
+    'slope_period': 3,
+    'slope_threshold': 0.0,
+    'base_ratio': 0.8,
+    'full_position_ratio': 0.95,
+    'grid_step': 0.02,
+    'take_profit': 0.025,
+    'martingale_mult': 1.5,
+    'max_grids': 5,
+    'initial_cash': 500000,
+}
+
+@dataclass
+class TradeRecord:
+    """交易记录"""
+    date: str
+    action: str
+    price: float
+    amount: int
+    reason: str
+    profit: float = 0
+
+
+class GridBook:
+    """
+    网格持仓簿：每组参数一行，每行 max_grids 个槽位保存非底仓持仓的买入价、数量和买入日
+
+    主升补仓不受 max_grids 限制，槽位用满时整体扩容（很少发生），其余时间数组大小固定。
+    数量为0的槽位为空。
+    """
+
+    def __init__(self, n_sets, capacity):
+        self.capacity = max(int(capacity), 1)
+        self.price = np.zeros((n_sets, self.capacity))
+        self.amount = np.zeros((n_sets, self.capacity))
+        self.day = np.zeros((n_sets, self.capacity), dtype=np.int64)
+
+    def _grow(self):
+        extra = self.capacity
+        self.price = np.pad(self.price, ((0, 0), (0, extra)))
+        self.amount = np.pad(self.amount, ((0, 0), (0, extra)))
+        self.day = np.pad(self.day, ((0, 0), (0, extra)))
+        self.capacity += extra
+
+    def add(self, rows, price, amounts, day):
+        """在 rows 各行的第一个空槽位买入 amounts 股"""
+        if len(rows) == 0:
+            return
+        free = self.amount[rows] == 0
+        if not free.any(axis=1).all():
+            self._grow()
+            free = self.amount[rows] == 0
+        slots = free.argmax(axis=1)
+        self.price[rows, slots] = price
+        self.amount[rows, slots] = amounts
+        self.day[rows, slots] = day
+
+    def cheapest(self, rows, before_day):
+        """
+        rows 各行买入日早于 before_day 的持仓中买入价最低的槽位（同价取先买入的）
+
+        返回:
+            (有可卖持仓的行, 对应槽位)
+        """
+        eligible = (self.amount[rows] > 0) & (self.day[rows] < before_day)
+        has_lot = eligible.any(axis=1)
+        rows, eligible = rows[has_lot], eligible[has_lot]
+        prices = np.where(eligible, self.price[rows], np.inf)
+        lowest = eligible & (prices == prices.min(axis=1)[:, None])
+        slots = np.where(lowest, self.day[rows], np.iinfo(np.int64).max).argmin(axis=1)
+        return rows, slots
+
+
+def ma_slope(close, ma_period, slope_period):
+    """均线斜率（%）：slope_period 日前到今日的均线变化率"""
+    ma = pd.Series(close).rolling(ma_period).mean()
+    return ((ma - ma.shift(slope_period)) / ma.shift(slope_period) * 100).values
+
+
+def param_grid(**values):
+    """
+    参数网格：对给定参数的取值做笛卡尔积，未给出的参数取默认值
+
+    返回:
+        DataFrame，每行一组参数，行顺序与嵌套循环（先给出的参数在外层）一致
+    """
+    combos = list(product(*values.values()))
+    table = pd.DataFrame(combos, columns=list(values.keys()))
+    for name, default in DEFAULT_PARAMS.items():
+        if name not in table.columns:
+            table[name] = default
+    return table[list(DEFAULT_PARAMS)]
+
+
+def _simulate(close, slopes, groups, params, dates=None, trades=None, equity_curve=None, verbose=False):
+    """
+    逐日推进多组参数的回测，每一天对所有参数组做一次向量化更新
+
+    参数:
+        close: 收盘价 (天数,)
+        slopes: 去重后的均线斜率 (天数, 斜率组数)
+        groups: 每组参数对应的斜率列 (参数组数,)
+        params: 参数名 -> (参数组数,) 数组
+        dates/trades/equity_curve/verbose: 单组参数回测时记录交易明细和权益曲线
+    返回:
+        dict: 指标名 -> (参数组数,) 数组
+    """
+    n_sets = len(groups)
+    rows = np.arange(n_sets)
+    threshold = params['slope_threshold']
+    full_ratio = params['full_position_ratio']
+    grid_step = params['grid_step']
+    take_profit = params['take_profit']
+    mult = params['martingale_mult']
+    max_grids = params['max_grids']
+    initial_cash = params['initial_cash']
+
+    # 首日建底仓
+    first_price = close[0]
+    base_amount = np.trunc(initial_cash * params['base_ratio'] / first_price / 100) * 100
+    cash = initial_cash - base_amount * first_price
+    if trades is not None:
+        trades.append(TradeRecord(dates[0], 'buy', first_price, int(base_amount[0]), '初始建仓'))
+    last_buy_price = np.full(n_sets, first_price)
+    last_add_amount = np.trunc(cash * 0.3 / first_price / 100) * 100
+
+    book = GridBook(n_sets, max_grids.max())
+    total_profit = np.zeros(n_sets)
+    peak_equity = initial_cash.astype(np.float64)
+    max_drawdown = np.zeros(n_sets)
+    hold_days = np.zeros(n_sets, dtype=np.int64)
+    trade_days = np.zeros(n_sets, dtype=np.int64)
+    full_buys = np.zeros(n_sets, dtype=np.int64)
+    grid_buys = np.zeros(n_sets, dtype=np.int64)
+    grid_sells = np.zeros(n_sets, dtype=np.int64)
+
+    for i in range(1, len(close)):
+        price = close[i]
+        slope = slopes[i, groups]
+        slope = np.where(np.isnan(slope), 0, slope)
+
+        total_amount = base_amount + book.amount.sum(axis=1)
+        equity = cash + total_amount * price
+        if equity_curve is not None:
+            equity_curve.append({'date': dates[i], 'equity': equity[0], 'slope': slope[0]})
+        peak_equity = np.maximum(peak_equity, equity)
+        max_drawdown = np.maximum(max_drawdown, (peak_equity - equity) / peak_equity)
+        n_grids = (book.amount > 0).sum(axis=1)
+
+        # 主升浪：仓位不足则补到满仓
+        is_uptrend = slope > threshold
+        hold_days += is_uptrend
+        position_value = total_amount * price
+        want = is_uptrend & (position_value / equity < full_ratio) & (cash > price * 100)
+        buy_amount = np.trunc(np.minimum(equity * full_ratio - position_value, cash) / price / 100) * 100
+        buy = want & (buy_amount >= 100)
+        if buy.any():
+            cash = np.where(buy, cash - buy_amount * price, cash)
+            book.add(rows[buy], price, buy_amount[buy], i)
+            full_buys += buy
+            last_buy_price = np.where(buy, price, last_buy_price)
+            if trades is not None and buy[0]:
+                trades.append(TradeRecord(dates[i], 'hold_buy', price, int(buy_amount[0]),
+                                          f'主升补仓(斜率:{slope[0]:.2f}%)'))
+                if verbose:
+                    print(f"[{dates[i]}] 主升补仓 {int(buy_amount[0])}股 @ {price:.3f}, 斜率:{slope[0]:.2f}%")
+
+        # 震荡/下跌：马丁格尔加仓
+        is_range = ~is_uptrend
+        trade_days += is_range
+        drop_ratio = (last_buy_price - price) / last_buy_price
+        want = is_range & (drop_ratio >= grid_step) & (n_grids < max_grids) & (cash > 0)
+        add_amount = np.maximum(np.trunc(last_add_amount * mult / 100) * 100, 100)
+        cost = add_amount * price
+        buy = want & (cash >= cost)
+        if buy.any():
+            cash = np.where(buy, cash - cost, cash)
+            book.add(rows[buy], price, add_amount[buy], i)
+            grid_buys += buy
+            last_buy_price = np.where(buy, price, last_buy_price)
+            last_add_amount = np.where(buy, add_amount, last_add_amount)
+            if trades is not None and buy[0]:
+                trades.append(TradeRecord(dates[i], 'buy', price, int(add_amount[0]),
+                                          f'马丁加仓(跌{drop_ratio[0] * 100:.1f}%)'))
+                if verbose:
+                    print(f"[{dates[i]}] 马丁加仓 {int(add_amount[0])}股 @ {price:.3f}, 跌幅:{drop_ratio[0] * 100:.1f}%")
+
+        # 网格止盈：每天最多卖出一笔，只看买入价最低的一笔（它的涨幅最大）
+        sell_rows, slots = book.cheapest(rows[is_range], i)
+        if len(sell_rows):
+            lot_price = book.price[sell_rows, slots]
+            profit_ratio = (price - lot_price) / lot_price
+            hit = profit_ratio >= take_profit[sell_rows]
+            sell_rows, slots, lot_price, profit_ratio = sell_rows[hit], slots[hit], lot_price[hit], profit_ratio[hit]
+            lot_amount = book.amount[sell_rows, slots]
+            profit = (price - lot_price) * lot_amount
+            total_profit[sell_rows] += profit
+            cash[sell_rows] += lot_amount * price
+            book.amount[sell_rows, slots] = 0
+            grid_sells[sell_rows] += 1
+            last_buy_price[sell_rows] = price
+            if trades is not None and len(sell_rows):
+                trades.append(TradeRecord(dates[i], 'sell', price, int(lot_amount[0]),
+                                          f'网格止盈(涨{profit_ratio[0] * 100:.1f}%)', profit[0]))
+                if verbose:
+                    print(f"[{dates[i]}] 网格止盈 {int(lot_amount[0])}股 @ {price:.3f}, 盈利:{profit[0]:.0f}")
+
+    # 统计结果
+    final_price = close[-1]
+    final_amount = base_amount + book.amount.sum(axis=1)
+    final_equity = cash + final_amount * final_price
+    cost_value = base_amount * first_price + (book.price * book.amount).sum(axis=1)
+    held = final_amount > 0
+    avg_cost = np.where(held, cost_value / np.where(held, final_amount, 1), 0)
+    total_return = (final_equity - initial_cash) / initial_cash * 100
+    benchmark = (final_price - first_price) / first_price * 100
+
+    return {
+        'total_return': total_return,
+        'benchmark_return': np.full(n_sets, benchmark),
+        'excess_return': total_return - benchmark,
+        'realized_profit': total_profit,
+        'unrealized_profit': np.where(held, (final_price - avg_cost) * final_amount, 0),
+        'final_equity': final_equity,
+        'trade_count': 1 + full_buys + grid_buys + grid_sells,
+        'max_drawdown': max_drawdown * 100,
+        'final_position': final_amount.astype(np.int64),
+        'avg_cost': avg_cost,
+        'hold_days': hold_days,
+        'trade_days': trade_days,
+        'full_buys': full_buys,
+        'grid_buys': grid_buys,
+        'grid_sells': grid_sells,
+    }
+
+
+def _prepare(df, table, start_date, end_date):
+    """按区间截取行情，并为每个 (ma_period, slope_period) 计算一次斜率（均线在截取前计算）"""
+    close = df['close'].values.astype(np.float64)
+    mask = np.ones(len(df), dtype=bool)
+    if start_date:
+        mask &= (df['date'] >= start_date).values
+    if end_date:
+        mask &= (df['date'] <= end_date).values
+
+    pairs = table[['ma_period', 'slope_period']].astype(int)
+    keys = list(dict.fromkeys(map(tuple, pairs.values)))
+    slopes = np.column_stack([ma_slope(close, ma, period)[mask] for ma, period in keys])
+    position = {key: j for j, key in enumerate(keys)}
+    groups = np.array([position[key] for key in map(tuple, pairs.values)], dtype=np.int64)
+
+    params = {name: table[name].values.astype(np.float64) for name in DEFAULT_PARAMS}
+    params['max_grids'] = table['max_grids'].values.astype(np.int64)
+    return close[mask], df['date'].values[mask], slopes, groups, params
+
+
+def batch_backtest(df: pd.DataFrame, param_sets, start_date: str = None, end_date: str = None) -> pd.DataFrame:
+    """
+    批量回测：同一段行情上一次跑完多组参数
+
+    参数:
+        df: 包含 date, close 列的日线行情
+        param_sets: 参数表（DataFrame 或 dict 列表），缺失的参数取默认值
+    返回:
+        DataFrame，每行为一组参数及其回测指标
+    """
+    table = pd.DataFrame(param_sets).reset_index(drop=True)
+    for name, default in DEFAULT_PARAMS.items():
+        table[name] = table[name].fillna(default) if name in table.columns else default
+    close, dates, slopes, groups, params = _prepare(df, table, start_date, end_date)
+    metrics = _simulate(close, slopes, groups, params)
+    return pd.concat([table, pd.DataFrame(metrics)], axis=1)
+
+
+class MartingaleTrendBacktest:
+
+    def __init__(self, ma_period: int = 10, slope_period: int = 3, slope_threshold: float = 0.0,
+                 base_ratio: float = 0.8, full_position_ratio: float = 0.95, grid_step: float = 0.02,
+                 take_profit: float = 0.025, martingale_mult: float = 1.5, max_grids: int = 5,
+                 initial_cash: float = 500000):
+        self.ma_period = ma_period
+        self.slope_period = slope_period
+        self.slope_threshold = slope_threshold
+        self.base_ratio = base_ratio
+        self.full_position_ratio = full_position_ratio
+        self.grid_step = grid_step
+        self.take_profit = take_profit
+        self.martingale_mult = martingale_mult
+        self.max_grids = max_grids
+        self.initial_cash = initial_cash
+
+    def params(self) -> Dict:
+        return {name: getattr(self, name) for name in DEFAULT_PARAMS}
+
+    def run(self, df: pd.DataFrame, start_date: str = None, end_date: str = None, verbose: bool = False) -> Dict:
+        table = pd.DataFrame([self.params()])
+        close, dates, slopes, groups, params = _prepare(df, table, start_date, end_date)
+        trades: List[TradeRecord] = []
+        equity_curve: List[Dict] = []
+        metrics = _simulate(close, slopes, groups, params, dates, trades, equity_curve, verbose)
+
+        result = {name: values[0].item() for name, values in metrics.items()}
+        result['trades'] = trades
+        result['equity_curve'] = equity_curve
+        return result
+
+
+def _strategy(params, max_grids=8):
+    """由 (斜率周期, 底仓, 网格, 止盈, 倍数) 构造回测器"""
+    slope_period, base_ratio, grid_step, take_profit, martingale_mult = params
+    return MartingaleTrendBacktest(
+        ma_period=10,
+        slope_period=slope_period,
+        slope_threshold=0.0,
+        base_ratio=base_ratio,
+        full_position_ratio=0.95,
+        grid_step=grid_step,
+        take_profit=take_profit,
+        martingale_mult=martingale_mult,
+        max_grids=max_grids,
+    )
+
+
+# 参数搜索空间
+SEARCH_SPACE = {
+    'slope_period': [2, 3, 5],
+    'base_ratio': [0.5, 0.6, 0.7, 0.8],
+    'grid_step': [0.01, 0.015, 0.02, 0.025],
+    'take_profit': [0.008, 0.01, 0.012, 0.015, 0.02],
+    'martingale_mult': [1.2, 1.5, 2.0],
+}
+SEARCH_KEYS = list(SEARCH_SPACE)
+
+
+def _search_grid():
+    table = param_grid(**SEARCH_SPACE)
+    table['max_grids'] = 8
+    return table
+
+
+def quick_test():
+    """快速单参数测试"""
+    df = pd.read_csv('sh510300_daily.csv')
+    recent = df.iloc[-250:]
+    start_date = recent.iloc[0]['date']
+    end_date = recent.iloc[-1]['date']
+
+    print('=' * 70)
+    print('【10日均线斜率 + 马丁格尔网格策略 V2.1】')
+    print('=' * 70)
+    print(f'回测区间: {start_date} 到 {end_date}')
+    print(f"基准: {recent.iloc[0]['close']:.3f} -> {recent.iloc[-1]['close']:.3f}")
+    print()
+    print('核心逻辑:')
+    print('  * 10日均线斜率 > 0 (主升浪) -> 满仓持有，有现金则补仓')
+    print('  * 10日均线斜率 <= 0 (震荡/下跌) -> 马丁格尔加仓 + 网格止盈')
+    print()
+
+    table = batch_backtest(df, _search_grid(), start_date, end_date)
+    order = np.argsort(-table['total_return'].values, kind='stable')
+    ranked = table.iloc[order].to_dict('records')
+    best = ranked[0]
+
+    print('=' * 70)
+    print('TOP 10 最优参数组合:')
+    print('-' * 70)
+    for i, row in enumerate(ranked[:10]):
+        print(f"[{i + 1}] 收益: {row['total_return']:.2f}%  超额: {row['excess_return']:.2f}%  回撤: {row['max_drawdown']:.2f}%")
+        print(f"    主升持仓: {row['hold_days']}天  震荡交易: {row['trade_days']}天")
+        print(f"    主升补仓: {row['full_buys']}次  网格买入: {row['grid_buys']}次  网格卖出: {row['grid_sells']}次")
+        print(f"    已实现盈利: {row['realized_profit']:.0f}元")
+        print(f"    参数: 斜率周期={row['slope_period']}天, 底仓={row['base_ratio']:.0%}, "
+              f"网格={row['grid_step']:.1%}, 止盈={row['take_profit']:.1%}, 倍数={row['martingale_mult']}")
+        print('-' * 70)
+
+    print(f"\n基准收益(买入持有): {best['benchmark_return']:.2f}%")
+    beat_count = int((table['excess_return'] > 0).sum())
+    print(f'超越基准的参数组合数: {beat_count}/{len(table)}')
+
+    print('\n' + '=' * 70)
+    print('【最优参数详细回测】')
+    print('=' * 70)
+    bt = _strategy(tuple(best[key] for key in SEARCH_KEYS))
+    result = bt.run(df, start_date, end_date, verbose=True)
+
+    print('\n最终统计:')
+    print(f"  总收益: {result['total_return']:.2f}%")
+    print(f"  基准收益: {result['benchmark_return']:.2f}%")
+    print(f"  超额收益: {result['excess_return']:.2f}%")
+    print(f"  最大回撤: {result['max_drawdown']:.2f}%")
+    print(f"  已实现盈利: {result['realized_profit']:.0f}元")
+    print(f"  未实现盈利: {result['unrealized_profit']:.0f}元")
+    print(f"  最终权益: {result['final_equity']:.0f}元")
+
+
+def single_test(verbose=True):
+    """单次测试 - 用于查看详细交易记录"""
+    df = pd.read_csv('sh510300_daily.csv')
+    recent = df.iloc[-250:]
+    start_date = recent.iloc[0]['date']
+    end_date = recent.iloc[-1]['date']
+
+    print('=' * 60)
+    print('【10日均线斜率判断主升浪策略】')
+    print('=' * 60)
+    print(f'回测区间: {start_date} 到 {end_date}')
+    print('-' * 60)
+
+    bt = MartingaleTrendBacktest(
+        ma_period=10,
+        slope_period=3,
+        slope_threshold=0.0,
+        base_ratio=0.8,
+        full_position_ratio=0.95,
+        grid_step=0.02,
+        take_profit=0.025,
+        martingale_mult=1.5,
+        max_grids=5,
+    )
+    result = bt.run(df, start_date, end_date, verbose=verbose)
+
+    print('-' * 60)
+    print('策略说明:')
+    print('  10日均线斜率 > 0 -> 主升浪，满仓持有')
+    print('  10日均线斜率 <= 0 -> 震荡市，马丁格尔+网格交易')
+    print('-' * 60)
+    print(f"主升持仓天数: {result['hold_days']}")
+    print(f"震荡交易天数: {result['trade_days']}")
+    print(f"主升补仓次数: {result['full_buys']}")
+    print(f"网格买入次数: {result['grid_buys']}")
+    print(f"网格卖出次数: {result['grid_sells']}")
+    print(f"总收益率: {result['total_return']:.2f}%")
+    print(f"基准收益率: {result['benchmark_return']:.2f}%")
+    print(f"超额收益: {result['excess_return']:.2f}%")
+    print(f"最大回撤: {result['max_drawdown']:.2f}%")
+    print(f"最终权益: {result['final_equity']:.0f} 元")
+    return result
+
+
+def walk_forward_optimization():
+    """
+    Walk Forward 滚动前进优化
+    原理：
+    1. 将数据分成多个窗口（训练期+测试期）
+    2. 在训练期寻找最优参数
+    3. 用最优参数在测试期验证
+    4. 滚动前进，重复过程
+    5. 综合所有测试期结果，找到稳健参数
+    """
+    df = pd.read_csv('sh510300_daily.csv')
+    train_days = 120
+    test_days = 60
+    step_days = 60
+    total_days = len(df)
+
+    print('=' * 70)
+    print('【Walk Forward 滚动前进优化】')
+    print('=' * 70)
+    print(f'总数据量: {total_days} 天')
+    print(f'训练期: {train_days} 天, 测试期: {test_days} 天, 滚动步长: {step_days} 天')
+
+    grid = _search_grid()
+    print(f'参数组合数: {len(grid)}')
+
+    param_scores = {}
+    window_results = []
+    start_idx = 0
+    window_num = 0
+
+    while start_idx + train_days + test_days <= total_days:
+        window_num += 1
+        train_df = df.iloc[start_idx:start_idx + train_days]
+        test_df = df.iloc[start_idx + train_days:start_idx + train_days + test_days]
+        train_start_date = train_df.iloc[0]['date']
+        train_end_date = train_df.iloc[-1]['date']
+        test_start_date = test_df.iloc[0]['date']
+        test_end_date = test_df.iloc[-1]['date']
+
+        print(f'\n--- 窗口 {window_num} ---')
+        print(f'训练期: {train_start_date} ~ {train_end_date}')
+        print(f'测试期: {test_start_date} ~ {test_end_date}')
+
+        # 训练期：一次批量回测所有参数组合，取收益最高的一组
+        train = batch_backtest(df, grid, train_start_date, train_end_date)
+        best_row = train.iloc[int(train['total_return'].values.argmax())].to_dict()
+        best_train_return = best_row['total_return']
+        best_params = (int(best_row['slope_period']),) + tuple(best_row[key] for key in SEARCH_KEYS[1:])
+        slope_period, base_ratio, grid_step, take_profit, martingale_mult = best_params
+
+        bt = _strategy(best_params)
+        test_result = bt.run(df, test_start_date, test_end_date)
+
+        print(f'最优参数: 斜率={slope_period}, 底仓={base_ratio:.0%}, 网格={grid_step:.1%}, '
+              f'止盈={take_profit:.1%}, 倍数={martingale_mult}')
+        print(f'训练期收益: {best_train_return:.2f}%')
+        print(f"测试期收益: {test_result['total_return']:.2f}%, 超额: {test_result['excess_return']:.2f}%")
+
+        param_key = best_params
+        if param_key not in param_scores:
+            param_scores[param_key] = []
+        param_scores[param_key].append({
+            'window': window_num,
+            'test_return': test_result['total_return'],
+            'excess_return': test_result['excess_return'],
+            'max_drawdown': test_result['max_drawdown'],
+        })
+
+        window_results.append({
+            'window': window_num,
+            'train_period': f'{train_start_date}~{train_end_date}',
+            'test_period': f'{test_start_date}~{test_end_date}',
+            'best_params': best_params,
+            'train_return': best_train_return,
+            'test_return': test_result['total_return'],
+            'excess_return': test_result['excess_return'],
+        })
+
+        start_idx += step_days
+
+    print('\n' + '=' * 70)
+    print('【Walk Forward 汇总结果】')
+    print('=' * 70)
+
+    total_test_return = sum(w['test_return'] for w in window_results)
+    total_excess = sum(w['excess_return'] for w in window_results)
+    avg_test_return = total_test_return / len(window_results)
+    avg_excess = total_excess / len(window_results)
+
+    print(f'共 {len(window_results)} 个滚动窗口')
+    print(f'累计测试期收益: {total_test_return:.2f}%')
+    print(f'平均每窗口收益: {avg_test_return:.2f}%')
+    print(f'平均超额收益: {avg_excess:.2f}%')
+
+    param_count = {}
+    for w in window_results:
+        key = w['best_params']
+        param_count[key] = param_count.get(key, 0) + 1
+    sorted_params = sorted(param_count.items(), key=lambda x: x[1], reverse=True)
+
+    print('\n最常被选中的参数组合:')
+    for params, count in sorted_params[:5]:
+        slope_period, base_ratio, grid_step, take_profit, martingale_mult = params
+        print(f'  [{count}次] 斜率={slope_period}, 底仓={base_ratio:.0%}, 网格={grid_step:.1%}, '
+              f'止盈={take_profit:.1%}, 倍数={martingale_mult}')
+
+    robust_params = sorted_params[0][0]
+    slope_period, base_ratio, grid_step, take_profit, martingale_mult = robust_params
+
+    print('\n' + '=' * 70)
+    print('【稳健参数全量回测】')
+    print('=' * 70)
+    print(f'参数: 斜率周期={slope_period}, 底仓={base_ratio:.0%}, 网格={grid_step:.1%}, '
+          f'止盈={take_profit:.1%}, 倍数={martingale_mult}')
+
+    recent = df.iloc[-250:]
+    start_date = recent.iloc[0]['date']
+    end_date = recent.iloc[-1]['date']
+    bt = _strategy(robust_params)
+    result = bt.run(df, start_date, end_date, verbose=True)
+
+    print(f'\n回测区间: {start_date} ~ {end_date}')
+    print(f"总收益: {result['total_return']:.2f}%")
+    print(f"基准收益: {result['benchmark_return']:.2f}%")
+    print(f"超额收益: {result['excess_return']:.2f}%")
+    print(f"最大回撤: {result['max_drawdown']:.2f}%")
+    print(f"已实现盈利: {result['realized_profit']:.0f} 元")
+    print(f"主升持仓: {result['hold_days']}天, 震荡交易: {result['trade_days']}天")
+    print(f"网格买入: {result['grid_buys']}次, 网格卖出: {result['grid_sells']}次")
+
+    return robust_params, result
+
+
+if __name__ == '__main__':
+    walk_forward_optimization()
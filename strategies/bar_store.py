@@ -0,0 +1,291 @@
+# 列式日线/分钟线存储 (内存映射)
+#
+# 每个字段 (open/high/low/close/volume/money/high_limit/low_limit) 一个连续的 float64 文件，
+# 按 (K线, 股票) 行优先排列，通过 np.memmap 映射。按日期区间、股票集合切片时只读取
+# 需要的页；取全部股票的最近N根K线是零拷贝视图。新K线直接追加到文件末尾，不重写旧数据。
+#
+# 目录结构：
+#   meta.json     {"fields": [...], "symbols": [...], "symbol_capacity": N, "frequency": "daily"|"minute", "time_dtype": ...}
+#   days.idx      K线时间键：日线 int32 yyyymmdd，分钟线 int64 yyyymmddHHMM
+#   <字段>.f8     float64，形状 (K线数, symbol_capacity)
+#
+# 分钟线存储的查询边界可以是时刻，也可以是日期：只给日期时 start 取当日第一分钟、end 取当日
+# 最后一分钟，即覆盖整个交易日 (例如 end='2024-01-02' 包含当日全部分钟K线)。
+#
+# 追加时先写字段文件、最后写 days.idx，打开时以 days.idx 的长度为准，
+# 因此追加中途失败不会产生半截数据。
+#
+# 使用示例：
+#   store = BarStore.create('./data/bars', symbols)
+#   store.append(days, {'close': close_matrix, ...})
+#   closes = BarStore('./data/bars').window('close', count=21)          # 最近21日全部股票，零拷贝
+#   sub = store.window('close', symbols=['600000.SS'], start=20240101)  # 任意股票/区间
+#   minute = BarStore.create('./data/minute', symbols, frequency='minute')
+#   minute.append(pd.date_range('2024-01-02 09:31', periods=120, freq='min'), {'close': m})
+#   day = minute.frame('close', start='2024-01-02', end='2024-01-02')    # 当日全部分钟K线
+
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+FIELDS = ('open', 'high', 'low', 'close', 'volume', 'money', 'high_limit', 'low_limit')
+
+# 各频率的时间键格式与默认存储类型
+TIME_FORMATS = {'daily': '%Y%m%d', 'minute': '%Y%m%d%H%M'}
+TIME_DTYPES = {'daily': 'int32', 'minute': 'int64'}
+
+
+def _day_int(value):
+    """把日期统一为 yyyymmdd 整数"""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(pd.Timestamp(str(value) if not hasattr(value, 'year') else value).strftime('%Y%m%d'))
+
+
+def _is_date(value):
+    """value 是否只是日期 (不带时刻)：8位整数、date 对象、按日的 datetime64 或不含时刻的字符串"""
+    if isinstance(value, (int, np.integer)):
+        return int(value) < 10 ** 8
+    if isinstance(value, np.datetime64):
+        return np.datetime_data(value.dtype)[0] in ('D', 'W', 'M', 'Y')
+    if isinstance(value, str):
+        return ':' not in value and len(value.strip()) <= 10
+    return isinstance(value, datetime.date) and not isinstance(value, datetime.datetime)
+
+
+def _time_key(value, frequency='daily', bound=None):
+    """
+    把日期/时刻统一为存储的时间键：日线 yyyymmdd，分钟线 yyyymmddHHMM
+
+    参数:
+        bound: 分钟线下只给日期时，'end' 取当日最后一分钟 (HHMM=2359)，其余取当日第一分钟 (0000)
+    """
+    if frequency == 'daily':
+        return _day_int(value)
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if _is_date(value):
+        return _day_int(value) * 10000 + (2359 if bound == 'end' else 0)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(pd.Timestamp(value).strftime('%Y%m%d%H%M'))
+
+
+class BarStore:
+    """
+    内存映射的列式行情存储
+
+    参数:
+        path: 存储目录
+        mode: 'r' 只读，'r+' 可追加
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.fields = list(meta['fields'])
+        self.symbols = list(meta['symbols'])
+        self.symbol_capacity = int(meta['symbol_capacity'])
+        self.time_dtype = np.dtype(meta.get('time_dtype', 'int32'))
+        # 早期的存储没有 frequency，按时间轴类型推断
+        self.frequency = meta.get('frequency', 'minute' if self.time_dtype == np.int64 else 'daily')
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self._map()
+
+    @classmethod
+    def create(cls, path, symbols, fields=FIELDS, symbol_capacity=None, frequency='daily', time_dtype=None):
+        """
+        新建空存储
+
+        参数:
+            symbols: 股票代码列表
+            symbol_capacity: 预留的股票列数（新增股票不超过该数量时无需重写文件），默认为股票数的1.25倍
+            frequency: 'daily' 日线 (时间键 yyyymmdd) 或 'minute' 分钟线 (时间键 yyyymmddHHMM)
+            time_dtype: 时间轴类型，默认日线 int32、分钟线 int64
+        """
+        if frequency not in TIME_FORMATS:
+            raise ValueError(f'不支持的频率: {frequency}')
+        os.makedirs(path, exist_ok=True)
+        symbols = list(symbols)
+        capacity = symbol_capacity or max(int(len(symbols) * 1.25), len(symbols), 1)
+        meta = {'fields': list(fields), 'symbols': symbols, 'symbol_capacity': capacity, 'frequency': frequency,
+                'time_dtype': str(np.dtype(time_dtype or TIME_DTYPES[frequency]))}
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        for name in ['days.idx'] + [field + '.f8' for field in fields]:
+            open(os.path.join(path, name), 'wb').close()
+        return cls(path, mode='r+')
+
+    def _map(self):
+        """按 days.idx 的长度重新映射全部字段文件"""
+        days_file = os.path.join(self.path, 'days.idx')
+        size = os.path.getsize(days_file) // self.time_dtype.itemsize
+        self.days = np.fromfile(days_file, dtype=self.time_dtype, count=size)
+        self.n_days = len(self.days)
+        self._columns = {}
+        for field in self.fields:
+            if self.n_days == 0:
+                self._columns[field] = np.empty((0, self.symbol_capacity))
+            else:
+                self._columns[field] = np.memmap(os.path.join(self.path, field + '.f8'), dtype=np.float64, mode='r',
+                                                 shape=(self.n_days, self.symbol_capacity))
+
+    def _save_meta(self):
+        meta = {'fields': self.fields, 'symbols': self.symbols, 'symbol_capacity': self.symbol_capacity,
+                'frequency': self.frequency, 'time_dtype': str(self.time_dtype)}
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def add_symbols(self, symbols):
+        """登记新股票（占用预留列，旧交易日为NaN）；超出预留容量时重写文件扩容"""
+        if self.mode != 'r+':
+            raise IOError('存储以只读方式打开')
+        new = [s for s in symbols if s not in self.symbol_index]
+        if not new:
+            return
+        if len(self.symbols) + len(new) > self.symbol_capacity:
+            self._resize(max(int((len(self.symbols) + len(new)) * 1.25), self.symbol_capacity * 2))
+        for symbol in new:
+            self.symbol_index[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        self._save_meta()
+
+    def _resize(self, capacity):
+        """扩大预留列数（需要重写全部字段文件）"""
+        for field in self.fields:
+            old = np.array(self._columns[field])
+            grown = np.full((self.n_days, capacity), np.nan)
+            grown[:, :self.symbol_capacity] = old
+            grown.tofile(os.path.join(self.path, field + '.f8'))
+        self.symbol_capacity = capacity
+        self._save_meta()
+        self._map()
+
+    def append(self, days, data):
+        """
+        在末尾追加新K线
+
+        参数:
+            days: K线的交易日 (日线) 或时刻 (分钟线) 列表，必须递增且晚于已有的最后一根K线
+            data: {字段: 数组 (len(days), 股票数) 或 宽表 DataFrame(columns=股票)}；
+                  数组的列与 self.symbols 对齐，宽表中未登记的股票会自动登记，缺失字段与股票为NaN
+        """
+        if self.mode != 'r+':
+            raise IOError('存储以只读方式打开')
+        days = np.array([_time_key(d, self.frequency) for d in days], dtype=self.time_dtype)
+        if len(days) == 0:
+            return
+        if (np.diff(days) <= 0).any() or (self.n_days and days[0] <= self.days[-1]):
+            raise ValueError('追加的K线时间必须递增且晚于已有数据')
+
+        for frame in data.values():
+            if isinstance(frame, pd.DataFrame):
+                self.add_symbols(list(frame.columns))
+
+        for field in self.fields:
+            block = np.full((len(days), self.symbol_capacity), np.nan)
+            values = data.get(field)
+            if isinstance(values, pd.DataFrame):
+                cols = np.array([self.symbol_index[s] for s in values.columns], dtype=np.int64)
+                block[:, cols] = values.to_numpy(dtype=np.float64)
+            elif values is not None:
+                values = np.asarray(values, dtype=np.float64)
+                block[:, :values.shape[1]] = values
+            with open(os.path.join(self.path, field + '.f8'), 'ab') as f:
+                # 以已提交的行数为准截断，丢弃上次追加失败残留的数据
+                f.truncate(self.n_days * self.symbol_capacity * 8)
+                block.tofile(f)
+
+        with open(os.path.join(self.path, 'days.idx'), 'ab') as f:
+            days.tofile(f)
+        self._map()
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    def column(self, field):
+        """整个字段的 (交易日, 股票) 只读视图（零拷贝）"""
+        return self._columns[field][:, :len(self.symbols)]
+
+    def day_slice(self, start=None, end=None, count=None):
+        """
+        区间 [start, end] 对应的行切片；count 表示截至 end 的最近 count 根K线
+        分钟线存储只给日期时覆盖整个交易日
+        """
+        if end is None:
+            hi = self.n_days
+        else:
+            hi = int(np.searchsorted(self.days, _time_key(end, self.frequency, 'end'), side='right'))
+        if count is not None:
+            lo = max(hi - count, 0)
+        elif start is None:
+            lo = 0
+        else:
+            lo = int(np.searchsorted(self.days, _time_key(start, self.frequency, 'start'), side='left'))
+        return slice(lo, hi)
+
+    def symbol_positions(self, symbols):
+        """股票代码对应的列号（未登记的股票为-1）"""
+        return np.array([self.symbol_index.get(s, -1) for s in symbols], dtype=np.int64)
+
+    def window(self, field, symbols=None, start=None, end=None, count=None):
+        """
+        按股票集合与日期区间取数据
+
+        symbols 为 None 时返回零拷贝视图；否则只读取所选行中对应的列，未登记的股票为NaN
+        """
+        rows = self._columns[field][self.day_slice(start, end, count)]
+        if symbols is None:
+            return rows[:, :len(self.symbols)]
+        cols = self.symbol_positions(symbols)
+        out = rows[:, np.maximum(cols, 0)]
+        out[:, cols < 0] = np.nan
+        return out
+
+    def frame(self, field, symbols=None, start=None, end=None, count=None):
+        """同 window，返回 index=交易日 (分钟线为时刻)、columns=股票 的 DataFrame"""
+        rows = self.day_slice(start, end, count)
+        index = pd.to_datetime(self.days[rows].astype(str), format=TIME_FORMATS[self.frequency])
+        return pd.DataFrame(self.window(field, symbols, start, end, count), index=index,
+                            columns=self.symbols if symbols is None else list(symbols))
+
+    @classmethod
+    def from_daily_frame(cls, path, daily, fields=FIELDS):
+        """由日线长表 (date, code, 字段...) 新建存储"""
+        daily = daily.copy()
+        daily['date'] = pd.to_datetime(daily['date'].astype(str))
+        symbols = sorted(daily['code'].unique())
+        fields = [field for field in fields if field in daily.columns]
+        store = cls.create(path, symbols, fields=fields)
+        data = {}
+        for field in fields:
+            if field in daily.columns:
+                data[field] = daily.pivot(index='date', columns='code', values=field).reindex(columns=symbols)
+        days = next(iter(data.values())).index
+        store.append(days, {f: v.loc[days] for f, v in data.items()})
+        return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='由日线CSV长表构建列式行情存储')
+    parser.add_argument('csv', help='日线长表 CSV (date, code, open, high, low, close, volume, money[, high_limit, low_limit])')
+    parser.add_argument('path', help='存储目录')
+    args = parser.parse_args()
+    store = BarStore.from_daily_frame(args.path, pd.read_csv(args.csv, dtype={'code': str}))
+    print(f"已写入 {store.n_days} 个交易日, {len(store.symbols)} 只股票 -> {args.path}")
+
+
+if __name__ == '__main__':
+    main()
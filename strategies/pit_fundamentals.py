@@ -0,0 +1,92 @@
+# 时点 (Point-in-Time) 财务数据
+#
+# PointInTimeTable：把一张财务表按 (股票, 公告日期) 排序后保存为类型化的 float64 列，
+#   查询"某日可见的最新数据"只需一次向量化 searchsorted，只使用公告日期不晚于查询日的记录，
+#   不会引入未来数据。百分比字符串 ('15.2%') 在加载时一次性解析为数值 (15.2)。
+#
+# 使用示例：
+#   table = PointInTimeTable.from_csv('./data/fundamentals/profit_ability.csv')
+#   df = table.asof(['600000.SS', '000001.SZ'], '2024-05-06', fields=['roe', 'roa'])
+
+import numpy as np
+import pandas as pd
+
+from bar_store import _day_int
+
+
+def to_numeric(column):
+    """把财务字段转为 float64；百分比字符串去掉 '%' 后按数值保存（'15.2%' -> 15.2）"""
+    if not pd.api.types.is_numeric_dtype(column):
+        return pd.to_numeric(column.astype(str).str.rstrip('%'), errors='coerce').values.astype(np.float64)
+    return column.values.astype(np.float64)
+
+
+class PointInTimeTable:
+    """
+    时点财务表
+
+    参数:
+        frame: 长表，包含 date（公告/可用日期）、code 以及各字段；
+               可选 end_date（报告期），同一天公告多期时取报告期最新的一条
+    """
+
+    def __init__(self, frame, date_col='date', code_col='code'):
+        frame = frame.dropna(subset=[date_col, code_col])
+        self.fields = [c for c in frame.columns if c not in (date_col, code_col, 'end_date')]
+        self.codes = np.array(sorted(frame[code_col].astype(str).unique()), dtype=object)
+        self.code_id = {code: i for i, code in enumerate(self.codes)}
+
+        code_ids = np.array([self.code_id[c] for c in frame[code_col].astype(str)], dtype=np.int64)
+        days = pd.to_datetime(frame[date_col].astype(str)).dt.strftime('%Y%m%d').astype(np.int64).values
+        keys = [days, code_ids]
+        if 'end_date' in frame.columns:
+            keys.insert(0, pd.to_datetime(frame['end_date'].astype(str)).dt.strftime('%Y%m%d').astype(np.int64).values)
+        order = np.lexsort(keys)
+
+        # 组合键 = 股票编号 * 1e8 + 公告日，整张表按组合键有序
+        self._keys = code_ids[order] * 100000000 + days[order]
+        self.columns = {field: to_numeric(frame[field])[order] for field in self.fields}
+
+    @classmethod
+    def from_csv(cls, path):
+        return cls(pd.read_csv(path, dtype={'code': str}))
+
+    def asof(self, codes, date, fields=None):
+        """
+        查询 date 当日可见的各股票最新数据
+
+        返回:
+            DataFrame(index=codes, columns=fields)，无可见数据的为NaN
+        """
+        codes = list(codes)
+        fields = list(fields) if fields is not None else self.fields
+        ids = np.array([self.code_id.get(code, -1) for code in codes], dtype=np.int64)
+        pos = np.searchsorted(self._keys, ids * 100000000 + _day_int(date), side='right') - 1
+        hit = (ids >= 0) & (pos >= 0)
+        hit[hit] = self._keys[pos[hit]] // 100000000 == ids[hit]
+
+        out = pd.DataFrame(index=pd.Index(codes, name='code'))
+        for field in fields:
+            values = np.full(len(codes), np.nan)
+            if field in self.columns:
+                values[hit] = self.columns[field][pos[hit]]
+            out[field] = values
+        return out
+
+    def panel(self, codes, dates, field):
+        """
+        一次向量化查询多个日期的时点数据
+
+        返回:
+            ndarray (len(dates), len(codes))，第 t 行为 dates[t] 当日可见的最新值
+        """
+        ids = np.array([self.code_id.get(code, -1) for code in codes], dtype=np.int64)
+        days = np.array([_day_int(d) for d in dates], dtype=np.int64)
+        pos = np.searchsorted(self._keys, ids[None, :] * 100000000 + days[:, None], side='right') - 1
+        hit = (ids[None, :] >= 0) & (pos >= 0)
+        hit[hit] = self._keys[pos[hit]] // 100000000 == np.broadcast_to(ids, pos.shape)[hit]
+        out = np.full(pos.shape, np.nan)
+        if field in self.columns:
+            out[hit] = self.columns[field][pos[hit]]
+        return out
+
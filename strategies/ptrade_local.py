@@ -0,0 +1,808 @@
+# PTrade 本地运行时 (离线回测引擎)
+#
+# 用途：
+# 在本地用磁盘上的数据文件模拟 PTrade 的全局对象与API（g、log、run_daily、
+# get_price、get_history、get_fundamentals、order_target_value、get_positions ...），
+# 按交易日历驱动 initialize / before_trading_start / run_daily 回调 / handle_data /
+# after_trading_end，按 set_commission / set_fixed_slippage 的设置模拟成交，
+# 从而无需在交易终端排队即可在本地（多进程并行）回测本仓库的 PTrade 策略。
+#
+# 数据目录结构（CSV，均为 UTF-8）：
+#   daily.csv                 日线行情长表：date, code, open, high, low, close, volume, money[, high_limit, low_limit]
+#                             （指数也放在这里，如 000001.SS / 399001.SZ / 399986.SZ）
+#   bars/           (可选)    列式内存映射行情 (见 bar_store.py)，存在时代替 daily.csv，加载几乎不占时间
+#   stocks.csv                股票信息：code, name, listed_date[, de_listed_date]
+#   st.csv          (可选)    ST区间：code, start_date, end_date
+#   index_members.csv (可选)  指数成分快照：date, index, code（查询时取不晚于当日的最近快照）
+#   industry.csv    (可选)    申万一级行业成分：industry, code（行业代码不带后缀）
+#   fundamentals/<表名>.csv (可选)  财务数据：date, code, 字段...（date 为公告/可用日期，按不晚于查询日取最新值）
+#
+# 撮合规则（仅有日线数据时的近似）：
+#   13:00 之前下单按当日开盘价成交，之后按收盘价成交；9:30 之前的行情报价为昨收
+#   买入按100股取整；停牌不成交；涨停不能买入、跌停不能卖出；当日买入的股票当日不可卖出 (T+1)
+#   佣金 = max(成交额 * commission_ratio, min_commission)，卖出另收印花税 tax
+#   固定滑点 fixedslippage：买入价 + slippage/2，卖出价 - slippage/2
+#
+# 使用示例：
+#   python strategies/ptrade_local.py strategies/02_four_stirrers_ptrade.py --data ./data \
+#       --start 2015-01-05 --end 2026-01-07 --capital 100000
+
+import argparse
+import datetime
+import functools
+import logging
+import os
+import time as _time
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from bar_store import BarStore
+from pit_fundamentals import PointInTimeTable
+
+
+_INTRADAY_SWITCH = datetime.time(13, 0)   # 之前按开盘价成交，之后按收盘价成交
+_MARKET_OPEN = datetime.time(9, 30)
+_PRICE_FIELDS = ['open', 'high', 'low', 'close', 'volume', 'money']
+
+
+def _to_day(value):
+    """把 'YYYYMMDD' / 'YYYY-MM-DD' / date / datetime / Timestamp 统一为 datetime64[D]"""
+    if value is None:
+        return None
+    if isinstance(value, np.datetime64):
+        return value.astype('datetime64[D]')
+    return np.datetime64(pd.Timestamp(str(value) if isinstance(value, (int, np.integer)) else value).date(), 'D')
+
+
+def _as_list(securities):
+    if securities is None:
+        return []
+    if isinstance(securities, str):
+        return [securities]
+    return list(securities)
+
+
+class LocalData:
+    """
+    本地行情与基础数据
+
+    日线行情按字段保存为 (交易日, 股票) 的 float64 矩阵，其余数据为查询用的索引结构
+    """
+
+    def __init__(self, dates, codes, bars, stocks=None, st_periods=None,
+                 index_members=None, industries=None, fundamentals=None):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.codes = list(codes)
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        self.bars = {field: values if isinstance(values, np.memmap) else np.asarray(values, dtype=np.float64)
+                     for field, values in bars.items()}
+        if 'high_limit' not in self.bars or 'low_limit' not in self.bars:
+            self._derive_limits()
+
+        # 股票信息
+        stocks = stocks if stocks is not None else pd.DataFrame(columns=['code', 'name', 'listed_date'])
+        self.stocks = stocks.set_index('code')
+        self.stock_info = self.stocks.to_dict('index')
+        self.timestamps = pd.DatetimeIndex(self.dates)
+
+        # ST区间
+        self.st_periods = {}
+        if st_periods is not None:
+            for row in st_periods.itertuples(index=False):
+                end = _to_day(row.end_date) if isinstance(row.end_date, str) and row.end_date else np.datetime64('2262-01-01')
+                self.st_periods.setdefault(row.code, []).append((_to_day(row.start_date), end))
+
+        # 指数成分快照
+        self.index_members = {}
+        if index_members is not None and len(index_members):
+            for index_code, frame in index_members.groupby('index'):
+                snapshots = frame.groupby('date')['code'].apply(list).sort_index()
+                days = np.array([_to_day(d) for d in snapshots.index], dtype='datetime64[D]')
+                self.index_members[index_code] = (days, list(snapshots.values))
+
+        # 行业成分
+        self.industries = {}
+        self.stock_blocks = {}
+        if industries is not None:
+            for row in industries.itertuples(index=False):
+                industry = str(row.industry)
+                self.industries.setdefault(industry, []).append(row.code)
+                self.stock_blocks.setdefault(row.code, []).append(industry)
+
+        # 财务数据：按 (股票, 公告日期) 排序的时点表，查询为一次向量化二分查找 (见 pit_fundamentals.py)
+        self.fundamentals = {table: PointInTimeTable(frame) for table, frame in (fundamentals or {}).items()}
+
+    def _derive_limits(self):
+        """数据中没有涨跌停价时按昨收推算（创业板/科创板2020-08-24后为20%，其余10%）"""
+        close = self.bars['close']
+        prev = np.vstack([np.full((1, close.shape[1]), np.nan), close[:-1]])
+        prev = pd.DataFrame(prev).ffill().values
+        wide = np.array([code.startswith(('300', '301', '688')) for code in self.codes])
+        ratio = np.where(wide[None, :] & (self.dates[:, None] >= np.datetime64('2020-08-24')), 0.2, 0.1)
+        self.bars.setdefault('high_limit', np.round(prev * (1 + ratio), 2))
+        self.bars.setdefault('low_limit', np.round(prev * (1 - ratio), 2))
+
+    @classmethod
+    def from_frames(cls, daily, stocks=None, st_periods=None, index_members=None, industries=None, fundamentals=None):
+        """由日线行情长表 (date, code, 字段...) 及其余表格构建"""
+        daily = daily.copy()
+        daily['date'] = pd.to_datetime(daily['date'].astype(str))
+        dates = np.array(sorted(daily['date'].unique()), dtype='datetime64[D]')
+        codes = sorted(daily['code'].unique())
+        fields = [c for c in daily.columns if c not in ('date', 'code')]
+        bars = {}
+        for field in fields:
+            wide = daily.pivot(index='date', columns='code', values=field)
+            bars[field] = wide.reindex(index=dates.astype('datetime64[ns]'), columns=codes).values
+        return cls(dates, codes, bars, stocks, st_periods, index_members, industries, fundamentals)
+
+    @classmethod
+    def from_bar_store(cls, store, stocks=None, st_periods=None, index_members=None, industries=None, fundamentals=None):
+        """由列式行情存储构建，行情矩阵直接使用内存映射视图，不复制数据"""
+        store = store if isinstance(store, BarStore) else BarStore(store)
+        if store.frequency != 'daily':
+            raise ValueError(f'本地回测需要日线存储，{store.path} 为 {store.frequency} 存储')
+        dates = pd.to_datetime(store.days.astype(str), format='%Y%m%d').values.astype('datetime64[D]')
+        bars = {field: store.column(field) for field in store.fields}
+        return cls(dates, store.symbols, bars, stocks, st_periods, index_members, industries, fundamentals)
+
+    @classmethod
+    def load(cls, path, bars=None):
+        """从数据目录加载（结构见文件头说明）；bars 指定列式行情存储目录，默认为数据目录下的 bars/"""
+        def read(name, dtype=None):
+            file = os.path.join(path, name)
+            return pd.read_csv(file, dtype=dtype or {'code': str}) if os.path.exists(file) else None
+
+        fundamentals = {}
+        fund_dir = os.path.join(path, 'fundamentals')
+        if os.path.isdir(fund_dir):
+            for name in sorted(os.listdir(fund_dir)):
+                if name.endswith('.csv'):
+                    fundamentals[name[:-4]] = pd.read_csv(os.path.join(fund_dir, name), dtype={'code': str})
+        tables = dict(
+            stocks=read('stocks.csv', dtype={'code': str, 'listed_date': str}),
+            st_periods=read('st.csv', dtype={'code': str, 'start_date': str, 'end_date': str}),
+            index_members=read('index_members.csv', dtype={'code': str, 'index': str}),
+            industries=read('industry.csv', dtype={'code': str, 'industry': str}),
+            fundamentals=fundamentals,
+        )
+        bars = bars or os.path.join(path, 'bars')
+        if os.path.exists(os.path.join(bars, 'meta.json')):
+            return cls.from_bar_store(bars, **tables)
+        return cls.from_frames(read('daily.csv'), **tables)
+
+
+class GlobalVars:
+    """PTrade 全局对象 g"""
+    pass
+
+
+class Blotter:
+    def __init__(self):
+        self.current_dt = None
+
+
+class Position:
+    """持仓 (与 PTrade Position 字段同名)"""
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.amount = 0
+        self.enable_amount = 0
+        self.cost_basis = 0.0
+        self.last_sale_price = 0.0
+
+
+class Portfolio:
+    def __init__(self, cash):
+        self.start_cash = cash
+        self.cash = cash
+        self.positions = {}
+
+    @property
+    def positions_value(self):
+        return sum(p.amount * p.last_sale_price for p in self.positions.values())
+
+    @property
+    def portfolio_value(self):
+        return self.cash + self.positions_value
+
+
+class Context:
+    def __init__(self, cash):
+        self.blotter = Blotter()
+        self.portfolio = Portfolio(cash)
+        self.previous_date = None
+
+
+class BacktestResult:
+    """回测结果：逐日权益、换手与成交记录"""
+
+    def __init__(self, equity, turnover, trades, benchmark=None):
+        self.equity = equity          # pd.Series, index=交易日
+        self.turnover = turnover      # pd.Series, 当日成交额 / 当日权益
+        self.trades = trades          # pd.DataFrame
+        self.benchmark = benchmark
+
+    @property
+    def drawdown(self):
+        return self.equity / self.equity.cummax() - 1
+
+    def summary(self):
+        years = max(len(self.equity) / 244.0, 1e-9)
+        total = self.equity.iloc[-1] / self.equity.iloc[0] - 1 if len(self.equity) else 0.0
+        return {
+            'total_return': float(total),
+            'annual_return': float((1 + total) ** (1 / years) - 1),
+            'max_drawdown': float(self.drawdown.min()) if len(self.equity) else 0.0,
+            'turnover': float(self.turnover.sum() / years),
+            'trades': len(self.trades),
+        }
+
+
+class PTradeRuntime:
+    """
+    PTrade API 的本地替身 + 事件驱动回测引擎
+
+    参数:
+        strategy_path: 策略文件路径
+        data: LocalData 或数据目录
+        capital: 初始资金
+        tax: 卖出印花税率
+        params: initialize 之后覆盖到 g 上的参数字典（用于参数扫描）
+        log_level: 策略日志级别
+        profiler: 可选的 ptrade_profiler.Profiler，给定时记录每个API与策略函数的调用
+        latency: 每次数据查询API (get_*，持仓查询除外) 额外等待的秒数，模拟平台请求的往返耗时
+    """
+
+    def __init__(self, strategy_path, data, capital=100000.0, tax=0.001, params=None, log_level=logging.WARNING,
+                 profiler=None, latency=0.0):
+        self.strategy_path = strategy_path
+        self.data = data if isinstance(data, LocalData) else LocalData.load(data)
+        self.capital = float(capital)
+        self.tax = tax
+        self.params = params or {}
+        self.profiler = profiler
+        self.latency = latency
+        self.log = logging.getLogger('ptrade_local.' + os.path.splitext(os.path.basename(strategy_path))[0])
+        self.log.setLevel(log_level)
+
+        self.commission_ratio = 0.0003
+        self.min_commission = 5.0
+        self.fixed_slippage = 0.0
+        self.slippage_ratio = 0.0
+        self.benchmark = None
+        self.universe = []
+        self._daily = []          # [(time, func)]
+        self._order_seq = 0
+        self._trades = []
+        self._traded_value = 0.0
+        self._bought_today = {}
+
+        self.context = Context(self.capital)
+        self.g = GlobalVars()
+        self.namespace = self._load_strategy()
+
+    # ------------------------------------------------------------------
+    # 策略加载与调度
+    # ------------------------------------------------------------------
+    def api(self):
+        """注入策略命名空间的全局对象与API"""
+        return {
+            'g': self.g,
+            'log': self.log,
+            'set_benchmark': self.set_benchmark,
+            'set_commission': self.set_commission,
+            'set_fixed_slippage': self.set_fixed_slippage,
+            'set_slippage': self.set_slippage,
+            'set_universe': self.set_universe,
+            'run_daily': self.run_daily,
+            'run_interval': self.run_interval,
+            'is_trade': lambda: False,
+            'get_trade_days': self.get_trade_days,
+            'get_all_trades_days': self.get_all_trades_days,
+            'get_price': self.get_price,
+            'get_history': self.get_history,
+            'get_snapshot': self.get_snapshot,
+            'get_fundamentals': self.get_fundamentals,
+            'get_index_stocks': self.get_index_stocks,
+            'get_Ashares': self.get_Ashares,
+            'get_industry_stocks': self.get_industry_stocks,
+            'get_stock_blocks': self.get_stock_blocks,
+            'get_stock_status': self.get_stock_status,
+            'get_stock_name': self.get_stock_name,
+            'get_stock_info': self.get_stock_info,
+            'get_positions': self.get_positions,
+            'get_position': self.get_position,
+            'order': self.order,
+            'order_target': self.order_target,
+            'order_value': self.order_value,
+            'order_target_value': self.order_target_value,
+        }
+
+    def _with_latency(self, api):
+        """给数据查询API加上固定延迟（线程内 sleep，不占用 GIL，可被并发请求重叠）"""
+        latency = self.latency
+
+        def delayed(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                _time.sleep(latency)
+                return func(*args, **kwargs)
+            return wrapper
+
+        return {name: delayed(obj) if name.startswith('get_') and name not in ('get_positions', 'get_position') else obj
+                for name, obj in api.items()}
+
+    def _load_strategy(self):
+        with open(self.strategy_path, encoding='utf-8') as f:
+            source = f.read()
+        namespace = {'__name__': 'ptrade_strategy', '__file__': self.strategy_path}
+        api = self.api()
+        if self.latency > 0:
+            api = self._with_latency(api)
+        namespace.update(self.profiler.wrap_api(api) if self.profiler is not None else api)
+        exec(compile(source, self.strategy_path, 'exec'), namespace)
+        if self.profiler is not None:
+            self.profiler.wrap_functions(namespace, self.strategy_path)
+        return namespace
+
+    def set_benchmark(self, security):
+        self.benchmark = security
+
+    def set_commission(self, commission_ratio=0.0003, min_commission=5.0, type='STOCK'):
+        self.commission_ratio = commission_ratio
+        self.min_commission = min_commission
+
+    def set_fixed_slippage(self, fixedslippage=0.0):
+        self.fixed_slippage = fixedslippage
+        self.slippage_ratio = 0.0
+
+    def set_slippage(self, slippage=0.0):
+        self.slippage_ratio = slippage
+        self.fixed_slippage = 0.0
+
+    def set_universe(self, security_list):
+        self.universe = _as_list(security_list)
+
+    def run_daily(self, context, func, time='9:31'):
+        hour, minute = (int(x) for x in str(time).split(':')[:2])
+        self._daily.append((datetime.time(hour, minute), func))
+
+    def run_interval(self, context, func, seconds=10):
+        # 日线回测没有盘中时间片，按 PTrade 回测行为忽略
+        pass
+
+    def run(self, start=None, end=None):
+        """按交易日历运行回测，返回 BacktestResult"""
+        dates = self.data.dates
+        lo = 0 if start is None else int(np.searchsorted(dates, _to_day(start), side='left'))
+        hi = len(dates) if end is None else int(np.searchsorted(dates, _to_day(end), side='right'))
+        days = dates[lo:hi]
+        if len(days) == 0:
+            raise ValueError('回测区间内没有交易日')
+
+        ns = self.namespace
+        self._t = lo
+        self.context.blotter.current_dt = datetime.datetime.combine(days[0].item(), datetime.time(8, 30))
+        ns['initialize'](self.context)
+        for key, value in self.params.items():
+            setattr(self.g, key, value)
+
+        events = [(datetime.time(9, 0), 'before_trading_start')]
+        events += [(t, func) for t, func in self._daily]
+        events += [(datetime.time(14, 50), 'handle_data'), (datetime.time(15, 30), 'after_trading_end')]
+        events.sort(key=lambda e: e[0])
+
+        equity, turnover = [], []
+        for t in range(lo, hi):
+            self._begin_day(t)
+            day = dates[t].item()
+            self._traded_value = 0.0
+            for at, func in events:
+                self.context.blotter.current_dt = datetime.datetime.combine(day, at)
+                if isinstance(func, str):
+                    if func in ns:
+                        ns[func](self.context, {})
+                else:
+                    func(self.context)
+            self._mark_to_market(t, 'close')
+            value = self.context.portfolio.portfolio_value
+            equity.append(value)
+            turnover.append(self._traded_value / value if value else 0.0)
+
+        index = self.data.timestamps[lo:hi]
+        benchmark = None
+        if self.benchmark in self.data.code_index:
+            benchmark = pd.Series(self.data.bars['close'][lo:hi, self.data.code_index[self.benchmark]], index=index)
+        trades = pd.DataFrame(self._trades, columns=['datetime', 'code', 'amount', 'price', 'commission', 'tax'])
+        return BacktestResult(pd.Series(equity, index=index), pd.Series(turnover, index=index), trades, benchmark)
+
+    def _begin_day(self, t):
+        self._t = t
+        if self.profiler is not None:
+            day = self.data.timestamps[t]
+            self.profiler.day = day.year * 10000 + day.month * 100 + day.day
+        self.context.previous_date = self.data.dates[t - 1].item() if t > 0 else None
+        self._bought_today = {}
+        for position in self.context.portfolio.positions.values():
+            position.enable_amount = position.amount
+        self._mark_to_market(t - 1, 'close')
+
+    def _mark_to_market(self, t, field):
+        if t < 0:
+            return
+        prices = self.data.bars[field][t]
+        for code, position in self.context.portfolio.positions.items():
+            px = prices[self.data.code_index[code]]
+            if not np.isnan(px):
+                position.last_sale_price = px
+
+    # ------------------------------------------------------------------
+    # 行情时间轴
+    # ------------------------------------------------------------------
+    def _now(self):
+        return self.context.blotter.current_dt
+
+    def _last_complete(self):
+        """最近一根已收盘日线的下标（收盘前为昨日）"""
+        return self._t if self._now().time() >= datetime.time(15, 0) else self._t - 1
+
+    def _day_index(self, value, side='right'):
+        """日期对应的交易日下标（非交易日取之前最近的交易日）"""
+        return int(np.searchsorted(self.data.dates, _to_day(value), side=side)) - (1 if side == 'right' else 0)
+
+    def _columns(self, securities):
+        index = self.data.code_index
+        return np.array([index.get(code, -1) for code in securities], dtype=np.int64)
+
+    def _take(self, field, rows, cols):
+        """取 (rows, cols) 子矩阵（rows 为行切片或行号列表），不存在的股票为NaN"""
+        values = self.data.bars[field][rows][:, np.maximum(cols, 0)]
+        values[:, cols < 0] = np.nan
+        return values
+
+    def _current_prices(self, cols):
+        """当前时刻的近似价格：开盘前为昨收，13:00前为开盘价，之后为收盘价"""
+        now = self._now().time()
+        if now < _MARKET_OPEN:
+            return self._take('close', [max(self._t - 1, 0)], cols)[0]
+        field = 'open' if now < _INTRADAY_SWITCH else 'close'
+        return self._take(field, [self._t], cols)[0]
+
+    def _today_bar(self, field, cols):
+        """当日未完成的K线：价格取当前近似价，其余字段取当日数据"""
+        if field in ('open', 'high', 'low', 'close'):
+            return self._current_prices(cols)
+        return self._take(field, [self._t], cols)[0]
+
+    # ------------------------------------------------------------------
+    # 行情API
+    # ------------------------------------------------------------------
+    def get_trade_days(self, start_date=None, end_date=None, count=None):
+        dates = self.data.dates
+        hi = self._day_index(end_date) + 1 if end_date is not None else self._t + 1
+        if count is not None:
+            lo = max(hi - count, 0)
+        else:
+            lo = self._day_index(start_date, side='left') if start_date is not None else 0
+        return [d.item() for d in dates[lo:hi]]
+
+    def get_all_trades_days(self, date=None):
+        hi = self._day_index(date) + 1 if date is not None else len(self.data.dates)
+        return np.array([d.item() for d in self.data.dates[:hi]])
+
+    def get_price(self, security, start_date=None, end_date=None, frequency='1d', fields=None, fq=None, count=None):
+        if frequency not in ('1d', 'daily'):
+            raise NotImplementedError('本地运行时仅支持日线 get_price')
+        securities = _as_list(security)
+        fields = _as_list(fields) or list(_PRICE_FIELDS)
+        hi = self._last_complete() if end_date is None else min(self._day_index(end_date), self._last_complete())
+        if count is not None:
+            lo = max(hi - count + 1, 0)
+        else:
+            lo = self._day_index(start_date, side='left') if start_date is not None else 0
+        rows = slice(lo, hi + 1)
+        index = self.data.timestamps[rows]
+        cols = self._columns(securities)
+        if isinstance(security, str):
+            return pd.DataFrame({f: self._take(f, rows, cols)[:, 0] for f in fields}, index=index)
+        frame = pd.DataFrame({
+            'code': np.tile(np.array(securities, dtype=object), len(index)),
+            **{f: self._take(f, rows, cols).ravel() for f in fields},
+        }, index=np.repeat(index, len(securities)))
+        return frame
+
+    def get_history(self, count, frequency='1d', field='close', security_list=None, fq=None,
+                    include=False, fill='nan', is_dict=False):
+        securities = _as_list(security_list) or list(self.universe)
+        fields = _as_list(field)
+        cols = self._columns(securities)
+        if frequency in ('1d', 'daily'):
+            hi = self._t - 1
+            n_done = count - 1 if include else count
+            lo = max(hi - n_done + 1, 0)
+            rows = slice(lo, hi + 1)
+            index = list(self.data.timestamps[rows])
+            blocks = {f: self._take(f, rows, cols) for f in fields}
+            if include:
+                index.append(pd.Timestamp(self._now()))
+                blocks = {f: np.vstack([v, self._today_bar(f, cols)[None, :]]) for f, v in blocks.items()}
+        else:
+            # 没有分钟数据：以当前时刻的近似价格作为最新一根分钟K线
+            index = [pd.Timestamp(self._now())]
+            blocks = {f: self._today_bar(f, cols)[None, :] for f in fields}
+        index = pd.DatetimeIndex(index)
+
+        if is_dict:
+            return {code: {f: blocks[f][:, j] for f in fields} for j, code in enumerate(securities)}
+        if len(securities) == 1 and isinstance(security_list, str):
+            return pd.DataFrame({f: blocks[f][:, 0] for f in fields}, index=index)
+        if len(fields) == 1:
+            return pd.DataFrame(blocks[fields[0]], index=index, columns=securities)
+        return pd.DataFrame({
+            'code': np.tile(np.array(securities, dtype=object), len(index)),
+            **{f: blocks[f].ravel() for f in fields},
+        }, index=np.repeat(index, len(securities)))
+
+    def get_snapshot(self, security):
+        securities = _as_list(security)
+        cols = self._columns(securities)
+        last = self._current_prices(cols)
+        prev = self._take('close', [max(self._t - 1, 0)], cols)[0]
+        high_limit = self._take('high_limit', [self._t], cols)[0]
+        low_limit = self._take('low_limit', [self._t], cols)[0]
+        volume = self._take('volume', [self._t], cols)[0]
+        result = {}
+        for j, code in enumerate(securities):
+            if cols[j] < 0:
+                continue
+            result[code] = {
+                'last_px': last[j], 'preclose_px': prev[j],
+                'up_px': high_limit[j], 'down_px': low_limit[j],
+                'high_limit': high_limit[j], 'low_limit': low_limit[j],
+                'business_amount': volume[j],
+                'trade_status': 'HALT' if not volume[j] > 0 else 'TRADE',
+            }
+        return result
+
+    def get_fundamentals(self, security, table, fields=None, date=None, **kwargs):
+        securities = _as_list(security)
+        if table not in self.data.fundamentals:
+            return pd.DataFrame(index=securities)
+        pit = self.data.fundamentals[table]
+        day = _to_day(date) if date is not None else self.data.dates[self._t]
+        fields = _as_list(fields) or pit.fields
+        out = pit.asof(securities, day, [f for f in fields if f != 'secu_code'])
+        if 'secu_code' in fields:
+            out.insert(fields.index('secu_code'), 'secu_code', securities)
+        return out
+
+    # ------------------------------------------------------------------
+    # 基础数据API
+    # ------------------------------------------------------------------
+    def get_index_stocks(self, index_code, date=None):
+        if index_code not in self.data.index_members:
+            return []
+        days, members = self.data.index_members[index_code]
+        day = _to_day(date) if date is not None else self.data.dates[self._t]
+        i = int(np.searchsorted(days, day, side='right')) - 1
+        return list(members[i]) if i >= 0 else []
+
+    def get_Ashares(self, date=None):
+        day = _to_day(date) if date is not None else self.data.dates[self._t]
+        stocks = self.data.stocks
+        listed = pd.to_datetime(stocks['listed_date'].astype(str), errors='coerce').values.astype('datetime64[D]')
+        ok = ~(listed > day)
+        if 'de_listed_date' in stocks.columns:
+            delisted = pd.to_datetime(stocks['de_listed_date'].astype(str), errors='coerce').values.astype('datetime64[D]')
+            ok &= ~(delisted <= day)
+        return [code for code, keep in zip(stocks.index, ok) if keep and code in self.data.code_index]
+
+    def get_industry_stocks(self, industry_code):
+        return list(self.data.industries.get(industry_code.split('.')[0], []))
+
+    def get_stock_blocks(self, stock):
+        return list(self.data.stock_blocks.get(stock, []))
+
+    def get_stock_status(self, stocks, query_type='ST', query_date=None):
+        securities = _as_list(stocks)
+        day = _to_day(query_date) if query_date is not None else self.data.dates[self._t]
+        if query_type == 'HALT':
+            t = self._day_index(day)
+            volume = self._take('volume', [t], self._columns(securities))[0]
+            return {code: not volume[j] > 0 for j, code in enumerate(securities)}
+        if query_type == 'ST':
+            periods = self.data.st_periods
+            return {code: any(s <= day <= e for s, e in periods.get(code, ())) for code in securities}
+        return {code: False for code in securities}
+
+    def get_stock_name(self, stocks):
+        info = self.data.stock_info
+        return {code: info[code].get('name') for code in _as_list(stocks) if code in info}
+
+    def get_stock_info(self, stocks, field=None):
+        fields = _as_list(field) or ['stock_name', 'listed_date', 'de_listed_date']
+        info = self.data.stock_info
+        result = {}
+        for code in _as_list(stocks):
+            row = info.get(code)
+            if row is not None:
+                result[code] = {f: row.get('name' if f == 'stock_name' else f) for f in fields}
+        return result
+
+    # ------------------------------------------------------------------
+    # 交易API
+    # ------------------------------------------------------------------
+    def get_positions(self, security=None):
+        positions = {code: p for code, p in self.context.portfolio.positions.items() if p.amount > 0}
+        if security is None:
+            return positions
+        return {code: positions[code] for code in _as_list(security) if code in positions}
+
+    def get_position(self, security):
+        return self.context.portfolio.positions.get(security) or Position(security)
+
+    def _fill_price(self, col, side):
+        t = self._t
+        field = 'open' if self._now().time() < _INTRADAY_SWITCH else 'close'
+        price = self.data.bars[field][t, col]
+        volume = self.data.bars['volume'][t, col]
+        if np.isnan(price) or not volume > 0:
+            return None
+        if side > 0 and price >= self.data.bars['high_limit'][t, col] - 1e-6:
+            return None
+        if side < 0 and price <= self.data.bars['low_limit'][t, col] + 1e-6:
+            return None
+        if self.fixed_slippage:
+            price += side * self.fixed_slippage / 2
+        elif self.slippage_ratio:
+            price *= 1 + side * self.slippage_ratio / 2
+        return price
+
+    def order(self, security, amount, limit_price=None):
+        """按股数下单，正数买入负数卖出；立即按当前近似价成交，返回订单号，未成交返回None"""
+        col = self.data.code_index.get(security)
+        if col is None or amount == 0:
+            return None
+        side = 1 if amount > 0 else -1
+        price = self._fill_price(col, side)
+        if price is None:
+            self.log.debug(f"{security} 停牌或涨跌停，订单未成交")
+            return None
+
+        portfolio = self.context.portfolio
+        position = portfolio.positions.get(security)
+        if side > 0:
+            amount = int(amount // 100 * 100)
+            # 资金不足时按可买数量成交
+            while amount > 0:
+                value = amount * price
+                cost = value + max(value * self.commission_ratio, self.min_commission)
+                if cost <= portfolio.cash + 1e-6:
+                    break
+                amount = int(min(amount - 100, portfolio.cash / (price * (1 + self.commission_ratio)) // 100 * 100))
+            if amount <= 0:
+                return None
+        else:
+            available = position.enable_amount if position else 0
+            amount = -min(-amount, available)
+            if amount == 0:
+                return None
+
+        value = abs(amount) * price
+        commission = max(value * self.commission_ratio, self.min_commission)
+        tax = value * self.tax if side < 0 else 0.0
+        if position is None:
+            position = portfolio.positions[security] = Position(security)
+        if side > 0:
+            position.cost_basis = (position.cost_basis * position.amount + value + commission) / (position.amount + amount)
+            portfolio.cash -= value + commission
+        else:
+            portfolio.cash += value - commission - tax
+            position.enable_amount += amount
+        position.amount += amount
+        position.last_sale_price = price
+        if position.amount == 0:
+            del portfolio.positions[security]
+
+        self._traded_value += value
+        self._order_seq += 1
+        self._trades.append((self._now(), security, amount, price, commission, tax))
+        return str(self._order_seq)
+
+    def order_target(self, security, amount, limit_price=None):
+        position = self.context.portfolio.positions.get(security)
+        return self.order(security, amount - (position.amount if position else 0), limit_price)
+
+    def order_value(self, security, value, limit_price=None):
+        col = self.data.code_index.get(security)
+        price = self._current_prices(np.array([col]))[0] if col is not None else np.nan
+        if np.isnan(price) or price <= 0:
+            return None
+        return self.order(security, int(value / price // 100 * 100), limit_price)
+
+    def order_target_value(self, security, value, limit_price=None):
+        col = self.data.code_index.get(security)
+        price = self._current_prices(np.array([col]))[0] if col is not None else np.nan
+        if np.isnan(price) or price <= 0:
+            return None
+        position = self.context.portfolio.positions.get(security)
+        held = position.amount if position else 0
+        if value <= 0:
+            return self.order(security, -held, limit_price)
+        delta = int(value / price) - held
+        return self.order(security, int(delta // 100 * 100) if delta > 0 else -int(-delta // 100 * 100), limit_price)
+
+
+# 每个工作进程缓存已加载的数据目录
+_worker_data = {}
+
+
+def run_backtest(strategy_path, data, start=None, end=None, capital=100000.0, params=None, **kwargs):
+    """运行一次回测并返回 BacktestResult（data 可为 LocalData 或数据目录）"""
+    if not isinstance(data, LocalData):
+        if data not in _worker_data:
+            _worker_data[data] = LocalData.load(data)
+        data = _worker_data[data]
+    runtime = PTradeRuntime(strategy_path, data, capital=capital, params=params, **kwargs)
+    return runtime.run(start, end)
+
+
+def _run_job(job):
+    result = run_backtest(**job)
+    return job, result.summary(), result.equity
+
+
+def run_many(jobs, processes=None):
+    """
+    多进程并行运行多个回测
+
+    参数:
+        jobs: run_backtest 关键字参数字典的列表（data 传数据目录，每个进程只加载一次）
+        processes: 进程数，默认为CPU核数
+    返回:
+        [(job, summary, equity), ...]，与 jobs 同序
+    """
+    with Pool(processes) as pool:
+        return pool.map(_run_job, jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PTrade 策略本地回测')
+    parser.add_argument('strategy', help='策略文件路径')
+    parser.add_argument('--data', required=True, help='数据目录')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--capital', type=float, default=100000.0)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--profile', default=None, help='输出剖析结果的路径前缀（写 <前缀>.csv 与 <前缀>.folded）')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='每次数据查询API注入的延迟（毫秒）')
+    args = parser.parse_args()
+
+    profiler = None
+    if args.profile:
+        from ptrade_profiler import Profiler
+        profiler = Profiler()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    started = _time.time()
+    result = run_backtest(args.strategy, args.data, args.start, args.end, args.capital,
+                          log_level=getattr(logging, args.log_level.upper()), profiler=profiler,
+                          latency=args.latency_ms / 1000)
+    print(f"回测完成，用时 {_time.time() - started:.1f} 秒")
+    for key, value in result.summary().items():
+        print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+
+    if profiler is not None:
+        table = profiler.table(per_day=True)
+        table.to_csv(args.profile + '.csv', index=False)
+        profiler.collapsed(args.profile + '.folded')
+        print(f"剖析结果已写入 {args.profile}.csv / {args.profile}.folded")
+        print(profiler.table().sort_values('wall', ascending=False).head(15).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+# PTrade 策略运行剖析 (可选开启)
+#
+# 配合 ptrade_local.py 使用：把注入策略的每个平台API (get_history、get_stock_status、
+# get_fundamentals、get_snapshot ...) 和策略文件中定义的每个函数（含 run_daily 注册的回调、
+# 各过滤环节）包装一层，记录调用栈、交易日、耗时、返回行数，以及缓存函数的命中/未命中。
+# 缓存函数（见 CACHE_FUNCTIONS）执行期间没有调用任何平台API记为命中，否则记为未命中。
+#
+# 记录保存在预分配的环形缓冲区中（每次调用写一个元组，超出容量时覆盖最早的记录），
+# 可导出为扁平表（按交易日 / 调用栈汇总）或火焰图使用的折叠栈格式
+# (flamegraph.pl、speedscope 均可直接读取)。
+# 不开启时运行时不做任何包装，没有额外开销。
+# 策略在工作线程中并发发出的API调用（见策略内的 ConcurrentFetcher）记在主线程当前的调用栈下。
+#
+# 使用示例：
+#   profiler = Profiler()
+#   result = run_backtest('strategies/02_four_stirrers_ptrade.py', './data', profiler=profiler)
+#   profiler.table().sort_values('wall', ascending=False).head(20)
+#   profiler.collapsed('profile.folded')
+#   或命令行：python strategies/ptrade_local.py <策略> --data ./data --profile ./profile
+
+import functools
+import threading
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+
+# 结果带缓存、未命中时才请求平台的策略函数
+CACHE_FUNCTIONS = (
+    'get_fundamentals_cached', 'get_st_flags', 'get_listed_dates', 'get_halt_flags',
+    'get_industry_index', 'update_market_breadth', 'judge_market_env', 'evaluate_factor',
+)
+
+KINDS = ('function', 'api')
+
+
+def _rows(result):
+    """返回值的行数：DataFrame/列表/字典为长度，None 为0，其余为1"""
+    if result is None:
+        return 0
+    try:
+        return len(result)
+    except TypeError:
+        return 1
+
+
+class Profiler:
+    """
+    调用剖析器
+
+    参数:
+        capacity: 环形缓冲区容量（按2的幂向上取整），超出后只保留最近的记录
+        cached: 视为缓存函数的策略函数名
+    """
+
+    def __init__(self, capacity=1 << 18, cached=CACHE_FUNCTIONS):
+        self.capacity = 1 << max(int(capacity) - 1, 1).bit_length()
+        self._mask = self.capacity - 1
+        self._buf = [None] * self.capacity
+        self._n = 0
+        self._stack = ['']     # 主线程的调用栈
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sites = {}        # 调用栈 'a;b;c' -> 编号
+        self._site_names = []
+        self._api_calls = 0
+        self.cached = set(cached)
+        self.day = 0            # 当前交易日 yyyymmdd，由运行时设置
+
+    @property
+    def dropped(self):
+        """因缓冲区已满被覆盖的记录数"""
+        return max(self._n - self.capacity, 0)
+
+    def reset(self):
+        self._buf = [None] * self.capacity
+        self._n = 0
+        self._api_calls = 0
+
+    # ------------------------------------------------------------------
+    # 包装
+    # ------------------------------------------------------------------
+    def _wrap(self, name, func, kind):
+        clock = time.perf_counter
+        kind_code = KINDS.index(kind)
+        is_api = kind == 'api'
+        is_cached = name in self.cached
+        main_stack = self._stack
+        main_thread = threading.main_thread()
+        local = self._local
+        sites = self._sites
+        lock = self._lock
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = main_stack
+            if threading.current_thread() is not main_thread:
+                # 工作线程：空闲时以主线程当前所在的函数为根 (主线程此时正等待并发请求完成)
+                stack = local.__dict__.setdefault('stack', [''])
+                if len(stack) == 1:
+                    stack[0] = main_stack[-1]
+            key = stack[-1] + ';' + name if stack[-1] else name
+            stack.append(key)
+            if is_api:
+                self._api_calls += 1
+            api_before = self._api_calls
+            result = None
+            start = clock()
+            try:
+                result = func(*args, **kwargs)
+                return result
+            finally:
+                wall = clock() - start
+                stack.pop()
+                hit = (1 if self._api_calls == api_before else 0) if is_cached else -1
+                with lock:
+                    site = sites.get(key)
+                    if site is None:
+                        site = sites[key] = len(self._site_names)
+                        self._site_names.append(key)
+                    self._buf[self._n & self._mask] = (self.day, site, kind_code, wall, _rows(result), hit)
+                    self._n += 1
+
+        return wrapper
+
+    def wrap_api(self, api):
+        """包装注入策略的API字典（g、log 等非函数对象原样返回）"""
+        return {name: self._wrap(name, obj, 'api') if callable(obj) and not isinstance(obj, type) else obj
+                for name, obj in api.items()}
+
+    def wrap_functions(self, namespace, filename):
+        """包装策略命名空间中在 filename 里定义的全部模块级函数"""
+        for name, obj in list(namespace.items()):
+            if isinstance(obj, types.FunctionType) and obj.__code__.co_filename == filename:
+                namespace[name] = self._wrap(name, obj, 'function')
+
+    # ------------------------------------------------------------------
+    # 导出
+    # ------------------------------------------------------------------
+    def events(self):
+        """缓冲区内的原始记录：day, stack, callback, name, kind, wall(秒), rows, hit(1命中/0未命中/-1非缓存)"""
+        n = min(self._n, self.capacity)
+        records = [self._buf[i & self._mask] for i in range(self._n - n, self._n)]
+        df = pd.DataFrame(records, columns=['day', 'site', 'kind', 'wall', 'rows', 'hit'])
+        names = np.array(self._site_names + [''], dtype=object)
+        df.insert(1, 'stack', names[df.pop('site').values.astype(np.int64)])
+        df.insert(2, 'callback', df['stack'].str.split(';', n=1).str[0])
+        df.insert(3, 'name', df['stack'].str.rsplit(';', n=1).str[-1])
+        df['kind'] = np.array(KINDS, dtype=object)[df['kind'].values.astype(np.int64)]
+        return df
+
+    def table(self, per_day=False):
+        """
+        扁平汇总表
+
+        参数:
+            per_day: True 时按 (交易日, 调用栈) 汇总，否则按调用栈汇总
+        返回:
+            DataFrame: [day,] callback, stack, name, kind, calls, wall, max_wall, rows, hits, misses
+        """
+        df = self.events()
+        df['hits'] = df['hit'] == 1
+        df['misses'] = df['hit'] == 0
+        keys = (['day'] if per_day else []) + ['callback', 'stack', 'name', 'kind']
+        return df.groupby(keys, sort=True).agg(
+            calls=('wall', 'size'), wall=('wall', 'sum'), max_wall=('wall', 'max'),
+            rows=('rows', 'sum'), hits=('hits', 'sum'), misses=('misses', 'sum'),
+        ).reset_index()
+
+    def collapsed(self, path=None):
+        """
+        折叠栈格式（每行 'a;b;c 自身耗时微秒'），可直接输入 flamegraph.pl / speedscope
+
+        参数:
+            path: 给定时写入文件
+        返回:
+            折叠栈文本
+        """
+        total = self.events().groupby('stack')['wall'].sum()
+        parents = pd.Series([s.rsplit(';', 1)[0] if ';' in s else '' for s in total.index], index=total.index)
+        children = total.groupby(parents.values).sum()
+        own = (total - children.reindex(total.index).fillna(0.0)).clip(lower=0.0)
+        text = ''.join(f"{stack} {int(round(us))}\n" for stack, us in (own * 1e6).items() if us >= 0.5)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+        return text
@@ -0,0 +1,495 @@
+# 四大搅屎棍策略 (02_four_stirrers_ptrade.py) 的全历史向量化研究模式
+#
+# 不经过回调逐日回放 prepare_stock_list -> weekly_adjustment -> check_limit_up，
+# 而是在 (交易日, 股票) 矩阵上一次算出选股各环节的结果：
+#   1. 申万一级行业市场宽度 (收盘价站上 breadth_window 日均线的比例) 与宽度最高的行业；
+#   2. 市场环境 '存量' 标记 (沪深成交额均线变化率、中证银行指数涨幅)；
+#   3. ST / 次新 / 停牌 / 涨停 / 跌停掩码；
+#   4. 中证1000 (399101) 中 ROE、ROA 达标股票的市值排名；
+# 再在每周首个交易日得到目标持仓，输出 (交易日, 股票) 的目标权重矩阵，由 simulate 做快速组合模拟。
+#
+# 与策略一致的约定：宽度与市场环境使用截至前一交易日的数据，指数成分与财务数据取当日可见的最新值，
+# 次新股按前一交易日计算上市天数，停牌按当日成交量、涨跌停按 9:30 的价格 (开盘价) 判断。
+# 与策略的差别：涨跌停过滤对全部候选生效 (策略中已持仓的股票不过滤)；目标持仓等权，
+# 不模拟"昨日涨停的持仓继续持有"和盘中开板卖出。
+# 市场宽度与策略的 MarketBreadth 逐日相同：收盘价与均线几乎相等时同样按 pandas 的算法重算均线再比较。
+#
+# 使用示例：
+#   data = LocalData.load('./data')
+#   result = research(data, start='2015-01-05', end='2026-01-07', params={'stock_num': 8})
+#   result.targets()                                   # {调仓日: 目标股票列表}
+#   summary = simulate(data, result.weights).summary()
+#
+#   python strategies/research_four_stirrers.py --data ./data --start 2015-01-05 --out ./research
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from ptrade_local import BacktestResult, LocalData
+
+
+# 策略参数及默认值 (与 initialize 中的 g 同名)
+DEFAULT_PARAMS = {
+    'stock_num': 8,
+    'breadth_window': 20,
+    'env_ma_window': 20,
+    'env_slope_window': 5,
+    'turnover_cut': 0.1,
+    'bank_cut': 0.9,
+    'roe_min': 15,
+    'roa_min': 10,
+}
+
+# 行业编号顺序与策略的 get_industry_index 一致：市场宽度行业在前，其余申万一级行业补充
+INDUSTRY_CODES = ['801010', '801020', '801030', '801040', '801050', '801080', '801110', '801120', '801130',
+                  '801140', '801150', '801160', '801170', '801180', '801200', '801210', '801230', '801710',
+                  '801720', '801730', '801740', '801750', '801760', '801770', '801780', '801790', '801880',
+                  '801890', '801060', '801070', '801090', '801100', '801190', '801220', '801950', '801960',
+                  '801970', '801980']
+STIRRERS = ['801780', '801050', '801950', '801040']     # 银行、有色、煤炭、钢铁
+BREADTH_INDEX = '000985.XBHS'
+SMALL_CAP_INDEX = '399101.XBHS'
+ENV_INDEXES = ['000001.SS', '399001.SZ', '399986.SZ']   # 上证、深证成交额，中证银行收盘价
+
+
+def _day(value):
+    return np.datetime64(pd.Timestamp(str(value)).date(), 'D')
+
+
+def _bars(data, field, cols):
+    """取 (交易日, 股票) 行情矩阵，不在行情数据中的股票 (cols 为-1) 为NaN"""
+    values = data.bars[field][:, np.maximum(cols, 0)].astype(np.float64)
+    values[:, cols < 0] = np.nan
+    return values
+
+
+def member_matrix(data, index_code, col):
+    """
+    指数成分掩码
+
+    参数:
+        col: {股票: 列号}
+    返回:
+        (成分掩码 (交易日, 股票), 当日是否有成分数据 (交易日,))；
+        第 t 行为 dates[t] 当日可见的最近一期快照，同 get_index_stocks(index_code, 当日)
+    """
+    member = np.zeros((len(data.dates), len(col)), dtype=bool)
+    available = np.zeros(len(data.dates), dtype=bool)
+    if index_code not in data.index_members:
+        return member, available
+    days, snapshots = data.index_members[index_code]
+    snap = np.searchsorted(days, data.dates, side='right') - 1
+    for k, members in enumerate(snapshots):
+        rows = np.flatnonzero(snap == k)
+        if len(rows) and members:
+            member[np.ix_(rows, [col[c] for c in members])] = True
+            available[rows] = True
+    return member, available
+
+
+def ashare_matrix(data, stocks):
+    """全部A股掩码 (交易日, 股票)：已上市、未退市且有行情数据，同 get_Ashares(当日)"""
+    info = data.stocks.reindex(stocks)
+    listed = pd.to_datetime(info['listed_date'].astype(str), errors='coerce').values.astype('datetime64[D]')
+    ok = np.isin(stocks, list(data.stock_info)) & np.isin(stocks, data.codes)
+    member = ok[None, :] & ~(listed[None, :] > data.dates[:, None])
+    if 'de_listed_date' in info.columns:
+        delisted = pd.to_datetime(info['de_listed_date'].astype(str), errors='coerce').values.astype('datetime64[D]')
+        member &= ~(delisted[None, :] <= data.dates[:, None])
+    return member
+
+
+def industry_ids(data, stocks):
+    """股票的行业编号 (INDUSTRY_CODES 中的下标)，按行业顺序取首个归属，未知为-1"""
+    ids = np.full(len(stocks), -1, dtype=np.int64)
+    position = {code: j for j, code in enumerate(stocks)}
+    for k in range(len(INDUSTRY_CODES) - 1, -1, -1):
+        cols = [position[c] for c in data.industries.get(INDUSTRY_CODES[k], []) if c in position]
+        ids[cols] = k
+    return ids
+
+
+# 收盘价与均线相差在此相对误差以内时按 pandas 的算法重算均线 (同 MarketBreadth.tolerance)
+BREADTH_TOLERANCE = 1e-9
+
+
+def _rolling_last_mean(block, window):
+    """
+    按 pandas rolling(window).mean() 的运算顺序求 (window + 1, n) 收盘价块最后一个窗口的均值，
+    结果与 pandas 逐位相同 (同 02_four_stirrers_ptrade._rolling_last_mean)；block 按时间顺序且不含缺失
+    """
+    total = np.zeros(block.shape[1])
+    comp = np.zeros(block.shape[1])
+    run = np.zeros(block.shape[1], dtype=np.int64)
+    for k, x in enumerate(block):
+        if k >= window:
+            total = total - block[k - window]
+        y = x - comp
+        t = total + y
+        comp = t - total - y
+        total = t
+        run = np.where(x == block[k - 1], run + 1, 1) if k else run + 1
+    return np.where(run >= window, block[-1], total / window)
+
+
+def breadth_panel(close, universe, industry, window=20):
+    """
+    逐日行业宽度
+
+    参数:
+        close: (交易日, 股票) 收盘价
+        universe: (交易日, 股票) 当日的宽度股票池 (000985 成分)
+        industry: 股票的行业编号，未知为-1
+    返回:
+        (交易日, 行业) 矩阵，各行业站上均线的股票比例 (0-100，四舍五入)；
+        第 t 行为 t-1 日的宽度 (均线取 t-1 日及之前 window 个交易日)，与策略在 t 日调仓时看到的
+        MarketBreadth 一致。t-1 日及之前 window + 1 个交易日内有缺失价格的股票不参与统计，
+        没有有效股票的行业为NaN
+    """
+    n_days, n_stocks = close.shape
+    ratios = np.full((n_days, len(INDUSTRY_CODES)), np.nan)
+    if n_days <= window + 1:
+        return ratios
+    # t 日的均线窗口为 [t - window, t - 1]，有效性看 [t - window - 1, t - 1]；
+    # 逐行累加窗口和，不用全历史前缀和 (长期累计的浮点误差会超出 BREADTH_TOLERANCE)
+    n_rows = n_days - window - 1
+    missing = np.isnan(close)
+    filled = np.where(missing, 0.0, close)
+    window_sum = filled[1:1 + n_rows].copy()
+    n_missing = missing[:n_rows].astype(np.int32) + missing[1:1 + n_rows]
+    for k in range(2, window + 1):
+        window_sum += filled[k:k + n_rows]
+        n_missing += missing[k:k + n_rows]
+    del filled
+    t = np.arange(window + 1, n_days)
+    valid = (n_missing == 0) & universe[t] & (industry >= 0)
+    last = close[t - 1]
+    mavg = window_sum / window
+    gap = last - mavg
+    margin = BREADTH_TOLERANCE * np.abs(mavg)
+    above = valid & (gap > margin)
+    near_row, near_col = np.nonzero(valid & (np.abs(gap) <= margin))
+    if len(near_row):
+        block = close[near_row[None, :] + np.arange(window + 1)[:, None], near_col[None, :]]
+        above[near_row, near_col] = last[near_row, near_col] > _rolling_last_mean(block, window)
+    onehot = np.zeros((n_stocks, len(INDUSTRY_CODES)))
+    known = np.flatnonzero(industry >= 0)
+    onehot[known, industry[known]] = 1.0
+    total = valid @ onehot
+    up = above @ onehot
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratios[t] = np.where(total > 0, np.round(up * 100.0 / total), np.nan)
+    return ratios
+
+
+def breadth_leader(ratios):
+    """每日宽度最高的行业代码 (宽度相同取代码较小的)，没有有效行业为None"""
+    codes = np.array(INDUSTRY_CODES, dtype=object)
+    order = np.argsort(INDUSTRY_CODES, kind='stable')
+    filled = np.where(np.isnan(ratios), -np.inf, ratios)[:, order]
+    best = order[np.argmax(filled, axis=1)]
+    return np.where(np.isnan(ratios).all(axis=1), None, codes[best])
+
+
+def market_regime(data, ma_window=20, slope_window=5, turnover_cut=0.1, bank_cut=0.9):
+    """
+    逐日市场环境 '存量' 标记 (同 MarketEnvClassifier)
+
+    返回:
+        (交易日,) 布尔数组，第 t 个元素为 t-1 日 (含) 之前最近一个有效交易日的判断；缺少指数数据时为False
+    """
+    cols = [data.code_index.get(code, -1) for code in ENV_INDEXES]
+    regime = np.zeros(len(data.dates), dtype=bool)
+    if min(cols) < 0:
+        return regime
+    money = data.bars['money'][:, cols[0]] + data.bars['money'][:, cols[1]]
+    bank = np.asarray(data.bars['close'][:, cols[2]], dtype=np.float64)
+    rows = np.flatnonzero(~np.isnan(money) & ~np.isnan(bank))
+    if len(rows) == 0:
+        return regime
+
+    w, s = ma_window, slope_window
+    csum = np.r_[0.0, np.cumsum(money[rows])]
+    bank = bank[rows]
+    i = np.arange(len(rows))
+    prev = i - s
+    start = i - w + 1
+    ready = (prev >= w - 1) & (start >= 0)
+    ma_now = (csum[i + 1] - csum[np.maximum(i + 1 - w, 0)]) / w
+    ma_prev = (csum[np.maximum(prev + 1, 0)] - csum[np.maximum(prev + 1 - w, 0)]) / w
+    with np.errstate(invalid='ignore', divide='ignore'):
+        change = (ma_now - ma_prev) / np.where(ready, ma_prev, 1.0)
+        flag = ready & ((change <= turnover_cut) | (bank / bank[np.maximum(start, 0)] <= bank_cut))
+
+    k = np.searchsorted(rows, np.arange(len(data.dates)) - 1, side='right') - 1
+    regime[k >= 0] = flag[k[k >= 0]]
+    return regime
+
+
+def filter_masks(data, stocks, cols):
+    """
+    过滤掩码 (同 filter_stock_batch)
+
+    返回:
+        {'st', 'new', 'paused', 'limit_up', 'limit_down': (交易日, 股票) 布尔矩阵}
+        ST 含 ST 区间内及名称含 ST、*、退 的股票；次新为上市不满375天 (按前一交易日计算，上市日期未知的不算)
+    """
+    dates = data.dates
+    st = np.zeros((len(dates), len(stocks)), dtype=bool)
+    for j, code in enumerate(stocks):
+        for start, end in data.st_periods.get(code, ()):
+            st[np.searchsorted(dates, start):np.searchsorted(dates, end, side='right'), j] = True
+        name = (data.stock_info.get(code) or {}).get('name')
+        if isinstance(name, str) and ('ST' in name or '*' in name or '退' in name):
+            st[:, j] = True
+
+    info = data.stocks.reindex(stocks)
+    listed = pd.to_datetime(info['listed_date'].astype(str), errors='coerce').values.astype('datetime64[D]')
+    yesterday = np.r_[dates[:1], dates[:-1]]
+    new = ~np.isnat(listed)[None, :] & ((yesterday[:, None] - listed[None, :]).astype(np.int64) < 375)
+
+    with np.errstate(invalid='ignore'):
+        paused = ~(_bars(data, 'volume', cols) > 0)
+        last = _bars(data, 'open', cols)
+        valid = last > 0
+        high_limit = _bars(data, 'high_limit', cols)
+        limit_up = valid & (high_limit > 0) & (last >= high_limit * 0.999)
+        del high_limit
+        low_limit = _bars(data, 'low_limit', cols)
+        limit_down = valid & (low_limit > 0) & (last <= low_limit * 1.001)
+    return {'st': st, 'new': new, 'paused': paused, 'limit_up': limit_up, 'limit_down': limit_down}
+
+
+def value_rank(values, eligible):
+    """
+    逐日市值排名：eligible 内按 values 从小到大排名 (1 起)，市值缺失的排在最后，其余为NaN
+
+    返回:
+        float32 (交易日, 股票) 排名矩阵
+    """
+    key = np.where(eligible, np.where(np.isnan(values), np.inf, values), np.nan)
+    order = np.argsort(key, axis=1, kind='stable')
+    rank = np.empty(key.shape, dtype=np.float32)
+    np.put_along_axis(rank, order, np.arange(1, key.shape[1] + 1, dtype=np.float32)[None, :], axis=1)
+    rank[~eligible] = np.nan
+    return rank
+
+
+def rebalance_days(dates):
+    """每周 (周一为一周开始) 首个交易日的掩码，同 TradingCalendar.first_of_week"""
+    week = (dates.astype(np.int64) + 3) // 7
+    return np.r_[True, week[1:] != week[:-1]]
+
+
+class ResearchResult:
+    """
+    研究模式结果
+
+    属性 (index 均为交易日)：
+        breadth: 行业宽度 DataFrame (columns=行业代码)
+        leader / regime / stirred: 宽度最高行业、'存量' 标记、搅屎棍空仓标记 Series
+        masks: {'st', 'new', 'paused', 'limit_up', 'limit_down'} 布尔 DataFrame (columns=股票)
+        eligible: 小市值候选 (中证1000、非科创北交创业板、非ST次新、ROE/ROA达标) 布尔 DataFrame
+        rank: 候选的市值排名 DataFrame
+        rebalance: 调仓日标记 Series
+        weights: 目标权重 DataFrame，调仓日确定、持有到下一个调仓日
+    """
+
+    def __init__(self, breadth, leader, regime, stirred, masks, eligible, rank, rebalance, weights):
+        self.breadth = breadth
+        self.leader = leader
+        self.regime = regime
+        self.stirred = stirred
+        self.masks = masks
+        self.eligible = eligible
+        self.rank = rank
+        self.rebalance = rebalance
+        self.weights = weights
+
+    def targets(self):
+        """{调仓日: 目标股票列表 (按市值从小到大)}"""
+        out = {}
+        stocks = self.weights.columns.values
+        for date in self.rebalance.index[self.rebalance.values]:
+            row = self.weights.index.get_loc(date)
+            picked = np.flatnonzero(self.weights.values[row] > 0)
+            out[date] = stocks[picked[np.argsort(self.rank.values[row, picked], kind='stable')]].tolist()
+        return out
+
+
+def research(data, start=None, end=None, params=None):
+    """
+    一次向量化计算全历史的选股结果与目标权重
+
+    参数:
+        data: LocalData
+        start / end: 输出区间 (宽度与市场环境仍使用区间之前的数据)
+        params: 覆盖 DEFAULT_PARAMS 的参数字典
+    返回:
+        ResearchResult
+    """
+    p = {**DEFAULT_PARAMS, **(params or {})}
+    dates = data.dates
+    lo = 0 if start is None else int(np.searchsorted(dates, _day(start)))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, _day(end), side='right'))
+
+    # 股票列：两个指数出现过的全部成分股；中证1000缺少成分数据时补充全部A股
+    stocks = set()
+    for index_code in (BREADTH_INDEX, SMALL_CAP_INDEX):
+        for members in data.index_members.get(index_code, (None, []))[1]:
+            stocks.update(members)
+    col = {code: j for j, code in enumerate(sorted(stocks))}
+    universe, has_universe = member_matrix(data, BREADTH_INDEX, col)
+    pool, has_pool = member_matrix(data, SMALL_CAP_INDEX, col)
+    if not has_pool[lo:hi].all():
+        extra = sorted(set(data.stock_info) - set(col))
+        col.update({code: len(col) + k for k, code in enumerate(extra)})
+        universe = np.hstack([universe, np.zeros((len(dates), len(extra)), dtype=bool)])
+        pool = np.hstack([pool, np.zeros((len(dates), len(extra)), dtype=bool)])
+        pool[~has_pool] = ashare_matrix(data, list(col))[~has_pool]
+    stocks = list(col)
+    cols = np.array([data.code_index.get(code, -1) for code in stocks], dtype=np.int64)
+
+    # 1. 行业宽度、领涨行业与市场环境
+    ratios = breadth_panel(_bars(data, 'close', cols), universe, industry_ids(data, stocks), p['breadth_window'])
+    leader = breadth_leader(ratios)
+    regime = market_regime(data, p['env_ma_window'], p['env_slope_window'], p['turnover_cut'], p['bank_cut'])
+    stirred = np.isin(leader, STIRRERS) & regime
+    del universe
+
+    # 2. 小市值候选与市值排名
+    masks = filter_masks(data, stocks, cols)
+    board = np.array([code.split('.')[0].startswith(('4', '8', '68', '3')) for code in stocks])
+    eligible = pool & ~board[None, :] & ~masks['st'] & ~masks['new']
+    days = dates[lo:hi]
+    eligible = eligible[lo:hi]
+    if 'profit_ability' in data.fundamentals:
+        table = data.fundamentals['profit_ability']
+        with np.errstate(invalid='ignore'):
+            eligible &= table.panel(stocks, days, 'roe') > p['roe_min']
+            eligible &= table.panel(stocks, days, 'roa') > p['roa_min']
+    if 'valuation' in data.fundamentals:
+        values = data.fundamentals['valuation'].panel(stocks, days, 'total_value')
+    else:
+        values = np.zeros(eligible.shape)
+    rank = value_rank(values, eligible)
+    del values
+
+    # 3. 调仓日的目标持仓：前 stock_num 只中去掉停牌、涨跌停；
+    #    搅屎棍触发、缺少股票池数据或没有历史行情 (首个交易日) 时空仓
+    rebalance = rebalance_days(dates)[lo:hi]
+    picked = (rank <= p['stock_num']) & ~masks['paused'][lo:hi] & ~masks['limit_up'][lo:hi] & ~masks['limit_down'][lo:hi]
+    active = ~stirred & has_universe & (np.arange(len(dates)) > 0)
+    picked &= active[lo:hi, None]
+    count = picked.sum(axis=1, keepdims=True)
+    target = np.where(picked, 1.0 / np.maximum(count, 1), 0.0)
+    # 非调仓日沿用最近一个调仓日的权重，区间内首个调仓日之前空仓
+    last = np.maximum.accumulate(np.where(rebalance, np.arange(len(days)), -1))
+    weights = np.where((last >= 0)[:, None], target[np.maximum(last, 0)], 0.0)
+
+    index = pd.DatetimeIndex(days)
+    frame = lambda values: pd.DataFrame(values, index=index, columns=stocks)
+    return ResearchResult(
+        breadth=pd.DataFrame(ratios[lo:hi], index=index, columns=INDUSTRY_CODES),
+        leader=pd.Series(leader[lo:hi], index=index, name='leader'),
+        regime=pd.Series(regime[lo:hi], index=index, name='regime'),
+        stirred=pd.Series(stirred[lo:hi], index=index, name='stirred'),
+        masks={name: frame(mask[lo:hi]) for name, mask in masks.items()},
+        eligible=frame(eligible),
+        rank=frame(rank),
+        rebalance=pd.Series(rebalance, index=index, name='rebalance'),
+        weights=frame(weights),
+    )
+
+
+def simulate(data, weights, capital=100000.0, commission_ratio=0.0003, min_commission=5.0, tax=0.001):
+    """
+    按目标权重矩阵做快速组合模拟
+
+    权重变化的交易日按开盘价调整到目标权重 (与策略 9:30 调仓一致)，其余交易日持仓随价格浮动；
+    停牌股票的价格沿用最近收盘价。佣金 = max(成交额 * commission_ratio, min_commission)，卖出另收印花税
+
+    参数:
+        weights: 目标权重 DataFrame (index=交易日, columns=股票)，如 ResearchResult.weights
+    返回:
+        BacktestResult (trades 为每笔调仓：datetime, code, value, commission, tax)
+    """
+    held = weights.columns[(weights.values > 0).any(axis=0)]
+    w = weights[held].values
+    rows = np.searchsorted(data.dates, weights.index.values.astype('datetime64[D]'))
+    cols = np.array([data.code_index.get(code, -1) for code in held], dtype=np.int64)
+    close = pd.DataFrame(_bars(data, 'close', cols)).ffill().values
+    prev = np.vstack([np.full((1, len(cols)), np.nan), close[:-1]])
+    open_ = _bars(data, 'open', cols)
+    open_ = np.where(np.isnan(open_), prev, open_)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gap = np.nan_to_num(open_ / prev, nan=1.0, posinf=1.0)[rows]
+        intraday = np.nan_to_num(close / open_, nan=1.0, posinf=1.0)[rows]
+
+    value = np.zeros(len(held))
+    cash = float(capital)
+    equity = np.empty(len(rows))
+    turnover = np.zeros(len(rows))
+    trades = []
+    for t in range(len(rows)):
+        value *= gap[t]
+        if t == 0 or (w[t] != w[t - 1]).any():
+            total = value.sum() + cash
+            delta = w[t] * total - value
+            traded = np.flatnonzero(np.abs(delta) > 1e-9 * total)
+            commission = np.maximum(np.abs(delta[traded]) * commission_ratio, min_commission)
+            stamp = np.where(delta[traded] < 0, -delta[traded] * tax, 0.0)
+            value = w[t] * total
+            cash = total - value.sum() - commission.sum() - stamp.sum()
+            turnover[t] = np.abs(delta).sum() / total if total else 0.0
+            trades.extend((weights.index[t], held[j], delta[j], c, s) for j, c, s in zip(traded, commission, stamp))
+        value *= intraday[t]
+        equity[t] = value.sum() + cash
+
+    index = weights.index
+    trades = pd.DataFrame(trades, columns=['datetime', 'code', 'value', 'commission', 'tax'])
+    return BacktestResult(pd.Series(equity, index=index), pd.Series(turnover, index=index), trades)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='四大搅屎棍策略全历史向量化研究')
+    parser.add_argument('--data', required=True, help='数据目录 (格式见 ptrade_local.py)')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--capital', type=float, default=100000.0)
+    parser.add_argument('--params', nargs='*', default=[], help='覆盖策略参数，如 stock_num=10 roe_min=12')
+    parser.add_argument('--out', default=None, help='结果目录，写出 daily.csv / targets.csv')
+    args = parser.parse_args()
+
+    params = {}
+    for item in args.params:
+        name, _, text = item.partition('=')
+        params[name.strip()] = float(text) if '.' in text else int(text)
+
+    started = time.time()
+    data = LocalData.load(args.data)
+    loaded = time.time()
+    result = research(data, args.start, args.end, params)
+    computed = time.time()
+    backtest = simulate(data, result.weights, args.capital)
+    print(f"{len(result.weights)} 个交易日, {result.weights.shape[1]} 只股票, 加载 {loaded - started:.1f} 秒, "
+          f"选股 {computed - loaded:.1f} 秒, 模拟 {time.time() - computed:.1f} 秒")
+    print(f"调仓 {int(result.rebalance.sum())} 次, 搅屎棍空仓 {int((result.stirred & result.rebalance).sum())} 次")
+    print({k: round(v, 4) for k, v in backtest.summary().items()})
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        daily = pd.DataFrame({'leader': result.leader, 'regime': result.regime, 'stirred': result.stirred,
+                              'rebalance': result.rebalance, 'holdings': (result.weights > 0).sum(axis=1),
+                              'equity': backtest.equity})
+        daily.to_csv(os.path.join(args.out, 'daily.csv'), index_label='date')
+        targets = [(date, code, rank + 1) for date, codes in result.targets().items() for rank, code in enumerate(codes)]
+        pd.DataFrame(targets, columns=['date', 'code', 'rank']).to_csv(os.path.join(args.out, 'targets.csv'), index=False)
+
+
+if __name__ == '__main__':
+    main()
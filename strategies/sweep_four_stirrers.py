@@ -0,0 +1,147 @@
+# 四大搅屎棍策略参数扫描 (本地多进程)
+#
+# 用 ptrade_local.py 的本地运行时，在进程池中并行回测 02_four_stirrers_ptrade.py 的多组参数
+# （g.stock_num、g.num、g.breadth_window、g.env_ma_window、g.env_slope_window、
+#  g.turnover_cut、g.bank_cut、g.roe_min、g.roa_min，见策略 initialize）。
+#
+# 行情只加载一次：数据目录没有 bars/ 时先在临时目录转换为列式内存映射存储 (bar_store.py)，
+# 各工作进程以只读 memmap 打开同一组文件，由操作系统页缓存共享同一份物理内存，
+# 行情不经过 pickle 传给子进程，任务只传递一个小的参数字典。
+# 每组参数回测完成即把汇总指标追加到结果表 results.csv，逐日权益/回撤/换手追加到 curves.csv。
+#
+# 使用示例：
+#   python strategies/sweep_four_stirrers.py --data ./data --start 2018-01-02 --end 2025-12-31 \
+#       --grid stock_num=5,8,10 num=1,2 breadth_window=20,30 turnover_cut=0.05,0.1 --out ./sweep
+
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import Pool
+
+import pandas as pd
+
+from bar_store import BarStore
+from ptrade_local import LocalData, PTradeRuntime
+
+
+STRATEGY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '02_four_stirrers_ptrade.py')
+
+# 工作进程内常驻的数据与回测设置（由 _init_worker 设置）
+_worker = {}
+
+
+def parse_grid(items):
+    """把 ['stock_num=5,8', 'bank_cut=0.9'] 解析为 {'stock_num': [5, 8], 'bank_cut': [0.9]}"""
+    def value(text):
+        for cast in (int, float):
+            try:
+                return cast(text)
+            except ValueError:
+                pass
+        return text
+
+    grid = {}
+    for item in items:
+        name, _, values = item.partition('=')
+        grid[name.strip()] = [value(v.strip()) for v in values.split(',') if v.strip()]
+    return grid
+
+
+def expand_grid(grid):
+    """参数网格的笛卡尔积，返回参数字典列表"""
+    names = list(grid)
+    return [dict(zip(names, combo)) for combo in itertools.product(*(grid[n] for n in names))]
+
+
+def _init_worker(data_path, bars_path, strategy_path, start, end, capital):
+    _worker['data'] = LocalData.load(data_path, bars=bars_path)
+    _worker['settings'] = (strategy_path, start, end, capital)
+
+
+def _run_config(item):
+    run_id, params = item
+    strategy_path, start, end, capital = _worker['settings']
+    started = time.time()
+    result = PTradeRuntime(strategy_path, _worker['data'], capital=capital, params=params).run(start, end)
+    curves = pd.DataFrame({
+        'run': run_id,
+        'date': result.equity.index,
+        'equity': result.equity.values,
+        'drawdown': result.drawdown.values,
+        'turnover': result.turnover.reindex(result.equity.index).fillna(0.0).values,
+    })
+    row = {'run': run_id, **params, **result.summary(), 'seconds': time.time() - started}
+    return row, curves
+
+
+def _append_csv(frame, path):
+    frame.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+
+
+def sweep(data_path, configs, start=None, end=None, capital=100000.0, processes=None, out_dir=None,
+          strategy_path=STRATEGY):
+    """
+    并行回测多组参数
+
+    参数:
+        data_path: 数据目录（格式见 ptrade_local.py）
+        configs: 参数字典列表（覆盖到 g 上）
+        processes: 进程数，默认为CPU核数
+        out_dir: 结果目录，给定时逐组追加 results.csv / curves.csv
+    返回:
+        结果表 DataFrame（每组参数一行：参数、收益、回撤、换手等），按 run 排序
+    """
+    tmp_dir = None
+    bars_path = os.path.join(data_path, 'bars')
+    if not os.path.exists(os.path.join(bars_path, 'meta.json')):
+        # 先转换一次列式存储，子进程以 memmap 共享
+        tmp_dir = tempfile.mkdtemp(prefix='sweep_bars_')
+        bars_path = os.path.join(tmp_dir, 'bars')
+        BarStore.from_daily_frame(bars_path, pd.read_csv(os.path.join(data_path, 'daily.csv'), dtype={'code': str}))
+
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        for name in ('results.csv', 'curves.csv'):
+            if os.path.exists(os.path.join(out_dir, name)):
+                os.remove(os.path.join(out_dir, name))
+
+    rows = []
+    try:
+        init = (data_path, bars_path, strategy_path, start, end, capital)
+        with Pool(processes, initializer=_init_worker, initargs=init) as pool:
+            for row, curves in pool.imap_unordered(_run_config, list(enumerate(configs))):
+                rows.append(row)
+                if out_dir:
+                    _append_csv(pd.DataFrame([row]), os.path.join(out_dir, 'results.csv'))
+                    _append_csv(curves, os.path.join(out_dir, 'curves.csv'))
+                print(f"[{len(rows)}/{len(configs)}] run {row['run']}: 年化 {row['annual_return']:.2%}, "
+                      f"最大回撤 {row['max_drawdown']:.2%}, 用时 {row['seconds']:.1f}s")
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return pd.DataFrame(rows).sort_values('run').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='四大搅屎棍策略本地参数扫描')
+    parser.add_argument('--data', required=True, help='数据目录')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--capital', type=float, default=100000.0)
+    parser.add_argument('--grid', nargs='+', default=['stock_num=8'], help='参数网格，如 stock_num=5,8,10 num=1,2')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--out', default='./sweep', help='结果目录')
+    args = parser.parse_args()
+
+    configs = expand_grid(parse_grid(args.grid))
+    started = time.time()
+    table = sweep(args.data, configs, args.start, args.end, args.capital, args.processes, args.out)
+    print(f"{len(configs)} 组参数完成，用时 {time.time() - started:.1f} 秒")
+    print(table.sort_values('annual_return', ascending=False).head(10).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
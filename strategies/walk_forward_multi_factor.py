@@ -0,0 +1,276 @@
+# 多因子策略 (03_multi_factor.py) 的滚动前推 (walk-forward) 参数优化
+#
+# 在预先算好的因子排名张量 (交易日, 股票, 因子) 与各调仓周期的远期收益矩阵上，
+# 对每个滚动训练窗口搜索因子权重、调仓频率 tc 与持仓数 N，再在紧随其后的样本外窗口评估。
+#
+# 所有候选一起批量计算，不逐个回测：
+#   1. 每个调仓日把全部候选权重一次矩阵乘得到 (股票, 候选) 得分，按列只排序一次；
+#   2. 按排序取出远期收益做累加，第 N-1 行除以 N 即为持仓数 N 的组合收益，所有 N 一次得到；
+#   3. 调仓日固定在 t % tc == 0 (与策略中 g.t % g.tc 一致)，各周期收益按调仓日序号做前缀和，
+#      任一训练窗口的得分都是两个前缀和之差。
+# 训练窗口只使用在窗口结束前已经实现的收益，不引入未来数据。
+#
+# 因子排名与策略一致：缺失值用截面均值填充，因子值最大的排名为1；得分 = 排名 · 权重，
+# 取得分最高的 N 只。权重为正表示因子值越小越好 (同 g.weights)。
+#
+# 使用示例：
+#   python strategies/walk_forward_multi_factor.py --data ./data --factors total_value,roe,pe_ttm,pb \
+#       --tc 5,10,15,20 --n 10,20,30 --train-months 36 --candidates 2000 --out ./wf.csv
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ptrade_local import LocalData
+
+
+MONTH = 21    # 每月交易日数
+
+
+def rank_panel(values, valid):
+    """
+    逐日截面排名：缺失值用截面均值填充，因子值最大的排名为1，股票池外的股票排名为NaN
+
+    参数:
+        values: (交易日, 股票, 因子) 原始因子值
+        valid: (交易日, 股票) 是否在股票池内
+    返回:
+        float32 排名张量，与 values 同形
+    """
+    ranks = np.full(values.shape, np.nan, dtype=np.float32)
+    position = np.arange(1, values.shape[1] + 1, dtype=np.float32)[None, :]
+    for k in range(values.shape[2]):
+        x = np.where(valid, values[:, :, k], np.nan)
+        count = np.maximum((~np.isnan(x)).sum(axis=1, keepdims=True), 1)
+        mean = np.nansum(x, axis=1, keepdims=True) / count
+        # 股票池外的股票排在最后，再统一置为NaN
+        filled = np.where(valid, np.where(np.isnan(x), mean, x), -np.inf)
+        order = np.argsort(-filled, axis=1, kind='stable')
+        rank = np.empty(x.shape, dtype=np.float32)
+        np.put_along_axis(rank, order, position, axis=1)
+        ranks[:, :, k] = np.where(valid, rank, np.nan)
+    return ranks
+
+
+def forward_returns(close, horizons):
+    """各持有期的远期收益 {tc: (交易日, 股票)}，第 t 行为 close[t + tc] / close[t] - 1"""
+    out = {}
+    for tc in horizons:
+        fwd = np.full(close.shape, np.nan, dtype=np.float32)
+        fwd[:-tc] = close[tc:] / close[:-tc] - 1
+        out[tc] = fwd
+    return out
+
+
+def build_panel(data, factors, index_code='000300.SS', start=None, end=None):
+    """
+    由 LocalData 构建因子值张量与收盘价矩阵
+
+    参数:
+        factors: 财务字段名列表 (如 total_value)，也可写作 '表名.字段'
+        index_code: 股票池指数，逐日取成分股
+    返回:
+        (交易日, 股票列表, 因子值 (交易日, 股票, 因子), 股票池掩码 (交易日, 股票), 收盘价 (交易日, 股票))
+    """
+    dates = data.dates
+    lo = 0 if start is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(start).date(), 'D')))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(end).date(), 'D'), 'right'))
+    dates = dates[lo:hi]
+
+    snapshot_days, snapshots = data.index_members.get(index_code, (np.array([], dtype='datetime64[D]'), []))
+    stocks = sorted({code for members in snapshots for code in members if code in data.code_index})
+    col = {code: j for j, code in enumerate(stocks)}
+    valid = np.zeros((len(dates), len(stocks)), dtype=bool)
+    snap = np.searchsorted(snapshot_days, dates, side='right') - 1
+    for k, members in enumerate(snapshots):
+        rows = snap == k
+        if rows.any():
+            valid[np.ix_(rows, [col[c] for c in members if c in col])] = True
+
+    close = data.bars['close'][lo:hi][:, [data.code_index[c] for c in stocks]].astype(np.float64)
+    valid &= ~np.isnan(close)
+
+    values = np.full((len(dates), len(stocks), len(factors)), np.nan)
+    for k, factor in enumerate(factors):
+        table, _, field = factor.rpartition('.')
+        tables = [data.fundamentals[table]] if table else [t for t in data.fundamentals.values() if field in t.fields]
+        if not tables:
+            raise KeyError(f'财务数据中没有因子 {factor}')
+        values[:, :, k] = tables[0].panel(stocks, dates, field)
+    return dates, stocks, values, valid, close
+
+
+def candidate_weights(n_factors, n_random=2000, seed=0, include=None):
+    """
+    候选因子权重 (候选, 因子)：每个因子单独取正负，加上随机稀疏权重；按 L1 归一化
+
+    参数:
+        include: 额外必须包含的权重 (如当前的 g.weights)
+    """
+    rng = np.random.default_rng(seed)
+    single = np.vstack([np.eye(n_factors), -np.eye(n_factors)])
+    magnitude = rng.dirichlet(np.ones(n_factors), n_random)
+    magnitude *= rng.random((n_random, n_factors)) < rng.uniform(0.2, 1.0, (n_random, 1))
+    weights = magnitude * rng.choice([-1.0, 1.0], (n_random, n_factors))
+    parts = [single, weights]
+    if include is not None:
+        parts.append(np.asarray(include, dtype=np.float64).reshape(-1, n_factors))
+    weights = np.vstack(parts)
+    norm = np.abs(weights).sum(axis=1)
+    weights = weights[norm > 0] / norm[norm > 0, None]
+    return np.unique(np.round(weights, 6), axis=0)
+
+
+def period_log_returns(ranks, fwd, weights, tcs, ns, cost=0.0):
+    """
+    全部候选在每个调仓日的组合对数收益
+
+    参数:
+        ranks: (交易日, 股票, 因子) 排名张量
+        fwd: {tc: (交易日, 股票)} 远期收益
+        weights: (候选, 因子) 候选权重
+        tcs: 调仓周期列表；调仓日为 t % tc == 0
+        ns: 持仓数列表
+        cost: 每次调仓扣除的交易成本 (按收益率)
+    返回:
+        {tc: (调仓日下标, float32 数组 (调仓日, 候选, len(ns)))}，远期收益不完整的调仓日不含在内
+    """
+    n_days, n_stocks, _ = ranks.shape
+    ns = np.asarray(ns)
+    w = np.asarray(weights, dtype=np.float32).T
+    rebalance_days = np.unique(np.concatenate([np.arange(0, n_days - tc, tc) for tc in tcs]))
+    out = {tc: [] for tc in tcs}
+    for t in rebalance_days:
+        r = ranks[t]
+        valid = ~np.isnan(r[:, 0])
+        n_valid = int(valid.sum())
+        if n_valid == 0:
+            for tc in tcs:
+                if t % tc == 0 and t < n_days - tc:
+                    out[tc].append(np.zeros((len(w.T), len(ns)), dtype=np.float32))
+            continue
+        scores = r[valid] @ w                                       # (股票, 候选)
+        order = np.argsort(-scores, axis=0, kind='stable')          # 每个候选只排序一次
+        take = np.minimum(ns, n_valid) - 1
+        for tc in tcs:
+            if t % tc or t >= n_days - tc:
+                continue
+            ret = np.nan_to_num(fwd[tc][t][valid])
+            csum = np.cumsum(ret[order], axis=0)                     # 第 k 行 = 前 k+1 只的收益之和
+            mean = csum[take].T / ns                                 # (候选, len(ns))
+            out[tc].append(np.log1p(np.maximum(mean - cost, -0.99)).astype(np.float32))
+    return {tc: (np.arange(0, n_days - tc, tc), np.array(out[tc])) for tc in tcs}
+
+
+def _prefix(x):
+    """沿第0轴的前缀和，首位补0"""
+    out = np.zeros((len(x) + 1,) + x.shape[1:], dtype=np.float64)
+    np.cumsum(x, axis=0, out=out[1:])
+    return out
+
+
+def walk_forward(ranks, fwd, dates, weights, tcs, ns, train_days=36 * MONTH, step_days=MONTH,
+                 objective='sharpe', cost=0.0):
+    """
+    滚动前推优化
+
+    参数:
+        ranks / fwd / dates: 排名张量、远期收益、交易日
+        weights: (候选, 因子) 候选权重
+        tcs / ns: 调仓周期与持仓数候选
+        train_days / step_days: 训练窗口与前推步长 (交易日)
+        objective: 'sharpe' (按期收益均值/标准差年化) 或 'return' (日均对数收益)
+    返回:
+        (每个窗口一行的结果表, 样本外逐期收益 Series)
+    """
+    stats = {}
+    for tc, (days, logret) in period_log_returns(ranks, fwd, weights, tcs, ns, cost).items():
+        stats[tc] = (days, _prefix(logret), _prefix(logret.astype(np.float64) ** 2), logret)
+
+    rows, oos = [], []
+    n_days = len(dates)
+    for train_start in range(0, n_days - train_days - step_days + 1, step_days):
+        test_start = train_start + train_days
+        test_end = min(test_start + step_days, n_days)
+        best = None
+        for tc, (days, csum, csq, _) in stats.items():
+            # 训练期：调仓日在窗口内，且持有期在样本外窗口开始前结束
+            lo = int(np.searchsorted(days, train_start))
+            hi = int(np.searchsorted(days, test_start - tc, side='right'))
+            n = hi - lo
+            if n < 2:
+                continue
+            total = csum[hi] - csum[lo]
+            if objective == 'return':
+                score = total / (n * tc)
+            else:
+                mean = total / n
+                std = np.sqrt(np.maximum((csq[hi] - csq[lo]) / n - mean ** 2, 1e-12))
+                score = mean / std * np.sqrt(244.0 / tc)
+            k, j = np.unravel_index(np.argmax(score), score.shape)
+            if best is None or score[k, j] > best[0]:
+                best = (float(score[k, j]), tc, int(k), int(j), float(total[k, j]) / (n * tc))
+        if best is None:
+            continue
+
+        score, tc, k, j, train_daily = best
+        days, _, _, logret = stats[tc]
+        # 样本外：调仓日在样本外窗口内的各期收益
+        lo = int(np.searchsorted(days, test_start))
+        hi = int(np.searchsorted(days, test_end))
+        test = logret[lo:hi, k, j].astype(np.float64)
+        for t, r in zip(days[lo:hi], test):
+            oos.append((pd.Timestamp(dates[t]), float(np.expm1(r))))
+        rows.append({
+            'train_start': pd.Timestamp(dates[train_start]), 'test_start': pd.Timestamp(dates[test_start]),
+            'test_end': pd.Timestamp(dates[test_end - 1]), 'tc': tc, 'N': int(ns[j]),
+            'weights': [[round(float(x), 4) + 0.0] for x in weights[k]], 'train_score': score,
+            'train_daily_logret': train_daily, 'test_return': float(np.expm1(test.sum())) if len(test) else 0.0,
+        })
+    returns = pd.Series(dict(oos), name='oos_return').sort_index()
+    return pd.DataFrame(rows), returns
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多因子策略滚动前推参数优化')
+    parser.add_argument('--data', required=True, help='数据目录 (格式见 ptrade_local.py)')
+    parser.add_argument('--factors', default='total_value,roe', help='因子字段，逗号分隔')
+    parser.add_argument('--index', default='000300.SS', help='股票池指数')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--tc', default='5,10,15,20', help='调仓周期候选 (交易日)')
+    parser.add_argument('--n', default='10,20,30', help='持仓数候选')
+    parser.add_argument('--train-months', type=int, default=36)
+    parser.add_argument('--step-months', type=int, default=1)
+    parser.add_argument('--candidates', type=int, default=2000, help='随机候选权重数')
+    parser.add_argument('--objective', default='sharpe', choices=['sharpe', 'return'])
+    parser.add_argument('--cost', type=float, default=0.003, help='每次调仓的交易成本')
+    parser.add_argument('--out', default=None, help='结果表 CSV 路径')
+    args = parser.parse_args()
+
+    started = time.time()
+    factors = args.factors.split(',')
+    tcs = [int(x) for x in args.tc.split(',')]
+    ns = [int(x) for x in args.n.split(',')]
+    dates, stocks, values, valid, close = build_panel(LocalData.load(args.data), factors, args.index, args.start, args.end)
+    ranks = rank_panel(values, valid)
+    fwd = forward_returns(close, tcs)
+    weights = candidate_weights(len(factors), args.candidates, include=[[1], [-1]] if len(factors) == 2 else None)
+    print(f"{len(dates)} 个交易日, {len(stocks)} 只股票, {len(factors)} 个因子, {len(weights)} 组候选权重, "
+          f"准备用时 {time.time() - started:.1f} 秒")
+
+    table, returns = walk_forward(ranks, fwd, dates, weights, tcs, ns, args.train_months * MONTH,
+                                  args.step_months * MONTH, args.objective, args.cost)
+    print(f"{len(table)} 个窗口完成，总用时 {time.time() - started:.1f} 秒")
+    if len(returns):
+        equity = (1 + returns).cumprod()
+        print(f"样本外累计收益 {equity.iloc[-1] - 1:.2%}，最大回撤 {(equity / equity.cummax() - 1).min():.2%}")
+    if args.out:
+        table.to_csv(args.out, index=False)
+    print(table.tail(10).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+# 测试公共配置：策略脚本位于 strategies/ 下且并非包，这里把目录加入 sys.path，
+# 测试中用 importlib.import_module('01_dual_moving_average') 之类的方式按文件名导入；
+# PTrade 脚本 (02/03) 依赖平台注入的全局变量，用 ptrade_script 夹具加载其中的函数与类
+import logging
+import os
+import sys
+import types
+
+import pytest
+
+STRATEGIES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'strategies')
+if STRATEGIES_DIR not in sys.path:
+    sys.path.insert(0, STRATEGIES_DIR)
+
+
+@pytest.fixture(scope='session')
+def ptrade_script():
+    """按文件名加载 PTrade 策略脚本 (不访问平台API)，返回其模块级命名空间；同一脚本只加载一次"""
+    loaded = {}
+
+    def load(filename):
+        if filename not in loaded:
+            path = os.path.join(STRATEGIES_DIR, filename)
+            namespace = {'__name__': 'ptrade_test', '__file__': path,
+                         'log': logging.getLogger('ptrade_test.' + filename), 'g': types.SimpleNamespace()}
+            with open(path, encoding='utf-8') as f:
+                exec(compile(f.read(), path, 'exec'), namespace)
+            loaded[filename] = namespace
+        return loaded[filename]
+    return load
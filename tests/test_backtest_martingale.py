@@ -0,0 +1,88 @@
+# backtest_martingale_v2 的回归测试
+#
+# fixtures/martingale_golden.json 保存了一段固定行情 (date/close) 和几组参数/区间下的指标与逐笔交易，
+# 数值来自提交 e10c9b2 的源码：该版本源码在提交时与仓库原有的编译版本 (.pyc) 做过逐项比对
+# (随机参数组的指标、交易明细、权益曲线均一致)，原编译文件此后已被重新编译覆盖。
+# 修改回测逻辑时这里应保持通过；确需改变结果时，重新生成夹具并在提交说明中写明原因。
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest_martingale_v2 import GridBook, MartingaleTrendBacktest, batch_backtest
+
+with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'martingale_golden.json'), encoding='utf-8') as f:
+    GOLDEN = json.load(f)
+CASES = GOLDEN['cases']
+
+
+@pytest.fixture(scope='module')
+def market():
+    return pd.DataFrame({'date': GOLDEN['date'], 'close': GOLDEN['close']})
+
+
+def _assert_metrics(actual, expected):
+    assert set(actual) == set(expected)
+    for name, value in expected.items():
+        assert np.isclose(actual[name], value, rtol=1e-10, atol=1e-6), name
+
+
+@pytest.mark.parametrize('case', CASES, ids=[str(k) for k in range(len(CASES))])
+def test_run_matches_golden(market, case):
+    result = MartingaleTrendBacktest(**case['params']).run(market, case['start_date'], case['end_date'])
+    trades = result.pop('trades')
+    equity_curve = result.pop('equity_curve')
+    _assert_metrics(result, case['metrics'])
+
+    assert len(trades) == len(case['trades'])
+    for trade, (date, action, price, amount, reason, profit) in zip(trades, case['trades']):
+        assert (trade.date, trade.action, trade.amount, trade.reason) == (date, action, amount, reason)
+        assert np.isclose(trade.price, price) and np.isclose(trade.profit, profit, rtol=1e-10, atol=1e-6)
+
+    assert equity_curve[-1]['equity'] == pytest.approx(case['metrics']['final_equity'], rel=1e-12)
+
+
+@pytest.mark.parametrize('case', CASES, ids=[str(k) for k in range(len(CASES))])
+def test_batch_matches_golden(market, case):
+    table = batch_backtest(market, [case['params']], case['start_date'], case['end_date'])
+    _assert_metrics({name: table.loc[0, name] for name in case['metrics']}, case['metrics'])
+
+
+def test_batch_runs_parameter_sets_independently(market):
+    # 同一区间的多组参数放进一次批量回测，结果与逐组回测一致
+    cases = [case for case in CASES if case['start_date'] is None and case['end_date'] is None]
+    table = batch_backtest(market, [case['params'] for case in cases])
+    for k, case in enumerate(cases):
+        _assert_metrics({name: table.loc[k, name] for name in case['metrics']}, case['metrics'])
+
+
+def test_grid_book_grows_when_full():
+    book = GridBook(2, 2)
+    rows = np.array([0, 1])
+    book.add(rows, 10.0, np.array([100, 200]), 1)
+    book.add(np.array([0]), 9.0, np.array([300]), 2)
+    book.add(np.array([0]), 8.0, np.array([400]), 3)
+    assert book.capacity == 4
+    assert book.amount[0].tolist() == [100, 300, 400, 0]
+    assert book.amount[1].tolist() == [200, 0, 0, 0]
+    assert book.price[0, 2] == 8.0 and book.day[0, 2] == 3
+
+
+def test_grid_book_cheapest_skips_same_day_and_empty_rows():
+    book = GridBook(3, 4)
+    book.add(np.array([0, 1]), 10.0, np.array([100, 100]), 1)
+    book.add(np.array([0]), 9.0, np.array([100]), 2)
+    book.add(np.array([0, 1]), 9.0, np.array([100, 100]), 3)
+    book.add(np.array([0]), 8.0, np.array([100]), 5)
+
+    rows, slots = book.cheapest(np.arange(3), 5)      # 第5天买入的不能当天卖出，同价取先买入的
+    assert rows.tolist() == [0, 1]
+    assert slots.tolist() == [1, 1]
+    rows, slots = book.cheapest(np.arange(3), 6)
+    assert slots.tolist() == [3, 1]
+
+    book.amount[0, 3] = 0                             # 卖出后槽位变空，下次买入复用
+    book.add(np.array([0]), 7.0, np.array([100]), 6)
+    assert book.price[0, 3] == 7.0 and book.capacity == 4
@@ -0,0 +1,97 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bar_store import BarStore
+
+SYMBOLS = ['000001.SZ', '600000.SS', '600519.SS']
+
+
+def _matrix(n_rows, n_cols, seed=0):
+    return np.random.default_rng(seed).random((n_rows, n_cols))
+
+
+def test_daily_round_trip_and_reopen(tmp_path):
+    days = pd.bdate_range('2024-01-02', periods=30)
+    close = _matrix(30, 3)
+    store = BarStore.create(str(tmp_path), SYMBOLS, fields=['close', 'volume'])
+    store.append(days[:20], {'close': close[:20], 'volume': close[:20] * 100})
+    store.append(days[20:], {'close': close[20:], 'volume': close[20:] * 100})
+
+    reopened = BarStore(str(tmp_path))
+    assert reopened.frequency == 'daily' and reopened.n_days == 30
+    np.testing.assert_array_equal(reopened.column('close'), close)
+    frame = reopened.frame('close')
+    assert (frame.index == days).all() and list(frame.columns) == SYMBOLS
+
+    np.testing.assert_array_equal(reopened.window('close', count=5), close[-5:])
+    np.testing.assert_array_equal(reopened.window('close', start='2024-01-05', end=20240110), close[3:7])
+    sub = reopened.window('volume', symbols=['600519.SS', 'missing'], count=2)
+    np.testing.assert_array_equal(sub[:, 0], close[-2:, 2] * 100)
+    assert np.isnan(sub[:, 1]).all()
+
+
+def test_append_rejects_non_increasing_days(tmp_path):
+    store = BarStore.create(str(tmp_path), SYMBOLS, fields=['close'])
+    store.append(['2024-01-02', '2024-01-03'], {'close': _matrix(2, 3)})
+    with pytest.raises(ValueError):
+        store.append(['2024-01-03'], {'close': _matrix(1, 3)})
+    assert store.n_days == 2
+
+
+def test_frame_columns_register_new_symbols(tmp_path):
+    store = BarStore.create(str(tmp_path), SYMBOLS[:1], fields=['close'], symbol_capacity=1)
+    store.append(['2024-01-02'], {'close': pd.DataFrame([[1.0]], columns=SYMBOLS[:1])})
+    store.append(['2024-01-03'], {'close': pd.DataFrame([[2.0, 3.0]], columns=SYMBOLS[:2])})
+    assert store.symbols == SYMBOLS[:2]
+    np.testing.assert_array_equal(store.window('close'), [[1.0, np.nan], [2.0, 3.0]])
+
+
+@pytest.fixture
+def minute_store(tmp_path):
+    # 两个交易日，每日上午 09:31-11:30 共 120 根分钟K线
+    times = pd.DatetimeIndex([t for day in ('2024-01-02', '2024-01-03')
+                              for t in pd.date_range(f'{day} 09:31', periods=120, freq='min')])
+    close = _matrix(len(times), 3, seed=1)
+    store = BarStore.create(str(tmp_path), SYMBOLS, fields=['close'], frequency='minute')
+    # 同一交易日分多次追加
+    for lo, hi in ((0, 60), (60, 120), (120, 240)):
+        store.append(times[lo:hi], {'close': close[lo:hi]})
+    return store, times, close
+
+
+def test_minute_append_keeps_time_of_day(minute_store):
+    store, times, close = minute_store
+    reopened = BarStore(store.path)
+    assert reopened.frequency == 'minute' and reopened.time_dtype == np.int64
+    assert reopened.days[0] == 202401020931 and reopened.days[-1] == 202401031130
+    np.testing.assert_array_equal(reopened.column('close'), close)
+    with open(os.path.join(store.path, 'meta.json'), encoding='utf-8') as f:
+        assert json.load(f)['frequency'] == 'minute'
+    with pytest.raises(ValueError):
+        store.append(['2024-01-03 11:30'], {'close': _matrix(1, 3)})
+
+
+def test_minute_frame_index_has_times(minute_store):
+    store, times, close = minute_store
+    frame = store.frame('close', symbols=SYMBOLS[1:])
+    assert (frame.index == times).all()
+    np.testing.assert_array_equal(frame.values, close[:, 1:])
+
+
+def test_minute_date_bounds_cover_whole_days(minute_store):
+    store, times, close = minute_store
+    np.testing.assert_array_equal(store.window('close', end='2024-01-02'), close[:120])
+    np.testing.assert_array_equal(store.window('close', start=20240103), close[120:])
+    np.testing.assert_array_equal(store.window('close', start='2024-01-02', end='2024-01-02'), close[:120])
+    np.testing.assert_array_equal(store.window('close', end='2024-01-02', count=10), close[110:120])
+
+
+def test_minute_time_bounds(minute_store):
+    store, times, close = minute_store
+    window = store.window('close', start='2024-01-02 10:00', end=pd.Timestamp('2024-01-02 10:09'))
+    np.testing.assert_array_equal(window, close[29:39])
+    np.testing.assert_array_equal(store.window('close', start=202401031121), close[-10:])
@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+SCRIPTS = ['02_four_stirrers_ptrade.py', '03_multi_factor.py']
+
+
+class Py38Executor(ThreadPoolExecutor):
+    """Python 3.8 的线程池：shutdown 没有 cancel_futures 参数"""
+
+    def shutdown(self, wait=True):
+        super().shutdown(wait=wait)
+
+
+@pytest.fixture(params=SCRIPTS)
+def fetcher(request, ptrade_script, monkeypatch):
+    ns = ptrade_script(request.param)
+    monkeypatch.setitem(ns, 'ThreadPoolExecutor', Py38Executor)
+    return ns['ConcurrentFetcher'](max_workers=4, timeout=0.2, retries=2, backoff=0.01)
+
+
+def test_results_keep_input_order_and_failures_are_retried(fetcher):
+    calls = {}
+
+    def flaky(x):
+        calls[x] = calls.get(x, 0) + 1
+        if x % 3 == 0 and calls[x] == 1:
+            raise ConnectionError('reset')
+        time.sleep(0.01 * (x % 4))
+        return x * 10
+
+    assert fetcher.map(flaky, range(10)) == [x * 10 for x in range(10)]
+    assert fetcher.counts['retries'] == 4
+    assert fetcher.counts['errors'] == 0
+
+
+def test_item_arg_and_shared_kwargs(fetcher):
+    def get(count, security_list=None):
+        return (count, tuple(security_list))
+
+    chunks = [['a', 'b'], ['c']]
+    assert fetcher.map(get, chunks, item_arg='security_list', count=5) == [(5, ('a', 'b')), (5, ('c',))]
+
+
+def test_permanent_failure_returns_none(fetcher):
+    def broken(x):
+        if x == 2:
+            raise ValueError('bad')
+        return x
+
+    assert fetcher.map(broken, range(4)) == [0, 1, None, 3]
+    assert fetcher.counts['errors'] == 1
+
+
+def test_hung_calls_do_not_block_forever(fetcher):
+    # 所有线程都卡在不返回的调用上：排队的项在总时限内失败，map 返回，之后换用新线程池
+    release = threading.Event()
+    budget = fetcher.timeout * (fetcher.retries + 1) + fetcher.backoff * (2 ** fetcher.retries - 1)
+    try:
+        start = time.monotonic()
+        results = fetcher.map(lambda x: release.wait(), range(12))
+        elapsed = time.monotonic() - start
+        assert results == [None] * 12
+        assert elapsed < budget + 1.0
+        assert fetcher.counts['errors'] == 12
+        assert fetcher.map(lambda x: x + 1, range(6)) == [1, 2, 3, 4, 5, 6]
+    finally:
+        release.set()
+
+
+def test_imap_yields_as_completed(fetcher):
+    order = [item for item, _ in fetcher.imap(lambda x: time.sleep(0.05 * (3 - x)) or x, range(4))]
+    assert sorted(order) == [0, 1, 2, 3]
+    assert order[0] == 3
+
+
+def test_discarded_pool_cancels_queued_calls(fetcher):
+    # 线程全部卡住时关闭线程池：排队的调用被取消，放开后也不会再执行
+    release = threading.Event()
+    ran = []
+    pool = fetcher._executor()
+    busy = [pool.submit(release.wait) for _ in range(fetcher.max_workers)]
+    queued = [pool.submit(ran.append, x) for x in range(3)]
+    try:
+        fetcher._futures.update(busy + queued)
+        fetcher._discard_pool()
+    finally:
+        release.set()
+    assert fetcher._pool is None and not fetcher._futures
+    assert all(future.cancelled() for future in queued)
+    for future in busy:
+        future.result(timeout=1)
+    assert ran == []
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+SCRIPTS = ['02_four_stirrers_ptrade.py', '03_multi_factor.py']
+
+
+@pytest.fixture(params=SCRIPTS)
+def tracker(request, ptrade_script):
+    return ptrade_script(request.param)['ConstituentTracker']()
+
+
+def test_verdicts_compute_only_missing_stocks(tracker):
+    calls = []
+
+    def compute(stocks):
+        calls.append(list(stocks))
+        return [len(stock) for stock in stocks]
+
+    assert tracker.verdicts('size', ['a', 'bb', 'a'], compute).tolist() == [1, 2, 1]
+    assert tracker.verdicts('size', ['bb', 'ccc'], compute).tolist() == [2, 3]
+    assert calls == [['a', 'bb'], ['ccc']]
+    tracker.forget(['bb'])
+    tracker.verdicts('size', ['bb'], compute)
+    assert calls[-1] == ['bb']
+
+
+def test_verdicts_retry_unknown_results(tracker):
+    answers = {'a': [None, 1], 'b': [2]}
+    calls = []
+
+    def compute(stocks):
+        calls.append(list(stocks))
+        return [answers[stock].pop(0) for stock in stocks]
+
+    assert tracker.verdicts('flaky', ['a', 'b'], compute).tolist() == [None, 2]
+    assert tracker.verdicts('flaky', ['a', 'b'], compute).tolist() == [1, 2]
+    assert calls == [['a', 'b'], ['a']]
+    assert tracker.verdicts('flaky', ['a', 'b'], compute).tolist() == [1, 2]
+    assert len(calls) == 2
+
+
+def test_failed_listed_date_lookup_is_retried(ptrade_script, monkeypatch):
+    ns = ptrade_script('02_four_stirrers_ptrade.py')
+    monkeypatch.setitem(ns, '_constituents', ns['ConstituentTracker']())
+    listed = {'600000.SS': '1999-11-10', '688999.SS': '2024-06-03'}
+    down = {'688999.SS'}
+    requested = []
+
+    def get_stock_info(stocks, field=None):
+        requested.append(list(stocks))
+        return {stock: {'listed_date': listed[stock]} for stock in stocks if stock not in down}
+
+    monkeypatch.setitem(ns, 'get_stock_info', get_stock_info)
+    stocks = ['600000.SS', '688999.SS']
+    first = ns['get_listed_dates'](stocks)
+    assert first[0] == np.datetime64('1999-11-10') and np.isnat(first[1])
+
+    down.clear()
+    second = ns['get_listed_dates'](stocks)
+    np.testing.assert_array_equal(second, np.array(['1999-11-10', '2024-06-03'], dtype='datetime64[D]'))
+    assert requested == [stocks, ['688999.SS']]
@@ -0,0 +1,119 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+dma = importlib.import_module('01_dual_moving_average')
+
+WINDOWS = [(5, 20), (10, 60), (60, 20), (20, 60)]
+
+
+def _price_series():
+    rng = np.random.default_rng(7)
+    yield 'constant', np.full(120, 10.1)
+    yield 'plateaus', np.repeat([10.1, 10.2, 10.1, 9.87, 9.87, 10.3], 25)
+    yield 'alternating', np.tile([10.1, 10.2], 80)
+    yield 'random_walk', np.round(10 + rng.standard_normal(300).cumsum() * 0.1, 2)
+    yield 'random_plateaus', _plateaus(rng, 300)
+
+
+def _plateaus(rng, n):
+    """分价随机游走，价格常常连续多根不变 (一字板、停滞)"""
+    steps = rng.choice([-0.01, 0.0, 0.01], size=n, p=[0.2, 0.6, 0.2])
+    steps[rng.random(n) < 0.05] *= 20
+    return np.round(10 + steps.cumsum(), 2)
+
+
+def _stream(closes, short_window, long_window):
+    stream = dma.DualMovingAverageStream(1, short_window, long_window)
+    signal, positions, short_mavg, long_mavg = [], [], [], []
+    for close in closes:
+        positions.append(stream.update(close)[0])
+        signal.append(stream.signal[0])
+        short_mavg.append(stream.short_mavg[0])
+        long_mavg.append(stream.long_mavg[0])
+    return np.array(signal), np.array(positions), np.array(short_mavg), np.array(long_mavg)
+
+
+@pytest.mark.parametrize('short_window,long_window', WINDOWS)
+@pytest.mark.parametrize('name,closes', list(_price_series()), ids=lambda v: v if isinstance(v, str) else '')
+def test_stream_matches_batch(name, closes, short_window, long_window):
+    data = pd.DataFrame({'Close': closes}, index=pd.date_range('2024-01-01', periods=len(closes)))
+    batch = dma.DualMovingAverageStrategy(short_window, long_window).generate_signals(data)
+    signal, positions, short_mavg, long_mavg = _stream(closes, short_window, long_window)
+
+    np.testing.assert_array_equal(short_mavg, batch['short_mavg'].to_numpy())
+    np.testing.assert_array_equal(long_mavg, batch['long_mavg'].to_numpy())
+    np.testing.assert_array_equal(signal, batch['signal'].to_numpy())
+    np.testing.assert_array_equal(positions, batch['positions'].fillna(0).to_numpy())
+
+
+def test_constant_prices_never_cross():
+    _, positions, _, _ = _stream(np.full(60, 10.1), 5, 20)
+    assert not positions.any()
+
+
+def test_stream_tracks_symbols_independently():
+    closes = np.column_stack([series[:120] for _, series in _price_series()])
+    stream = dma.DualMovingAverageStream(closes.shape[1], 5, 20)
+    panel = np.array([stream.update(row) for row in closes])
+    for j in range(closes.shape[1]):
+        np.testing.assert_array_equal(panel[:, j], _stream(closes[:, j], 5, 20)[1])
+
+
+SWEEP_PAIRS = [(short, long) for short in (1, 2, 3, 5, 8, 10, 13, 20) for long in (5, 10, 20, 30, 60)]
+
+
+@pytest.mark.parametrize('name,closes', list(_price_series()), ids=lambda v: v if isinstance(v, str) else '')
+def test_sweep_matches_generate_signals(name, closes):
+    data = pd.DataFrame({'Close': closes}, index=pd.date_range('2024-01-01', periods=len(closes)))
+    signals, positions = dma.DualMovingAverageStrategy.sweep_signals(data, SWEEP_PAIRS)
+    for k, (short_window, long_window) in enumerate(SWEEP_PAIRS):
+        batch = dma.DualMovingAverageStrategy(short_window, long_window).generate_signals(data)
+        np.testing.assert_array_equal(signals[k], batch['signal'].to_numpy(), err_msg=str((short_window, long_window)))
+        np.testing.assert_array_equal(positions[k], batch['positions'].fillna(0).to_numpy())
+
+
+def test_sweep_skips_missing_closes_like_rolling():
+    closes = _plateaus(np.random.default_rng(3), 200)
+    closes[[0, 17, 18, 19, 90]] = np.nan
+    data = pd.DataFrame({'Close': closes})
+    signals, _ = dma.DualMovingAverageStrategy.sweep_signals(data, [(5, 20), (3, 10)])
+    for k, (short_window, long_window) in enumerate([(5, 20), (3, 10)]):
+        batch = dma.DualMovingAverageStrategy(short_window, long_window).generate_signals(data)
+        np.testing.assert_array_equal(signals[k], batch['signal'].to_numpy())
+
+
+def _suspended_panel(n_bars=250, n_symbols=40):
+    rng = np.random.default_rng(11)
+    close = np.column_stack([_plateaus(rng, n_bars) for _ in range(n_symbols)])
+    close[rng.random(close.shape) < 0.05] = np.nan               # 零星停牌
+    close[60:90, 0] = np.nan                                     # 长期停牌
+    close[:120, 1] = np.nan                                      # 中途上市
+    close[200:, 2] = np.nan                                      # 退市
+    close[:, 3] = np.nan                                         # 全程无数据
+    return pd.DataFrame(close, index=pd.date_range('2024-01-01', periods=n_bars, freq='B'),
+                        columns=[f'S{j:02d}' for j in range(n_symbols)])
+
+
+@pytest.mark.parametrize('short_window,long_window', [(5, 20), (10, 60), (1, 5)])
+def test_panel_matches_per_symbol_dropna(short_window, long_window):
+    close = _suspended_panel()
+    strategy = dma.DualMovingAverageStrategy(short_window, long_window)
+    panel = strategy.generate_panel_signals(close, return_mavg=True)
+
+    for j, code in enumerate(close.columns):
+        valid = close[code].notna().to_numpy()
+        batch = strategy.generate_signals(close[[code]].rename(columns={code: 'Close'}).dropna())
+        np.testing.assert_array_equal(panel.short_mavg[valid, j], batch['short_mavg'].to_numpy(), err_msg=code)
+        np.testing.assert_array_equal(panel.long_mavg[valid, j], batch['long_mavg'].to_numpy(), err_msg=code)
+        np.testing.assert_array_equal(panel.signal[valid, j], batch['signal'].to_numpy(), err_msg=code)
+        np.testing.assert_array_equal(panel.positions[valid, j], batch['positions'].fillna(0).to_numpy(), err_msg=code)
+
+        # 停牌日：均线为 NaN、不产生指令，持仓状态沿用停牌前最后一根有效K线
+        assert np.isnan(panel.short_mavg[~valid, j]).all()
+        assert not panel.positions[~valid, j].any()
+        held = pd.Series(np.where(valid, panel.signal[:, j], np.nan)).ffill().fillna(0).to_numpy()
+        np.testing.assert_array_equal(panel.signal[:, j], held, err_msg=code)
+
@@ -0,0 +1,75 @@
+import datetime
+import types
+
+import numpy as np
+import pytest
+
+STOCKS = ['600000.SS', '600001.SS', '600002.SS']
+LIMIT = np.array([11.0, 22.0, 33.0])
+
+
+@pytest.fixture
+def script(ptrade_script, monkeypatch):
+    ns = ptrade_script('02_four_stirrers_ptrade.py')
+    quotes = types.SimpleNamespace(last=LIMIT.copy())
+    cache = types.SimpleNamespace(lookup=lambda codes, now: (quotes.last.copy(), LIMIT.copy(), LIMIT * 0.8))
+    monkeypatch.setitem(ns, '_quote_cache', cache)
+    monkeypatch.setitem(ns, '_limit_up_monitor', ns['LimitUpMonitor'](capacity=8))
+    monkeypatch.setattr(ns['g'], 'yesterday_HL_list', STOCKS, raising=False)
+    ns['_limit_up_monitor'].track(STOCKS)
+    return ns, quotes
+
+
+def _context(hour, minute):
+    now = datetime.datetime(2024, 1, 3, hour, minute)
+    return types.SimpleNamespace(blotter=types.SimpleNamespace(current_dt=now))
+
+
+def test_poll_returns_open_stocks_until_marked_sold(script):
+    ns, quotes = script
+    monitor = ns['_limit_up_monitor']
+    now = datetime.datetime(2024, 1, 3, 10, 0)
+    assert monitor.poll(now) == []
+    quotes.last[1] = 21.0
+    assert monitor.poll(now) == ['600001.SS']
+    assert monitor.poll(now) == ['600001.SS']       # 未记录卖出时继续返回
+    monitor.mark_sold(['600001.SS'])
+    assert monitor.poll(now) == []
+    state = monitor.state()
+    assert state.loc['600001.SS', 'opened'] and state.loc['600001.SS', 'sold']
+    assert state.loc['600001.SS', 'open_time'] == 36000
+
+
+def test_rejected_sell_is_retried_by_the_fallback_check(script, monkeypatch):
+    ns, quotes = script
+    results = iter([False, True])
+    orders = []
+
+    def close_position(stock):
+        orders.append(stock)
+        return next(results)
+
+    monkeypatch.setitem(ns, 'close_position', close_position)
+    quotes.last[0] = 10.5
+    ns['monitor_limit_up'](_context(10, 0))         # 卖出被拒
+    assert not ns['_limit_up_monitor'].state().loc['600000.SS', 'sold']
+    ns['check_limit_up'](_context(14, 0))           # 14:00 兜底再次卖出
+    assert orders == ['600000.SS', '600000.SS']
+    assert ns['_limit_up_monitor'].state().loc['600000.SS', 'sold']
+    ns['check_limit_up'](_context(14, 0))
+    assert orders == ['600000.SS', '600000.SS']
+
+
+def test_reseal_is_counted_and_missing_quotes_keep_state(script):
+    ns, quotes = script
+    monitor = ns['_limit_up_monitor']
+    now = datetime.datetime(2024, 1, 3, 10, 0)
+    quotes.last[2] = 32.0
+    monitor.poll(now)
+    quotes.last[2] = 33.0
+    monitor.poll(now)
+    quotes.last[2] = np.nan
+    monitor.poll(now)
+    state = monitor.state()
+    assert state.loc['600002.SS', 'reseals'] == 1
+    assert state.loc['600002.SS', 'sealed']
@@ -0,0 +1,125 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+WINDOW = 20
+CODES = ['801010', '801030', '801080', '801150', '801780']
+
+
+def _baseline_ratios(close, industry_codes, t, window=WINDOW):
+    """原实现的市场宽度：取截至 t 日的 window + 1 天收盘价，剔除有缺失的股票，rolling 均线后按行业 groupby"""
+    df_close = pd.DataFrame(close[t - window:t + 1].T).dropna(axis=0)
+    df_ma = df_close.T.rolling(window=window).mean().T.iloc[:, -1:]
+    df_bias = df_close.iloc[:, -1:] > df_ma
+    known = industry_codes >= 0
+    df_bias['industry_code'] = pd.Series(np.array(CODES, dtype=object)[industry_codes[known]],
+                                         index=np.flatnonzero(known))
+    df_ratio = ((df_bias.groupby('industry_code').sum() * 100.0) / df_bias.groupby('industry_code').count()).round()
+    return df_ratio.iloc[:, -1].reindex(CODES).to_numpy(dtype=float)
+
+
+def _market(n_days=100, n_stocks=300, seed=0):
+    """分价行情，价格常常连续多日不变或回到均线，含零星停牌"""
+    rng = np.random.default_rng(seed)
+    steps = rng.choice([-0.01, 0.0, 0.01], size=(n_days, n_stocks), p=[0.25, 0.5, 0.25])
+    steps[rng.random(steps.shape) < 0.05] *= 30
+    close = np.round(np.abs(10 + steps.cumsum(axis=0)) + 1, 2)
+    close[rng.random(close.shape) < 0.003] = np.nan
+    close[:, 0] = 7.77                                            # 一字板
+    industry_codes = rng.integers(-1, len(CODES), n_stocks).astype(np.int32)
+    return close, industry_codes
+
+
+@pytest.fixture(scope='module')
+def breadth(ptrade_script):
+    return ptrade_script('02_four_stirrers_ptrade.py')['MarketBreadth']
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_update_matches_baseline_rolling(breadth, seed):
+    close, industry_codes = _market(seed=seed)
+    engine = breadth(industry_codes, CODES, window=WINDOW)
+    engine.update_many(close)
+    history = np.array(engine.history)
+    assert np.isnan(history[:WINDOW]).all()
+    for t in range(WINDOW, len(close)):
+        np.testing.assert_array_equal(history[t], _baseline_ratios(close, industry_codes, t), err_msg=str(t))
+
+
+def test_reindex_keeps_windows_and_backfills_added_stocks(breadth):
+    close, industry_codes = _market(n_days=80, n_stocks=60, seed=4)
+    keep, add = np.arange(0, 40), np.arange(40, 60)
+    engine = breadth(industry_codes[keep], CODES, window=WINDOW)
+    engine.update_many(close[:50, keep])
+
+    # 新股票池：保留的股票换了顺序，新加入的股票只补最近 window + 1 天收盘价
+    stocks = np.concatenate([keep[::-1], add])
+    rows = [len(keep) - 1 - i for i in range(len(keep))] + [-1] * len(add)
+    engine.reindex(rows, industry_codes[stocks], CODES, close[50 - WINDOW - 1:50, add])
+    np.testing.assert_array_equal(engine.ratios, _baseline_ratios(close[:, stocks], industry_codes[stocks], 49))
+    engine.update_many(close[50:, stocks])
+    for t in range(50, 80):
+        np.testing.assert_array_equal(engine.history[t], _baseline_ratios(close[:, stocks], industry_codes[stocks], t))
+
+
+def test_rolling_last_mean_matches_pandas(ptrade_script):
+    rolling_last_mean = ptrade_script('02_four_stirrers_ptrade.py')['_rolling_last_mean']
+    rng = np.random.default_rng(5)
+    block = np.round(10 + rng.choice([-0.01, 0.0, 0.01], size=(WINDOW + 1, 500)).cumsum(axis=0), 2)
+    block[:, :20] = np.round(rng.uniform(5, 50, 20), 2)
+    expected = pd.DataFrame(block).rolling(WINDOW).mean().iloc[-1].to_numpy()
+    np.testing.assert_array_equal(rolling_last_mean(block, WINDOW), expected)
+
+
+def test_research_breadth_matches_engine_history(breadth):
+    research = importlib.import_module('research_four_stirrers')
+    close, _ = _market(n_days=120, seed=3)
+    industry = np.random.default_rng(3).integers(-1, len(research.INDUSTRY_CODES), close.shape[1])
+    engine = breadth(industry, research.INDUSTRY_CODES, window=WINDOW)
+    engine.update_many(close)
+    panel = research.breadth_panel(close, np.ones(close.shape, dtype=bool), industry, WINDOW)
+    # 研究模式第 t 行为 t-1 日的宽度
+    np.testing.assert_array_equal(panel[1:], np.array(engine.history)[:-1])
+    assert np.isnan(panel[:WINDOW + 1]).all()
+
+
+def _fake_get_price(frame):
+    """按交易日历取最近 count 天；停牌 (NaN) 的日期不返回，单只股票时返回不带 code 列的时间序列表"""
+    def get_price(stocks, start_date=None, end_date=None, frequency='1d', fields=None, count=None):
+        stocks = [stocks] if isinstance(stocks, str) else list(stocks)
+        days = frame.index[frame.index <= pd.Timestamp(end_date)]
+        if start_date is not None:
+            days = days[days >= pd.Timestamp(start_date)]
+        if count is not None:
+            days = days[-count:]
+        parts = [pd.DataFrame({'code': stock, 'close': frame.loc[days, stock]}).dropna() for stock in stocks]
+        if len(stocks) == 1:
+            return parts[0][['close']]
+        return pd.concat(parts)
+    return get_price
+
+
+def test_pool_change_aligns_single_added_stock_to_engine_dates(ptrade_script, monkeypatch):
+    ns = ptrade_script('02_four_stirrers_ptrade.py')
+    close, industry_codes = _market(n_days=90, n_stocks=40, seed=6)
+    stocks = [f'{600000 + j}.SS' for j in range(40)]
+    frame = pd.DataFrame(close, index=pd.bdate_range('2024-01-01', periods=len(close)), columns=stocks)
+    frame.iloc[:, 39] = np.round(np.linspace(8, 12, len(close)), 2)
+    frame.iloc[[52, 55], 39] = np.nan                              # 新加入股票在补数窗口内停牌
+    industry = dict(zip(stocks, industry_codes))
+    monkeypatch.setitem(ns, 'get_price', _fake_get_price(frame))
+    monkeypatch.setitem(ns, 'get_industry_codes',
+                        lambda stock_list, date: (np.array([industry[s] for s in stock_list], dtype=np.int32), CODES))
+    monkeypatch.setitem(ns, '_breadth_state', {'engine': None, 'stocks': None, 'last_date': None})
+
+    old_pool, new_pool = stocks[:39], stocks[2:]                   # 剔除 2 只，只新增 1 只
+    ns['update_market_breadth'](old_pool, frame.index[49], window=WINDOW)
+    ns['update_market_breadth'](old_pool, frame.index[59], window=WINDOW)
+    engine = ns['update_market_breadth'](new_pool, frame.index[89], window=WINDOW)
+
+    reference = ns['MarketBreadth'](industry_codes[2:], CODES, window=WINDOW)
+    reference.update_many(frame[new_pool].to_numpy()[:90])
+    np.testing.assert_array_equal(np.array(engine.history[-30:]), np.array(reference.history[-30:]))
+    assert list(engine.dates[-30:]) == list(frame.index[60:90])
@@ -0,0 +1,41 @@
+# PTrade 策略须为单个文件，02 与 03 共用的类与函数各保留一份，标有 "# 镜像代码" 注释；
+# 这里检查两个文件中标记的定义集合相同且逐字一致
+import ast
+import os
+
+import pytest
+
+STRATEGIES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'strategies')
+SCRIPTS = ['02_four_stirrers_ptrade.py', '03_multi_factor.py']
+MARKER = '# 镜像代码'
+
+
+def _mirrored(filename):
+    """文件中紧跟镜像注释的顶层定义: {名称: 源码}"""
+    with open(os.path.join(STRATEGIES_DIR, filename), encoding='utf-8') as f:
+        source = f.read().replace('\r\n', '\n')
+    lines = source.split('\n')
+    found = {}
+    for node in ast.parse(source).body:
+        if not isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            continue
+        start = node.lineno - 1
+        comments = []
+        while start > 0 and lines[start - 1].startswith('#'):
+            start -= 1
+            comments.append(lines[start])
+        if any(line.startswith(MARKER) for line in comments):
+            found[node.name] = '\n'.join(lines[node.lineno - 1:node.end_lineno])
+    return found
+
+
+def test_both_scripts_mark_the_same_definitions():
+    names = [set(_mirrored(filename)) for filename in SCRIPTS]
+    assert names[0] == names[1]
+    assert {'ConstituentTracker', 'ConcurrentFetcher', 'plan_rebalance', 'get_fundamentals_cached'} <= names[0]
+
+
+@pytest.mark.parametrize('name', sorted(_mirrored(SCRIPTS[0])))
+def test_mirrored_definitions_are_identical(name):
+    first, second = (_mirrored(filename).get(name) for filename in SCRIPTS)
+    assert first == second, f'{name} 在 {SCRIPTS[0]} 与 {SCRIPTS[1]} 中不一致'
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+
+def _baseline_get_rank(r):
+    """原实现的 getRank：逐列冒泡交换排序，排序后的位置即排名，再换回原顺序"""
+    indexes = list(range(len(r)))
+    for k in range(len(r[0])):
+        for i in range(len(r)):
+            for j in range(i):
+                if r[j][k] < r[i][k]:
+                    indexes[j], indexes[i] = indexes[i], indexes[j]
+                    for l in range(len(r[0])):
+                        r[j][l], r[i][l] = r[i][l], r[j][l]
+        for i in range(len(r)):
+            r[i][k] = i + 1
+    for i in range(len(r)):
+        for j in range(i):
+            if indexes[j] > indexes[i]:
+                indexes[j], indexes[i] = indexes[i], indexes[j]
+                for k in range(len(r[0])):
+                    r[j][k], r[i][k] = r[i][k], r[j][k]
+    return r
+
+
+def _baseline_bubble(numbers, indexes):
+    """原实现的 bubble：按得分从高到低交换排序"""
+    indexes = list(indexes)
+    for i in range(len(numbers)):
+        for j in range(i):
+            if numbers[j][0] < numbers[i][0]:
+                numbers[j][0], numbers[i][0] = numbers[i][0], numbers[j][0]
+                indexes[j], indexes[i] = indexes[i], indexes[j]
+    return numbers, indexes
+
+
+def _baseline_picks(factors, weights, stocks, n):
+    """原实现 handle_data 的选股：排名、np.dot 打分、bubble 排序后取前 n 名"""
+    ranks = _baseline_get_rank(factors.tolist())
+    points = np.dot(ranks, weights)
+    _, stock_sort = _baseline_bubble(points, stocks)
+    return stock_sort[0:min(n, len(stock_sort))]
+
+
+@pytest.fixture(scope='module')
+def ns(ptrade_script):
+    return ptrade_script('03_multi_factor.py')
+
+
+@pytest.mark.parametrize('weights', [[[1], [-0.7071]], [[0.3137], [1.0719], [-2.2903]]])
+def test_picks_match_baseline_on_tie_free_input(ns, weights):
+    rng = np.random.default_rng(8)
+    for _ in range(30):
+        n_stocks = int(rng.integers(2, 60))
+        factors = rng.normal(size=(n_stocks, len(weights)))
+        stocks = [f'{600000 + j}.SS' for j in range(n_stocks)]
+        ranks = ns['getRank'](factors)
+        np.testing.assert_array_equal(ranks, _baseline_get_rank(factors.tolist()))
+
+        scores = ns['composite_score'](ranks, weights)
+        assert len(np.unique(scores)) == n_stocks
+        for n in [1, 5, 20, n_stocks + 3]:
+            assert ns['select_top_n'](scores, stocks, n) == _baseline_picks(factors, weights, stocks, n)
+
+
+def test_ties_get_average_rank_and_keep_stock_order(ns):
+    # 并列的因子值（如 NaN 用均值填充后）取平均排名；同分的股票按原顺序入选，原实现的结果取决于交换顺序
+    factors = np.array([[3.0], [5.0], [3.0], [np.nan], [1.0]])
+    ns['fillNan'](factors)
+    assert ns['getRank'](factors)[:, 0].tolist() == [3.0, 1.0, 3.0, 3.0, 5.0]
+    assert ns['select_top_n'](np.array([2.0, 4.0, 2.0, 2.0]), ['a', 'b', 'c', 'd'], 3) == ['b', 'a', 'c']
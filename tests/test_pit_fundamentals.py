@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pit_fundamentals import PointInTimeTable, to_numeric
+
+CODES = ['000001.SZ', '000002.SZ', '600000.SS', '600519.SS']
+
+
+def _naive_asof(frame, codes, date, fields):
+    """逐股票筛出公告日不晚于 date 的记录，取公告日最新（同日取报告期最新）的一条"""
+    day = pd.Timestamp(date)
+    rows = {}
+    for code in codes:
+        seen = frame[(frame['code'] == code) & (pd.to_datetime(frame['date']) <= day)]
+        if len(seen):
+            seen = seen.assign(_d=pd.to_datetime(seen['date']), _e=pd.to_datetime(seen['end_date']))
+            rows[code] = seen.sort_values(['_d', '_e']).iloc[-1][fields]
+    out = pd.DataFrame(index=pd.Index(codes, name='code'), columns=fields, dtype=float)
+    for code, row in rows.items():
+        out.loc[code] = [to_numeric(pd.Series([v]))[0] for v in row]
+    return out
+
+
+@pytest.fixture(scope='module')
+def frame():
+    rng = np.random.default_rng(12)
+    n = 200
+    dates = pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 700, n), unit='D')
+    end_dates = pd.to_datetime(['2021-12-31', '2022-03-31', '2022-06-30', '2022-09-30'])[rng.integers(0, 4, n)]
+    return pd.DataFrame({
+        'date': dates.strftime('%Y-%m-%d'),
+        'code': np.array(CODES)[rng.integers(0, len(CODES), n)],
+        'end_date': end_dates.strftime('%Y-%m-%d'),
+        'roe': rng.normal(10, 5, n).round(3),
+        'margin': [f'{v:.2f}%' for v in rng.uniform(-20, 60, n)],
+    })
+
+
+def test_asof_matches_naive_filter(frame):
+    table = PointInTimeTable(frame)
+    codes = CODES[::-1] + ['300750.SZ']                # 含表中没有的股票
+    for date in ['2021-12-31', '2022-01-01', '2022-05-17', '2023-02-28', '2024-06-30']:
+        expected = _naive_asof(frame, codes, date, ['roe', 'margin'])
+        actual = table.asof(codes, date, fields=['roe', 'margin'])
+        pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_asof_same_day_takes_latest_report_period():
+    frame = pd.DataFrame({
+        'date': ['2023-04-28', '2023-04-28', '2023-08-30'],
+        'code': ['600000.SS'] * 3,
+        'end_date': ['2023-03-31', '2022-12-31', '2023-06-30'],
+        'roe': [3.0, 12.0, 6.0],
+    })
+    table = PointInTimeTable(frame)
+    assert table.asof(['600000.SS'], '2023-04-27')['roe'].isna().all()
+    assert table.asof(['600000.SS'], '2023-04-28')['roe'].tolist() == [3.0]
+    assert table.asof(['600000.SS'], 20230830)['roe'].tolist() == [6.0]
+
+
+def test_asof_parses_percent_strings_and_unknown_fields(frame):
+    table = PointInTimeTable(frame)
+    out = table.asof(CODES, '2024-01-01', fields=['margin', 'missing'])
+    assert out['margin'].dtype == np.float64 and out['margin'].notna().all()
+    assert out['missing'].isna().all()
+
+
+def test_panel_matches_asof(frame):
+    table = PointInTimeTable(frame)
+    codes = CODES + ['300750.SZ']
+    dates = pd.date_range('2021-12-25', '2024-01-10', freq='37D').strftime('%Y-%m-%d')
+    panel = table.panel(codes, dates, 'roe')
+    expected = np.vstack([table.asof(codes, date, fields=['roe'])['roe'].values for date in dates])
+    np.testing.assert_array_equal(panel, expected)
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture(params=['02_four_stirrers_ptrade.py', '03_multi_factor.py'])
+def plan_rebalance(request, ptrade_script):
+    return ptrade_script(request.param)['plan_rebalance']
+
+
+def _fee(value, ratio=0.0003, minimum=5.0):
+    return np.where(value > 0, np.maximum(value * ratio, minimum), 0.0)
+
+
+def test_sells_fund_buys_and_nan_target_is_left_alone(plan_rebalance):
+    plan, left = plan_rebalance(['A', 'B', 'C'], [1000, 0, 500], [5000, 8000, np.nan], [10.0, 20.0, 5.0], 10000)
+    assert plan['delta'].tolist() == [-500, 400, 0]
+    assert plan['target'].tolist() == [500, 400, 500]
+    # 卖出 5000 扣佣金 5、印花税 5；买入 8000 加佣金 5
+    assert left == pytest.approx(10000 + 5000 - 5 - 5 - 8000 - 5)
+
+
+def test_short_cash_scales_buys_then_tops_up_largest_shortfall(plan_rebalance):
+    plan, left = plan_rebalance(['A', 'B'], [0, 0], [30000, 30000], [10.0, 15.0], 40000)
+    # 按比例缩减为 1900/1300 股，剩余资金给缺口更大的 A 再补一手
+    assert plan['delta'].tolist() == [2000, 1300]
+    assert left == pytest.approx(40000 - 20000 - 6 - 19500 - 5.85)
+
+
+def test_min_commission_overshoot_is_trimmed(plan_rebalance):
+    plan, left = plan_rebalance(['A'], [0], [1000], [1.0], 100, lot=1)
+    # 按比例缩减后 99 股 + 最低佣金 5 超出资金，逐手撤回到 95 股
+    assert plan['delta'].tolist() == [95]
+    assert left == pytest.approx(0)
+
+
+def test_top_up_on_a_trimmed_stock_sells_one_lot_less(plan_rebalance):
+    plan, left = plan_rebalance(['A'], [1000], [5050], [10.0], 0)
+    # 减仓到 500 股后还有缺口，补一手即少卖一手，只按净卖出 400 股计费
+    assert plan['delta'].tolist() == [-400]
+    assert left == pytest.approx(4000 - 5 - 4)
+
+
+def test_odd_lot_holding_buys_whole_lots(plan_rebalance):
+    plan, left = plan_rebalance(['A'], [40], [14000], [10.0], 100000)
+    assert plan['delta'].tolist() == [1400]
+    assert left == pytest.approx(100000 - 14000 - 5)
+
+
+def test_sells_respect_sellable_and_locked(plan_rebalance):
+    plan, _ = plan_rebalance(['A', 'B', 'C'], [1000, 850, 600], [0, 0, 0], [10.0, 10.0, 10.0], 0,
+                             sellable=[300, 850, 600], locked=[False, False, True])
+    # A 只有 300 股可卖；B 清仓时零股一并卖出；C 锁定不动
+    assert plan['delta'].tolist() == [-300, -850, 0]
+
+
+def test_random_plans_stay_within_cash_and_lots(plan_rebalance):
+    rng = np.random.default_rng(7)
+    for _ in range(200):
+        n = int(rng.integers(1, 12))
+        amounts = rng.integers(0, 50, n) * 100 + rng.integers(0, 2, n) * rng.integers(1, 100, n)
+        prices = rng.uniform(2, 80, n).round(2)
+        prices[rng.random(n) < 0.1] = np.nan
+        targets = rng.uniform(0, 100000, n) * (rng.random(n) > 0.2)
+        targets[rng.random(n) < 0.1] = np.nan
+        sellable = np.minimum(amounts, rng.integers(0, 60, n) * 100)
+        locked = rng.random(n) < 0.1
+        cash = float(rng.uniform(0, 200000))
+
+        plan, left = plan_rebalance(list(range(n)), amounts, targets, prices, cash, sellable=sellable, locked=locked)
+        delta = plan['delta'].values
+        frozen = locked | ~(prices > 0) | np.isnan(targets)
+        assert (delta[frozen] == 0).all()
+        assert (-delta <= sellable).all()
+        sells, buys = np.maximum(-delta, 0), np.maximum(delta, 0)
+        assert (buys % 100 == 0).all()
+        assert ((sells % 100 == 0) | (sells == amounts)).all()
+
+        px = np.where(frozen, 0.0, prices)
+        sold = sells * px
+        expected = cash + np.sum(sold - _fee(sold) - sold * 0.001) - np.sum(buys * px + _fee(buys * px))
+        assert left == pytest.approx(expected, abs=1e-6)
+        assert left >= -1e-6
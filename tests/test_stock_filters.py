@@ -0,0 +1,10 @@
+import numpy as np
+
+
+def test_paused_and_st_filters_keep_original_signature(ptrade_script, monkeypatch):
+    ns = ptrade_script('02_four_stirrers_ptrade.py')
+    monkeypatch.setitem(ns, 'get_halt_flags', lambda stocks: np.array([s == 'b' for s in stocks]))
+    monkeypatch.setitem(ns, 'get_st_flags', lambda stocks: np.array([s == 'c' for s in stocks]))
+    assert ns['filter_paused_stock'](['a', 'b', 'c']) == ['a', 'c']
+    assert ns['filter_st_stock'](['a', 'b', 'c']) == ['a', 'b']
+    assert ns['filter_st_stock']([]) == []